@@ -0,0 +1,284 @@
+import datetime
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from sqlalchemy import exc, insert
+
+import model
+
+
+### Write-behind log ของ SearchHistory / VisitHistory
+# request แค่ put ลง queue (ไม่รอ DB) -> thread เขียนเป็น batch (executemany) เมื่อครบ size หรือครบเวลา
+# ตอน shutdown (lifespan) flush ที่ค้างทั้งหมดก่อนปิด
+# query ที่ค้นหา -> count-min sketch + heavy hitters ต่อช่วงเวลา (trending / autocomplete ไม่ต้อง GROUP BY)
+# แถวเสีย (เช่นผิด FK) -> แบ่ง batch ครึ่งๆ จนเจอแถวที่ผิดแล้วกักไว้ (quarantine) / DB ล่ม -> เก็บ batch ไว้ลองใหม่
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_BATCH_SIZE = int(os.getenv("ACTIVITY_BATCH_SIZE", "500"))
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "1.0"))
+ACTIVITY_MAX_PENDING = int(os.getenv("ACTIVITY_MAX_PENDING", "100000"))
+TRENDING_WINDOW_SECONDS = int(os.getenv("TRENDING_WINDOW_SECONDS", "300"))
+TRENDING_WINDOWS = int(os.getenv("TRENDING_WINDOWS", "288")) # 288 x 5 นาที = 1 วัน
+ACTIVITY_QUARANTINE_SIZE = int(os.getenv("ACTIVITY_QUARANTINE_SIZE", "1000"))
+# error ของตัวข้อมูล (ลองใหม่ก็ fail ซ้ำ) -> หาแถวที่ผิด / อย่างอื่น (connection, timeout) -> ลองใหม่ทั้ง batch
+_ROW_ERRORS = (exc.IntegrityError, exc.DataError)
+
+
+def normalize_query(text):
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+##### Count-min sketch + heavy hitters
+
+class CountMinSketch:
+    """Approximate counts in ``depth`` x ``width`` counters; never underestimates."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+
+    def _columns(self, item):
+        # double hashing: h1 + i * h2 แทน hash function แยก depth ตัว
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return np.array([(h1 + i * h2) % self.width for i in range(self.depth)])
+
+    def add(self, item, count=1):
+        """Add ``count`` and return the new estimate."""
+        columns = self._columns(item)
+        self.table[self._rows, columns] += count
+        return int(self.table[self._rows, columns].min())
+
+    def estimate(self, item):
+        return int(self.table[self._rows, self._columns(item)].min())
+
+
+class HeavyHitters:
+    """Top-``capacity`` items by sketch estimate (candidate set kept beside a sketch)."""
+
+    def __init__(self, capacity=100, width=2048, depth=4):
+        self.capacity = capacity
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self.total = 0
+
+    def add(self, item, count=1):
+        estimate = self.sketch.add(item, count)
+        self.total += count
+        if item in self.candidates or len(self.candidates) < self.capacity:
+            self.candidates[item] = estimate
+            return
+        smallest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[smallest]:
+            del self.candidates[smallest]
+            self.candidates[item] = estimate
+
+    def top(self, k=10):
+        return sorted(self.candidates.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+
+
+class WindowedTopQueries:
+    """Heavy hitters per fixed time window, ring of ``windows`` buckets."""
+
+    def __init__(self, window_seconds=TRENDING_WINDOW_SECONDS, windows=TRENDING_WINDOWS, capacity=100):
+        self.window_seconds = window_seconds
+        self.windows = windows
+        self.capacity = capacity
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.window_seconds)
+
+    def add(self, query, timestamp=None):
+        query = normalize_query(query)
+        if not query:
+            return
+        bucket = self._bucket(time.time() if timestamp is None else timestamp)
+        with self._lock:
+            hitters = self._buckets.get(bucket)
+            if hitters is None:
+                hitters = self._buckets[bucket] = HeavyHitters(self.capacity)
+                for old in [b for b in self._buckets if b <= bucket - self.windows]:
+                    del self._buckets[old]
+            hitters.add(query)
+
+    def top(self, k=10, seconds=3600, now=None):
+        """Most frequent queries over the last ``seconds`` -> [(query, count), ...]."""
+        last = self._bucket(time.time() if now is None else now)
+        first = last - max(1, int(np.ceil(seconds / self.window_seconds))) + 1
+        with self._lock:
+            buckets = [h for b, h in self._buckets.items() if first <= b <= last]
+            candidates = set().union(*(h.candidates for h in buckets)) if buckets else set()
+            counts = {q: sum(h.sketch.estimate(q) for h in buckets) for q in candidates}
+        return sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:k]
+
+    def estimate(self, query, seconds=3600, now=None):
+        query = normalize_query(query)
+        last = self._bucket(time.time() if now is None else now)
+        first = last - max(1, int(np.ceil(seconds / self.window_seconds))) + 1
+        with self._lock:
+            return sum(h.sketch.estimate(query) for b, h in self._buckets.items() if first <= b <= last)
+
+
+##### Write-behind queue
+
+class WriteBehindLog:
+    def __init__(self, session_factory=None, batch_size=ACTIVITY_BATCH_SIZE,
+                 flush_interval=ACTIVITY_FLUSH_INTERVAL, max_pending=ACTIVITY_MAX_PENDING,
+                 quarantine_size=ACTIVITY_QUARANTINE_SIZE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_pending)
+        # batch ที่เขียนไม่สำเร็จเพราะ DB ล่ม -> เขียนก่อนของใหม่ในรอบถัดไป (ไม่ยัดกลับเข้า queue ที่อาจเต็ม)
+        self._retry = []
+        # แถวที่ DB ปฏิเสธ: (table, row, error) ล่าสุด quarantine_size แถว
+        self.quarantine = deque(maxlen=quarantine_size)
+        self.top_queries = WindowedTopQueries()
+        self.visit_counts = {}
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "dropped": 0, "errors": 0, "quarantined": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _put(self, table, row):
+        try:
+            self.queue.put_nowait((table, row))
+            self._count("enqueued")
+        except queue.Full:
+            # DB ช้ากว่า traffic มาก -> ทิ้งดีกว่าให้ request ค้าง
+            self._count("dropped")
+
+    def log_search(self, query_text, user_id=None, search_time=None):
+        search_time = search_time or datetime.datetime.now()
+        self.top_queries.add(query_text, search_time.timestamp())
+        self._put(model.SearchHistory.__table__,
+                  {"user_id": user_id, "query_text": query_text, "search_time": search_time})
+
+    def log_visit(self, user_id, castle_id, visit_date=None):
+        with self._stats_lock:
+            self.visit_counts[castle_id] = self.visit_counts.get(castle_id, 0) + 1
+        self._put(model.VisitHistory.__table__,
+                  {"user_id": user_id, "castle_id": castle_id, "visit_date": visit_date or datetime.datetime.now()})
+
+    def _drain(self, limit):
+        items, self._retry = self._retry, []
+        while len(items) < limit:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items):
+        by_table = {}
+        for table, row in items:
+            by_table.setdefault(table, []).append(row)
+        if self.session_factory is None:
+            from db import SessionLocal
+            self.session_factory = SessionLocal
+        db = self.session_factory()
+        try:
+            for table, rows in by_table.items():
+                db.execute(insert(table), rows)
+            db.commit()
+        finally:
+            db.close()
+        visited_users = {row["user_id"] for row in by_table.get(model.VisitHistory.__table__, ())}
+        if visited_users:
+            from cache import response_cache
+            response_cache.invalidate([f"user:{user_id}" for user_id in visited_users])
+
+    def _write_isolating(self, items):
+        """Write ``items``; on a row-level error split the batch until the bad rows are found.
+
+        Bad rows go to ``quarantine``. Returns rows written. Any other error
+        (connection, timeout) propagates.
+        """
+        try:
+            self._write(items)
+            self._count("batches")
+            return len(items)
+        except _ROW_ERRORS as e:
+            self._count("errors")
+            if len(items) == 1:
+                table, row = items[0]
+                self.quarantine.append((table.name, row, f"{type(e).__name__}: {e.orig or e}"))
+                self._count("quarantined")
+                logger.warning("activity log: quarantined %s row %r: %s", table.name, row, e.orig or e)
+                return 0
+        middle = len(items) // 2
+        return self._write_isolating(items[:middle]) + self._write_isolating(items[middle:])
+
+    def flush(self):
+        """Write everything queued so far; returns rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                items = self._drain(self.batch_size)
+                if not items:
+                    return written
+                try:
+                    count = self._write_isolating(items)
+                except Exception:
+                    # DB ล่มชั่วคราว -> เก็บ batch นี้ไว้เขียนก่อนในรอบหน้า
+                    self._count("errors")
+                    self._retry = items
+                    raise
+                written += count
+                self._count("written", count)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while not self._stop.is_set():
+            due = last_flush + self.flush_interval
+            if self.queue.qsize() < self.batch_size and time.monotonic() < due:
+                self._stop.wait(min(0.05, max(0.0, due - time.monotonic())))
+                continue
+            try:
+                self.flush()
+            except Exception:
+                self._stop.wait(self.flush_interval)
+            last_flush = time.monotonic()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="activity-log", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread and flush whatever is still queued."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            # ตอน shutdown ไม่ให้ error ของ DB ทำให้ lifespan ล้ม -> แถวที่ค้างหายไป (บอกจำนวนใน log)
+            logger.exception("activity log: %d rows not written at shutdown", len(self._retry) + self.queue.qsize())
+
+    def snapshot(self):
+        with self._stats_lock:
+            return dict(self.stats, pending=self.queue.qsize() + len(self._retry))
+
+
+activity_log = WriteBehindLog()
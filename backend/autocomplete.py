@@ -0,0 +1,359 @@
+import bisect
+import math
+import re
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+import model
+from activity_log import activity_log
+from startup import CatalogVersion, building, startup
+
+
+### Autocomplete: ชื่อ castle / keyword / จังหวัด
+# prefix: sorted array ของ key (bisect) -> ช่วงที่ขึ้นต้นด้วย prefix / fuzzy: trigram inverted index
+# key ของแต่ละคำ = ทั้งข้อความ + suffix ที่เริ่มต้นคำ (เว้นวรรค หรือคำใน keyword ที่เจอในภาษาไทย)
+# เรียงตาม popularity (VisitHistory + SearchHistory), แก้ catalog แล้ว update แบบ delta
+
+LOAD_BATCH_SIZE = 10000
+MIN_FUZZY_CONTAINMENT = 0.5
+POPULARITY_REFRESH_SECONDS = 300
+# วรรณยุกต์ + การันต์ + zero-width space (พิมพ์ผิด/ตกหล่นบ่อย)
+_IGNORED_MARKS = dict.fromkeys(map(ord, "\u0e48\u0e49\u0e4a\u0e4b\u0e4c\u200b\u200c\u200d"), None)
+# สระ/วรรณยุกต์ไทยไม่นับเป็น \w -> ให้ทั้งก้อนภาษาไทยเป็น token เดียว
+_TOKEN_RE = re.compile(r"[\u0e00-\u0e7f]+|[^\W_]+")
+_THAI_RUN_RE = re.compile("[\u0e00-\u0e7f]+")
+
+
+def normalize(text):
+    """Lowercase, collapse spaces and drop Thai tone marks (common typos)."""
+    text = unicodedata.normalize("NFC", text or "").lower().translate(_IGNORED_MARKS)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class AutocompleteIndex:
+    """Typeahead over (kind, ref_id, text) entries.
+
+    Entries keep stable integer ids. Updates append a new entry id and mark the
+    old one dead; new entries are scanned linearly until the delta is large
+    enough to rebuild the sorted arrays.
+    """
+
+    def __init__(self, rebuild_fraction=0.05, min_rebuild=500):
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self.vocabulary = set()
+        self._max_word = 0
+        self._entries = []
+        self._by_ref = {}
+        self._popularity = {}
+        self._scores = np.empty(0, dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._keys = []
+        self._key_entry = np.empty(0, dtype=np.int32)
+        self._key_scores = np.empty(0, dtype=np.float32)
+        self._trigrams = {}
+        self._indexed = 0
+        self._delta = []
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._by_ref)
+
+    ##### Keys
+
+    def set_vocabulary(self, words):
+        self.vocabulary = {normalize(w) for w in words if w and len(normalize(w)) > 1}
+        self._max_word = max((len(w) for w in self.vocabulary), default=0)
+
+    def keys_for(self, text):
+        key = normalize(text)
+        starts = {m.start() for m in _TOKEN_RE.finditer(key)}
+        # ภาษาไทยไม่เว้นวรรค -> ใช้คำใน vocabulary (keyword) หาจุดเริ่มคำ
+        for run in _THAI_RUN_RE.finditer(key):
+            for i in range(run.start(), run.end()):
+                for j in range(min(run.end(), i + self._max_word), i + 1, -1):
+                    if key[i:j] in self.vocabulary:
+                        starts.add(i)
+                        break
+        return [key[i:] for i in sorted(starts)] or [key]
+
+    ##### Build / update
+
+    def _score(self, kind, ref_id):
+        return math.log1p(self._popularity.get((kind, ref_id), 0.0))
+
+    def set_popularity(self, popularity):
+        """``popularity``: {(kind, ref_id): count}; applied to every entry."""
+        with self._lock:
+            self._popularity = dict(popularity)
+            scores = [self._score(kind, ref_id) for kind, ref_id, _ in self._entries]
+            self._scores = np.array(scores, dtype=np.float32)
+            self._key_scores = self._scores[self._key_entry] if self._key_entry.size else self._key_scores[:0]
+
+    def upsert(self, kind, ref_id, text):
+        with self._lock:
+            old = self._by_ref.pop((kind, ref_id), None)
+            if old is not None:
+                self._alive[old] = False
+            if not text or not normalize(text):
+                return
+            entry_id = len(self._entries)
+            self._entries.append((kind, ref_id, text))
+            self._by_ref[(kind, ref_id)] = entry_id
+            self._scores = np.append(self._scores, np.float32(self._score(kind, ref_id)))
+            self._alive = np.append(self._alive, True)
+            self._delta.append(entry_id)
+            if len(self._delta) > max(self.min_rebuild, self.rebuild_fraction * self._indexed):
+                self.rebuild()
+
+    def remove(self, kind, ref_id):
+        with self._lock:
+            old = self._by_ref.pop((kind, ref_id), None)
+            if old is not None:
+                self._alive[old] = False
+
+    def bulk_load(self, rows):
+        """Replace everything with ``rows`` [(kind, ref_id, text), ...] and rebuild."""
+        with self._lock:
+            self._entries = []
+            self._by_ref = {}
+            for kind, ref_id, text in rows:
+                if text and normalize(text) and (kind, ref_id) not in self._by_ref:
+                    self._by_ref[(kind, ref_id)] = len(self._entries)
+                    self._entries.append((kind, ref_id, text))
+            self._alive = np.ones(len(self._entries), dtype=bool)
+            self.set_popularity(self._popularity)
+            self.rebuild()
+        return self
+
+    def rebuild(self):
+        with self._lock:
+            # ตัด entry ที่ตายแล้วทิ้ง (entry id เปลี่ยน -> map ใหม่)
+            live = np.flatnonzero(self._alive).tolist()
+            self._entries = [self._entries[i] for i in live]
+            self._scores = self._scores[live] if live else np.empty(0, dtype=np.float32)
+            self._alive = np.ones(len(self._entries), dtype=bool)
+            self._by_ref = {(kind, ref_id): i for i, (kind, ref_id, _) in enumerate(self._entries)}
+
+            pairs = sorted((key, entry_id) for entry_id, (_, _, text) in enumerate(self._entries)
+                           for key in self.keys_for(text))
+            self._keys = [key for key, _ in pairs]
+            self._key_entry = np.array([entry_id for _, entry_id in pairs], dtype=np.int32)
+            self._key_scores = self._scores[self._key_entry]
+
+            postings = {}
+            for entry_id, (_, _, text) in enumerate(self._entries):
+                for gram in trigrams(normalize(text)):
+                    postings.setdefault(gram, []).append(entry_id)
+            self._trigrams = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+            self._indexed = len(self._entries)
+            self._delta = []
+
+    ##### Query
+
+    def _prefix_entries(self, key, k):
+        lo = bisect.bisect_left(self._keys, key)
+        hi = bisect.bisect_left(self._keys, key + "\U0010ffff")
+        found = self._key_entry[lo:hi]
+        limit = 8 * k
+        if found.size > limit:
+            # prefix สั้นมาก -> ตัดเหลือ key ที่ score สูงสุดก่อน (entry เดียวมีได้หลาย key / อาจตายแล้ว)
+            found = found[np.argpartition(-self._key_scores[lo:hi], limit - 1)[:limit]]
+        delta = [e for e in self._delta if any(k.startswith(key) for k in self.keys_for(self._entries[e][2]))]
+        if delta:
+            found = np.concatenate([found, np.array(delta, dtype=np.int32)])
+        return np.unique(found)
+
+    def _fuzzy_entries(self, key):
+        query_grams = trigrams(key)
+        lists = [self._trigrams[g] for g in query_grams if g in self._trigrams]
+        hits = np.bincount(np.concatenate(lists), minlength=self._indexed) if lists else np.zeros(self._indexed, dtype=np.int64)
+        containment = hits / len(query_grams)
+        entries = np.flatnonzero(containment >= MIN_FUZZY_CONTAINMENT)
+        scores = containment[entries]
+        delta_entries, delta_scores = [], []
+        for e in self._delta:
+            overlap = len(query_grams & trigrams(normalize(self._entries[e][2]))) / len(query_grams)
+            if overlap >= MIN_FUZZY_CONTAINMENT:
+                delta_entries.append(e)
+                delta_scores.append(overlap)
+        if delta_entries:
+            entries = np.concatenate([entries, np.array(delta_entries, dtype=np.int64)])
+            scores = np.concatenate([scores, np.array(delta_scores)])
+        return entries, scores
+
+    def _top(self, entries, rank, k):
+        if entries.size > k:
+            best = np.argpartition(-rank, k - 1)[:k]
+            entries, rank = entries[best], rank[best]
+        order = np.argsort(-rank, kind="stable")
+        return entries[order]
+
+    def suggest(self, text, k=10, kinds=None):
+        """Up to ``k`` completions [(text, kind, ref_id), ...]: prefix matches first, then fuzzy."""
+        key = normalize(text)
+        if not key or k <= 0:
+            return []
+        with self._lock:
+            entries = self._prefix_entries(key, k if kinds is None else 10 * k)
+            entries = entries[self._alive[entries]]
+            if kinds is not None:
+                entries = np.array([e for e in entries.tolist() if self._entries[e][0] in kinds], dtype=np.int64)
+            results = self._top(entries, self._scores[entries], k).tolist()
+            if len(results) < k and len(key) >= 2:
+                fuzzy, similarity = self._fuzzy_entries(key)
+                keep = self._alive[fuzzy] & ~np.isin(fuzzy, results)
+                if kinds is not None:
+                    keep &= np.array([self._entries[e][0] in kinds for e in fuzzy.tolist()], dtype=bool)
+                fuzzy, similarity = fuzzy[keep], similarity[keep]
+                # ความเหมือนก่อน แล้ว popularity เป็นตัวตัดสิน
+                rank = similarity * 100.0 + self._scores[fuzzy]
+                results += self._top(fuzzy, rank, k - len(results)).tolist()
+            return [(self._entries[e][2], self._entries[e][0], self._entries[e][1]) for e in results]
+
+
+##### โหลดจาก DB
+# popularity = นับจาก DB ครั้งเดียวตอน build + ส่วนที่เพิ่มหลังจากนั้นจาก activity_log (ไม่ต้อง GROUP BY ซ้ำ)
+
+def load_entries(db):
+    rows = [("castle", castle_id, name) for castle_id, name in
+            db.query(model.Castle.castle_id, model.Castle.castle_name).yield_per(LOAD_BATCH_SIZE)]
+    rows += [("keyword", keyword_id, word) for keyword_id, word in
+             db.query(model.Keyword.keyword_id, model.Keyword.keyword).yield_per(LOAD_BATCH_SIZE)]
+    rows += [("province", province, province) for (province,) in
+             db.query(model.Location.province).distinct() if province]
+    return rows
+
+
+def load_popularity(db):
+    """Visit counts per castle / province and search counts per normalized query text."""
+    visits = dict(
+        (castle_id, count) for castle_id, count in
+        db.query(model.VisitHistory.castle_id, func.count()).group_by(model.VisitHistory.castle_id)
+        if castle_id is not None)
+    searched = {}
+    for text, count in db.query(model.SearchHistory.query_text, func.count()).group_by(model.SearchHistory.query_text):
+        if text:
+            searched[normalize(text)] = searched.get(normalize(text), 0) + count
+    return visits, searched
+
+
+class CatalogAutocomplete(AutocompleteIndex):
+    """AutocompleteIndex over the castle catalog with popularity from visits and searches."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.castle_province = {}
+        self.base_visits = {}
+        self.base_searched = {}
+        self.built_at = None
+        self.popularity_at = 0.0
+        self._visit_offset = {}
+
+    def load(self, db):
+        rows = load_entries(db)
+        self.set_vocabulary(text for kind, _, text in rows if kind == "keyword")
+        self.castle_province = dict(
+            db.query(model.LocationCastle.castle_id, model.Location.province)
+            .join(model.Location, model.Location.location_id == model.LocationCastle.location_id))
+        self._visit_offset = dict(activity_log.visit_counts)
+        self.built_at = time.time()
+        self.base_visits, self.base_searched = load_popularity(db)
+        self.bulk_load(rows)
+        self.refresh_popularity()
+        return self
+
+    def refresh_popularity(self):
+        visits = dict(self.base_visits)
+        for castle_id, count in list(activity_log.visit_counts.items()):
+            visits[castle_id] = visits.get(castle_id, 0) + count - self._visit_offset.get(castle_id, 0)
+        searched = dict(self.base_searched)
+        # search ที่เกิดหลัง build: นับจาก heavy hitters ของ activity_log
+        for text, count in activity_log.top_queries.top(k=1000, seconds=max(1.0, time.time() - self.built_at)):
+            searched[normalize(text)] = searched.get(normalize(text), 0) + count
+        popularity = {}
+        for castle_id, count in visits.items():
+            popularity[("castle", castle_id)] = float(count)
+            province = self.castle_province.get(castle_id)
+            if province:
+                popularity[("province", province)] = popularity.get(("province", province), 0.0) + count
+        with self._lock:
+            for kind, ref_id, text in self._entries:
+                count = searched.get(normalize(text))
+                if count:
+                    popularity[(kind, ref_id)] = popularity.get((kind, ref_id), 0.0) + count
+            self.set_popularity(popularity)
+        self.popularity_at = time.monotonic()
+
+
+_autocomplete = None
+_autocomplete_lock = threading.Lock()
+_autocomplete_version = CatalogVersion()
+
+
+def get_autocomplete(db):
+    global _autocomplete
+    if _autocomplete is None:
+        with building(_autocomplete_lock, "autocomplete"):
+            if _autocomplete is None:
+                _autocomplete_version.mark()
+                with startup.timed("autocomplete"):
+                    _autocomplete = CatalogAutocomplete().load(db)
+    elif _autocomplete_version.changed() and _autocomplete_lock.acquire(blocking=False):
+        # bulk import จาก process อื่น -> โหลดใหม่แล้วสลับ
+        try:
+            _autocomplete_version.mark()
+            with startup.timed("autocomplete"):
+                _autocomplete = CatalogAutocomplete().load(db)
+        finally:
+            _autocomplete_lock.release()
+    elif time.monotonic() - _autocomplete.popularity_at > POPULARITY_REFRESH_SECONDS:
+        _autocomplete.refresh_popularity()
+    return _autocomplete
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_catalog_changes(session, flush_context):
+    if _autocomplete is None:
+        return
+    pending = session.info.setdefault("autocomplete_pending", [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, model.Castle):
+            pending.append(("castle", obj.castle_id, obj.castle_name))
+        elif isinstance(obj, model.Keyword):
+            pending.append(("keyword", obj.keyword_id, obj.keyword))
+        elif isinstance(obj, model.Location) and obj.province:
+            pending.append(("province", obj.province, obj.province))
+    for obj in session.deleted:
+        if isinstance(obj, model.Castle):
+            pending.append(("castle", obj.castle_id, None))
+        elif isinstance(obj, model.Keyword):
+            pending.append(("keyword", obj.keyword_id, None))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_catalog_changes(session):
+    pending = session.info.pop("autocomplete_pending", None)
+    if pending and _autocomplete is not None:
+        for kind, ref_id, text in pending:
+            if kind == "province" and (kind, ref_id) in _autocomplete._by_ref:
+                continue
+            if text is None:
+                _autocomplete.remove(kind, ref_id)
+            else:
+                _autocomplete.upsert(kind, ref_id, text)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_catalog_changes(session):
+    session.info.pop("autocomplete_pending", None)
@@ -0,0 +1,65 @@
+import argparse
+import datetime
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import model
+import repository
+import schemas
+from db import Base
+from query_count import count_queries
+
+
+### เทียบ lazy loading (N+1) กับ loader ใน repository.py
+# run (ใน backend/): python -m benchmarks.bench_castle_queries --sizes 10,100,1000
+
+
+def seed(Session, n):
+    start = datetime.datetime(2025, 1, 1)
+    with Session() as db:
+        db.add_all(model.CastleType(type_id=i, type_detail=f"type {i}") for i in range(1, 6))
+        for i in range(1, n + 1):
+            castle = model.Castle(castle_id=i, castle_name=f"castle {i}", era="khmer", type_id=i % 5 + 1)
+            castle.location_link = model.LocationCastle(
+                location=model.Location(latitude=14.5 + i * 1e-4, longitude=102.9, province="บุรีรัมย์"))
+            castle.architectures = [model.Architecture(architec_detail="prang")]
+            castle.images = [model.Image(img_description=f"image {j}") for j in range(2)]
+            castle.events = [model.Event(event_name=f"event {j}", event_start=start, event_end=start) for j in range(2)]
+            castle.nearby_places = [model.NearbyPlace(place_name="market")]
+            db.add(castle)
+        db.commit()
+
+
+def run_page(Session, engine, statement, repeat):
+    timings = []
+    for _ in range(repeat):
+        with Session() as db, count_queries(engine) as counter:
+            started = time.perf_counter()
+            castles = db.scalars(statement).unique().all()
+            [schemas.CastleDetailResponse.model_validate(c) for c in castles]
+            timings.append(time.perf_counter() - started)
+    return counter.count, min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'castles':>8} {'lazy queries':>13} {'lazy ms':>9} {'eager queries':>14} {'eager ms':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine)
+        seed(Session, size)
+        lazy = select(model.Castle).order_by(model.Castle.castle_id).limit(size)
+        lazy_queries, lazy_ms = run_page(Session, engine, lazy, args.repeat)
+        eager_queries, eager_ms = run_page(Session, engine, repository.castle_details_statement(size), args.repeat)
+        print(f"{size:>8} {lazy_queries:>13} {lazy_ms:>9.1f} {eager_queries:>14} {eager_ms:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
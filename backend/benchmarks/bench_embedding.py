@@ -0,0 +1,60 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import embedding
+import model
+from db import Base
+
+
+### Throughput benchmark ของ embedding pipeline
+# run (ใน backend/): python -m benchmarks.bench_embedding --rows 20000
+
+WORDS = ["ปราสาท", "หิน", "พนมรุ้ง", "khmer", "temple", "sandstone", "laterite", "ศิวะ", "lintel", "prang", "บุรีรัมย์", "era"]
+
+
+def _description(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-sizes", default="32,256,1024")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    workdir = tempfile.mkdtemp()
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.execute(model.Castle.__table__.insert(), [
+            {"castle_id": i, "castle_name": f"castle {i}", "castle_description": _description(rng)}
+            for i in range(1, args.rows + 1)
+        ])
+        db.commit()
+
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        cache = embedding.EmbeddingCache(os.path.join(workdir, f"cache_{batch_size}.sqlite3"))
+        for label in ("cold", "warm"):
+            with Session() as db:
+                stats = embedding.backfill(db, "castle", cache=cache, batch_size=batch_size)
+            print(f"batch={batch_size:5d} {label:4s} rows={stats.rows} hits={stats.cache_hits} "
+                  f"{stats.elapsed:6.2f}s {stats.rows_per_sec:8.0f} rows/s")
+        cache.close()
+
+    encoder = embedding.HashingEncoder(model.TEXT_VECTOR_DIM)
+    texts = [_description(rng) for _ in range(2000)]
+    start = time.perf_counter()
+    encoder.encode(texts)
+    print(f"encoder only: {len(texts) / (time.perf_counter() - start):.0f} texts/s")
+
+
+if __name__ == "__main__":
+    main()
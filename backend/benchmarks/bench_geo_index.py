@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import numpy as np
+
+from geo_index import GeoIndex, haversine_km
+
+
+### Benchmark ของ geo_index เทียบกับ haversine scan ทุกแถว
+# run (ใน backend/): python -m benchmarks.bench_geo_index --sizes 1000,100000,1000000
+
+# กรอบพิกัดประเทศไทยโดยประมาณ
+LAT_RANGE = (5.6, 20.5)
+LON_RANGE = (97.3, 105.7)
+
+
+def _time_ms(fn, queries):
+    started = time.perf_counter()
+    for lat, lon in queries:
+        fn(lat, lon)
+    return (time.perf_counter() - started) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--radius-km", type=float, default=50.0)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = list(zip(rng.uniform(*LAT_RANGE, args.queries), rng.uniform(*LON_RANGE, args.queries)))
+    print(f"{'points':>9} {'build s':>8} {'radius ms':>10} {'knn ms':>8} {'scan ms':>8} {'upsert us':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        lats = rng.uniform(*LAT_RANGE, size)
+        lons = rng.uniform(*LON_RANGE, size)
+        index = GeoIndex()
+        started = time.perf_counter()
+        index.upsert(np.arange(size), lats, lons)
+        index.rebuild()
+        build = time.perf_counter() - started
+
+        radius_ms = _time_ms(lambda lat, lon: index.within(lat, lon, args.radius_km), queries)
+        knn_ms = _time_ms(lambda lat, lon: index.nearest(lat, lon, args.k), queries)
+        scan_ms = _time_ms(lambda lat, lon: np.flatnonzero(haversine_km(lat, lon, lats, lons) <= args.radius_km), queries[:20])
+
+        started = time.perf_counter()
+        moved = rng.integers(0, size, 500)
+        for item_id in moved.tolist():
+            index.upsert([item_id], [rng.uniform(*LAT_RANGE)], [rng.uniform(*LON_RANGE)])
+        upsert_us = (time.perf_counter() - started) * 1e6 / moved.size
+        print(f"{size:>9} {build:>8.2f} {radius_ms:>10.3f} {knn_ms:>8.3f} {scan_ms:>8.2f} {upsert_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import repository
+import schemas
+from benchmarks.bench_castle_queries import seed
+from db import Base
+from responses import ORJSONResponse
+
+
+### เทียบ list endpoint 2 แบบ (query + serialize เป็น bytes)
+# ORM + Pydantic: โหลด Castle object -> CastleResponse.model_validate -> json.dumps
+# lean: select column tuple -> dict -> orjson
+# run (ใน backend/): python -m benchmarks.bench_list_endpoints --sizes 20,100,1000
+
+
+def orm_page(Session, limit):
+    with Session() as db:
+        castles = db.scalars(repository.castle_page_statement(0, limit)).unique().all()
+        items = [schemas.CastleResponse.model_validate(c) for c in castles]
+        return json.dumps(jsonable_encoder({"items": items, "next_cursor": None})).encode("utf-8")
+
+
+def lean_page(Session, limit):
+    with Session() as db:
+        rows = db.execute(repository.castle_rows_statement(0, limit)).all()
+        return ORJSONResponse(repository.page(repository.castle_rows_to_dicts(rows), "castle_id", limit)).body
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="20,100,1000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    seed(Session, max(sizes))
+
+    print(f"{'page':>6} {'orm ms':>9} {'lean ms':>9} {'speedup':>8} {'bytes':>9}")
+    for size in sizes:
+        orm_ms, _ = timed(lambda: orm_page(Session, size), args.repeat)
+        lean_ms, size_bytes = timed(lambda: lean_page(Session, size), args.repeat)
+        print(f"{size:>6} {orm_ms:>9.2f} {lean_ms:>9.2f} {orm_ms / lean_ms:>7.1f}x {size_bytes:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import datetime
+
+import numpy as np
+from sqlalchemy import insert
+
+import model
+
+
+### Synthetic catalog สำหรับ load test / micro benchmark (สุ่มแบบ seed คงที่ -> ผลเทียบกันข้าม run ได้)
+# insert ผ่าน Core executemany ทีละ batch (ไม่สร้าง ORM object) -> seed ได้เร็วแม้ scale ใหญ่
+
+SCALES = {
+    # castles, users, visits ต่อ user, interests ต่อ user, events/images ต่อ castle
+    "small": {"castles": 500, "users": 200, "visits": 10, "interests": 3, "events": 2, "images": 2},
+    "medium": {"castles": 5000, "users": 2000, "visits": 20, "interests": 5, "events": 3, "images": 3},
+    "large": {"castles": 50000, "users": 20000, "visits": 30, "interests": 5, "events": 3, "images": 4},
+}
+PROVINCES = ["บุรีรัมย์", "สุรินทร์", "ศรีสะเกษ", "นครราชสีมา", "สระแก้ว", "ลพบุรี", "สุโขทัย", "อยุธยา"]
+ERAS = ["khmer", "dvaravati", "sukhothai", "ayutthaya", "lanna"]
+BATCH_SIZE = 5000
+# กรอบพิกัดประเทศไทยโดยประมาณ
+LAT_RANGE = (5.6, 20.5)
+LON_RANGE = (97.3, 105.7)
+START_DATE = datetime.datetime(2025, 1, 1)
+
+
+def _insert(conn, table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        conn.execute(insert(table), rows[start:start + BATCH_SIZE])
+
+
+def _vectors(rng, n, dim):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def seed_catalog(engine, scale="small", seed=0, with_vectors=True, **overrides):
+    """Create the schema on ``engine`` and fill it; returns the sizes used."""
+    sizes = dict(SCALES[scale], **overrides)
+    rng = np.random.default_rng(seed)
+    n_castles, n_users = sizes["castles"], sizes["users"]
+    model.Base.metadata.create_all(engine)
+    castle_ids = np.arange(1, n_castles + 1)
+    # ความนิยมแบบ Zipf: castle ไม่กี่แห่งได้ visit ส่วนใหญ่ เหมือนข้อมูลจริง
+    popularity = 1.0 / np.arange(1, n_castles + 1) ** 1.1
+    popularity /= popularity.sum()
+    lats = rng.uniform(*LAT_RANGE, n_castles)
+    lons = rng.uniform(*LON_RANGE, n_castles)
+    text_vectors = _vectors(rng, n_castles, model.TEXT_VECTOR_DIM) if with_vectors else None
+
+    with engine.begin() as conn:
+        _insert(conn, model.CastleType.__table__, [{"type_id": i, "type_detail": f"type {i}"} for i in range(1, 6)])
+        _insert(conn, model.Castle.__table__, [{
+            "castle_id": int(c), "castle_name": f"ปราสาท {c} castle {c}", "era": ERAS[c % len(ERAS)],
+            "castle_description": f"synthetic castle {c}", "type_id": int(c % 5 + 1),
+            "text_vector": text_vectors[c - 1].tolist() if with_vectors else None,
+        } for c in castle_ids.tolist()])
+        _insert(conn, model.Location.__table__, [{
+            "location_id": c, "latitude": float(lats[c - 1]), "longitude": float(lons[c - 1]),
+            "district": f"district {c % 97}", "province": PROVINCES[c % len(PROVINCES)],
+        } for c in castle_ids.tolist()])
+        _insert(conn, model.LocationCastle.__table__, [
+            {"castle_id": c, "location_id": c} for c in castle_ids.tolist()])
+        events, images = [], []
+        for c in castle_ids.tolist():
+            for j in range(sizes["events"]):
+                begin = START_DATE + datetime.timedelta(days=int(rng.integers(0, 365)))
+                events.append({"castle_id": c, "event_name": f"event {c}-{j}", "event_start": begin,
+                               "event_end": begin + datetime.timedelta(days=int(rng.integers(1, 10)))})
+            for j in range(sizes["images"]):
+                images.append({"castle_id": c, "img_description": f"image {c}-{j}"})
+        _insert(conn, model.Event.__table__, events)
+        _insert(conn, model.Image.__table__, images)
+        _insert(conn, model.User.__table__, [{
+            "user_id": u, "username": f"user{u}", "password": "x", "email": f"user{u}@example.com",
+        } for u in range(1, n_users + 1)])
+        visits, interests = [], []
+        for u in range(1, n_users + 1):
+            for c in rng.choice(castle_ids, size=sizes["visits"], p=popularity).tolist():
+                visits.append({"user_id": u, "castle_id": c,
+                               "visit_date": START_DATE + datetime.timedelta(minutes=int(rng.integers(0, 525600)))})
+            for c in rng.choice(castle_ids, size=sizes["interests"], p=popularity).tolist():
+                interests.append({"user_id": u, "castle_id": c, "interest_name": ERAS[c % len(ERAS)]})
+        _insert(conn, model.VisitHistory.__table__, visits)
+        _insert(conn, model.Interest.__table__, interests)
+    return sizes
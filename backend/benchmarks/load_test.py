@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+
+### Load test: ยิง FastAPI app ใน process เดียวกัน (httpx ASGITransport) ด้วย client พร้อมกันหลายตัว
+# วัด latency ต่อ request -> p50/p95/p99 + throughput ต่อ endpoint
+# ไม่มี network / uvicorn -> ตัวเลขคือเวลาของ app + DB ล้วนๆ (เทียบระหว่าง commit ได้ แต่ไม่ใช่ตัวเลข production)
+
+
+def _castle(rng, sizes):
+    return int(rng.integers(1, sizes["castles"] + 1))
+
+
+def _user(rng, sizes):
+    return int(rng.integers(1, sizes["users"] + 1))
+
+
+# name -> (method, build(rng, sizes) -> (path, json body))
+ENDPOINTS = {
+    "castles_page": ("GET", lambda rng, s: (f"/castles?after={_castle(rng, s)}&limit=20", None)),
+    "castle_detail": ("GET", lambda rng, s: (f"/castles/{_castle(rng, s)}", None)),
+    "castle_events": ("GET", lambda rng, s: (f"/castles/{_castle(rng, s)}/events", None)),
+    "castles_nearby": ("GET", lambda rng, s: (
+        f"/castles/nearby?lat={rng.uniform(5.6, 20.5):.4f}&lon={rng.uniform(97.3, 105.7):.4f}&radius_km=50", None)),
+    "castles_nearest": ("GET", lambda rng, s: (
+        f"/castles/nearest?lat={rng.uniform(5.6, 20.5):.4f}&lon={rng.uniform(97.3, 105.7):.4f}&k=10", None)),
+    "castles_similar": ("GET", lambda rng, s: (f"/castles/{_castle(rng, s)}/similar?k=10", None)),
+    "castles_also_visited": ("GET", lambda rng, s: (f"/castles/{_castle(rng, s)}/also-visited?k=10", None)),
+    "user_recommendations": ("GET", lambda rng, s: (f"/users/{_user(rng, s)}/recommendations?k=10", None)),
+    "user_graph_recommendations": ("GET", lambda rng, s: (f"/users/{_user(rng, s)}/recommendations/graph?k=10", None)),
+    "events_page": ("GET", lambda rng, s: (f"/events?after={_castle(rng, s)}&limit=50", None)),
+    "images_page": ("GET", lambda rng, s: (f"/images?after={_castle(rng, s)}&limit=50", None)),
+    "autocomplete": ("GET", lambda rng, s: (f"/search/autocomplete?q=castle%20{_castle(rng, s) // 10}&k=10", None)),
+    "create_visit": ("POST", lambda rng, s: ("/visits", {
+        "user_id": _user(rng, s), "castle_id": _castle(rng, s), "visit_date": "2025-06-01T10:00:00"})),
+}
+
+
+def summarize(latencies, errors, wall_seconds):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if latencies.size == 0:
+        return {"requests": 0, "errors": errors}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]).tolist()
+    return {
+        "requests": int(latencies.size), "errors": errors,
+        "p50_ms": round(p50, 3), "p95_ms": round(p95, 3), "p99_ms": round(p99, 3),
+        "mean_ms": round(float(latencies.mean()), 3), "max_ms": round(float(latencies.max()), 3),
+        "rps": round(latencies.size / wall_seconds, 1) if wall_seconds > 0 else None,
+    }
+
+
+async def run_endpoint(client, name, sizes, requests=500, concurrency=16, warmup=20, seed=0):
+    method, build = ENDPOINTS[name]
+    rng = np.random.default_rng(seed)
+    # warm-up: index / cache ที่สร้างตอนเรียกครั้งแรก ไม่นับรวม
+    for _ in range(warmup):
+        path, body = build(rng, sizes)
+        await client.request(method, path, json=body)
+    jobs = [build(rng, sizes) for _ in range(requests)]
+    latencies, errors = [], [0]
+    position = [0]
+
+    async def worker():
+        while position[0] < len(jobs):
+            path, body = jobs[position[0]]
+            position[0] += 1
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+async def wait_until_ready(client, timeout=300.0):
+    # ไม่วัดตอน background warm-up ยังแย่ง CPU อยู่
+    deadline = time.perf_counter() + timeout
+    while (await client.get("/health/ready")).status_code != 200:
+        if time.perf_counter() > deadline:
+            raise TimeoutError("app did not become ready")
+        await asyncio.sleep(0.05)
+
+
+async def run_load(app, sizes, endpoints=None, requests=500, concurrency=16, warmup=20, progress=None):
+    """{endpoint: summary}; runs the app lifespan around the whole test."""
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await wait_until_ready(client)
+            for name in endpoints or ENDPOINTS:
+                results[name] = await run_endpoint(client, name, sizes, requests, concurrency, warmup)
+                if progress:
+                    progress(name, results[name])
+    return results
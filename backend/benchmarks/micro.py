@@ -0,0 +1,165 @@
+import json
+import time
+
+import numpy as np
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import sessionmaker
+
+import covisit
+import ingest
+import recommend
+import repository
+import rerank
+import schemas
+from autocomplete import AutocompleteIndex
+from geo_index import GeoIndex
+from vector_index import VectorIndex
+
+
+### Micro benchmarks: serialize / query / index build + query แยกจาก HTTP
+# แต่ละตัวคืน median ms ของหลายรอบ (median ทนต่อ noise จาก GC / scheduler มากกว่า mean)
+
+
+def timeit(fn, repeat=20, number=1):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    timings = np.asarray(timings) * 1000
+    return {"ms": round(float(np.median(timings)), 4), "min_ms": round(float(timings.min()), 4)}
+
+
+def serialization_benchmarks(Session, page_size=100):
+    with Session() as db:
+        rows = db.execute(repository.castle_rows_statement(0, page_size)).all()
+        castles = db.scalars(repository.castle_page_statement(0, page_size)).unique().all()
+        models = [schemas.CastleResponse.model_validate(c) for c in castles]
+    dicts = repository.castle_rows_to_dicts(rows)
+    return {
+        f"serialize.pydantic_json.{page_size}": timeit(
+            lambda: json.dumps(jsonable_encoder(models)).encode("utf-8")),
+        f"serialize.pydantic_validate.{page_size}": timeit(
+            lambda: [schemas.CastleResponse.model_validate(c) for c in castles]),
+        f"serialize.orjson_dicts.{page_size}": timeit(lambda: orjson.dumps(dicts), number=10),
+    }
+
+
+def query_benchmarks(Session, sizes, page_size=100):
+    rng = np.random.default_rng(1)
+    afters = rng.integers(0, max(sizes["castles"] - page_size, 1), size=64).tolist()
+    position = [0]
+
+    def next_after():
+        position[0] = (position[0] + 1) % len(afters)
+        return afters[position[0]]
+
+    def lean_page():
+        with Session() as db:
+            db.execute(repository.castle_rows_statement(next_after(), page_size)).all()
+
+    def detail_page():
+        with Session() as db:
+            db.scalars(repository.castle_details_statement(20)).unique().all()
+
+    return {
+        f"query.castle_rows.{page_size}": timeit(lean_page),
+        "query.castle_details.20": timeit(detail_page, repeat=10),
+    }
+
+
+def index_benchmarks(n=20000, dim=768, queries=50):
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    ids = np.arange(1, n + 1)
+    query_vectors = rng.standard_normal((queries, dim)).astype(np.float32)
+    lats, lons = rng.uniform(5.6, 20.5, n), rng.uniform(97.3, 105.7, n)
+    names = [("castle", i, f"ปราสาท {i} castle {i}") for i in ids.tolist()]
+
+    def build_vectors():
+        index = VectorIndex(dim)
+        index.add(ids, vectors)
+        return index
+
+    def build_geo():
+        index = GeoIndex()
+        index.upsert(ids, lats, lons)
+        index.rebuild()
+        return index
+
+    def build_autocomplete():
+        index = AutocompleteIndex()
+        index.bulk_load(names)
+        return index
+
+    vector_index, geo, autocomplete = build_vectors(), build_geo(), build_autocomplete()
+    position = [0]
+
+    def next_query():
+        position[0] = (position[0] + 1) % queries
+        return position[0]
+
+    return {
+        f"index.vector_build.{n}": timeit(build_vectors, repeat=3),
+        f"index.vector_search.{n}": timeit(lambda: vector_index.search(query_vectors[next_query()], k=10), number=20),
+        f"index.geo_build.{n}": timeit(build_geo, repeat=5),
+        f"index.geo_nearest.{n}": timeit(lambda: geo.nearest(lats[next_query()], lons[next_query()], k=10), number=50),
+        f"index.autocomplete_build.{n}": timeit(build_autocomplete, repeat=3),
+        f"index.autocomplete_suggest.{n}": timeit(lambda: autocomplete.suggest(f"castle {next_query()}", k=10),
+                                                 number=50),
+    }
+
+
+def rerank_benchmarks(Session, candidates=10000):
+    with Session() as db:
+        catalog = rerank.CastleCatalog().load(db)
+        vectors = recommend.get_castle_index(db)
+        context = rerank.UserContext.for_user(db, catalog, vectors, 1, lat=14.5, lon=102.9)
+    rng = np.random.default_rng(3)
+    n = min(candidates, catalog.castle_ids.shape[0])
+    rows = np.column_stack([rng.choice(catalog.castle_ids, n, replace=False), rng.random(n)])
+    reranker = rerank.Reranker(catalog, vectors)
+    return {f"rerank.mmr.{n}": timeit(lambda: reranker.rank(rows, context, k=10))}
+
+
+def covisit_benchmarks(Session, seeds=50):
+    with Session() as db:
+        build = timeit(lambda: covisit.build(db), repeat=3)
+        graph = covisit.build(db)
+    castle_id = int(graph.castle_ids[np.argmax(graph.transition()[1])])
+    return {
+        "covisit.build": build,
+        "covisit.also_visited": timeit(lambda: graph.also_visited(castle_id, 10)),
+        f"covisit.suggest_routes.{seeds}": timeit(lambda: graph.suggest_routes(5, 4, seeds=seeds), repeat=5),
+    }
+
+
+def ingest_benchmarks(paragraphs=500):
+    # tokenize + ตัด passage + keyword (ไม่รวม embedding) ของข้อความไทยปนอังกฤษ ~200 KB
+    rng = np.random.default_rng(4)
+    sentences = ["ปราสาทหินพนมรุ้งสร้างขึ้นในสมัยขอม", "ทับหลังนารายณ์บรรทมสินธุ์เป็นศิลปะแบบบาปวน",
+                 "ตั้งอยู่บนยอดภูเขาไฟในจังหวัดบุรีรัมย์", "The sanctuary was built from pink sandstone.",
+                 "Restoration work used anastylosis."]
+    blocks = [" ".join(sentences[i] for i in rng.integers(0, len(sentences), 12)) for _ in range(paragraphs)]
+    segmenter = ingest.ThaiSegmenter(engine="dict")
+
+    def split():
+        for passage in ingest.split_passages(ingest.tokenize(blocks, segmenter)):
+            ingest.extract_keywords(passage)
+            ingest.passage_text(passage)
+
+    return {f"ingest.split.{paragraphs}": timeit(split, repeat=5)}
+
+
+def run_micro(engine, sizes, index_size=20000):
+    Session = sessionmaker(bind=engine)
+    results = {}
+    results.update(serialization_benchmarks(Session))
+    results.update(query_benchmarks(Session, sizes))
+    results.update(index_benchmarks(index_size))
+    results.update(rerank_benchmarks(Session))
+    results.update(covisit_benchmarks(Session))
+    results.update(ingest_benchmarks())
+    return results
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+
+### Benchmark suite: seed catalog -> load test ผ่าน ASGI -> micro benchmarks -> JSON (+ เทียบ baseline)
+# run (ใน backend/):
+#   python -m benchmarks.run --scale small --out bench.json
+#   python -m benchmarks.run --scale small --baseline bench.json --threshold 0.2   (exit 1 ถ้าช้าลงเกิน 20%)
+# ใช้ Postgres: --database-url postgresql://... (DB ว่าง -> seed ให้ / มี castle อยู่แล้ว -> ใช้ข้อมูลเดิม ไม่ลบอะไร)
+
+# ตัวเลขที่เอามาเทียบ: latency ยิ่งต่ำยิ่งดี, throughput ยิ่งสูงยิ่งดี
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "ms")
+HIGHER_IS_BETTER = ("rps",)
+COMPARED = ("p95_ms", "rps", "ms")
+
+
+def isolated_environment(workdir, database_url=None):
+    """Point the app's DB and on-disk indexes at ``workdir``; must run before ``db`` is imported."""
+    indexes = os.path.join(workdir, "indexes")
+    os.makedirs(indexes, exist_ok=True)
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["CASTLE_INDEX_PATH"] = os.path.join(indexes, "castle_text.npz")
+    os.environ["CASTLE_DELTA_PATH"] = os.path.join(indexes, "castle_text_delta.npz")
+    os.environ["CF_MODEL_PATH"] = os.path.join(indexes, "cf_als.npz")
+    os.environ["USER_RECS_PATH"] = os.path.join(indexes, "user_recs")
+    os.environ["EMBEDDING_STORE_ROOT"] = os.path.join(indexes, "embeddings")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(indexes, "embedding_cache.sqlite3")
+    os.environ["PLACES_VERSION_PATH"] = os.path.join(indexes, "places.version")
+    os.environ["CATALOG_VERSION_PATH"] = os.path.join(indexes, "catalog.version")
+    os.environ["COVISIT_GRAPH_PATH"] = os.path.join(indexes, "covisit_graph.npz")
+    os.environ["PROFILE_DIR"] = os.path.join(workdir, "profiles")
+    os.environ["CACHE_REDIS_URL"] = ""
+    return os.environ["DATABASE_URL"]
+
+
+def compare(current, baseline, threshold):
+    """[(section, name, metric, baseline, current, change)] for every metric worse than ``threshold``."""
+    regressions = []
+    for section in ("load", "micro"):
+        for name, old in baseline.get(section, {}).items():
+            new = current.get(section, {}).get(name)
+            if new is None:
+                continue
+            for metric in COMPARED:
+                if not old.get(metric) or new.get(metric) is None:
+                    continue
+                change = (new[metric] - old[metric]) / old[metric]
+                worse = change > threshold if metric in LOWER_IS_BETTER else -change > threshold
+                if worse:
+                    regressions.append((section, name, metric, old[metric], new[metric], change))
+    return regressions
+
+
+def _print_load(name, summary):
+    print(f"  {name:<22} p50 {summary.get('p50_ms', 0):>8.2f}  p95 {summary.get('p95_ms', 0):>8.2f}  "
+          f"p99 {summary.get('p99_ms', 0):>8.2f} ms  {summary.get('rps') or 0:>8.1f} req/s  "
+          f"errors {summary['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend load test + micro benchmarks")
+    parser.add_argument("--scale", default="small", choices=("small", "medium", "large"))
+    parser.add_argument("--database-url", default=None, help="default: SQLite file in --workdir")
+    parser.add_argument("--workdir", default=None, help="default: a fresh temp directory")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoints", default=None, help="comma separated subset of load_test.ENDPOINTS")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--index-size", type=int, default=20000)
+    parser.add_argument("--out", default=None, help="write results JSON here")
+    parser.add_argument("--baseline", default=None, help="results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="castle-bench-")
+    database_url = isolated_environment(workdir, args.database_url)
+
+    # import หลังตั้ง env: db.py สร้าง engine จาก DATABASE_URL ตอน import
+    from sqlalchemy import func, inspect, select
+
+    import db
+    import model
+    from benchmarks.catalog import SCALES, seed_catalog
+    from benchmarks.load_test import run_load
+    from benchmarks.micro import run_micro
+
+    started = time.perf_counter()
+    existing = 0
+    if inspect(db.engine).has_table(model.Castle.__tablename__):
+        with db.engine.connect() as conn:
+            existing = conn.execute(select(func.count()).select_from(model.Castle)).scalar()
+    if existing:
+        sizes = dict(SCALES[args.scale], castles=existing)
+        with db.engine.connect() as conn:
+            sizes["users"] = conn.execute(select(func.count()).select_from(model.User)).scalar() or 1
+        print(f"using existing catalog in {database_url}: {sizes['castles']} castles, {sizes['users']} users")
+    else:
+        sizes = seed_catalog(db.engine, args.scale)
+        print(f"seeded {args.scale} catalog {sizes} in {time.perf_counter() - started:.1f}s ({database_url})")
+
+    results = {"meta": {
+        "scale": args.scale, "sizes": sizes, "database": db.engine.dialect.name,
+        "requests": args.requests, "concurrency": args.concurrency,
+        "python": platform.python_version(), "machine": platform.machine(), "created": time.time(),
+    }}
+    if not args.skip_load:
+        import main as app_module
+
+        print(f"load test ({args.requests} requests/endpoint, {args.concurrency} concurrent clients):")
+        endpoints = args.endpoints.split(",") if args.endpoints else None
+        results["load"] = asyncio.run(run_load(
+            app_module.app, sizes, endpoints, args.requests, args.concurrency, progress=_print_load))
+    if not args.skip_micro:
+        print("micro benchmarks (median ms):")
+        results["micro"] = run_micro(db.engine, sizes, args.index_size)
+        for name, summary in results["micro"].items():
+            print(f"  {name:<36} {summary['ms']:>10.4f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"wrote {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for section, name, metric, old, new, change in regressions:
+            print(f"REGRESSION {section}.{name}.{metric}: {old} -> {new} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
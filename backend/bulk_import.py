@@ -0,0 +1,445 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import time
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+import cache
+import model
+import retrieval
+import startup
+
+
+### Bulk import ของ catalog (CSV / JSONL) -> อ่านแบบ stream ทีละ chunk
+# resolve foreign key เป็น batch (ชื่อ castle / ชื่อ type / ชื่อ document / keyword)
+# Postgres: COPY (upsert = COPY เข้า temp table แล้ว INSERT .. ON CONFLICT) / DB อื่น: executemany
+# เขียนด้วย Core -> ไม่มี ORM event: import เสร็จแล้วแตะ version marker + invalidate response cache เอง
+#
+# run (ใน backend/): python bulk_import.py castles data/castles.csv
+#                    python bulk_import.py places data/places.jsonl --upsert --chunk-size 20000
+
+DEFAULT_CHUNK_SIZE = 5000
+KEYWORD_SEPARATOR = "|"
+# entity ที่ retrieval index (places_rag + keyword) อ่าน
+PLACES_ENTITIES = ("places", "keywords", "documents")
+# entity ที่ index อื่นในหน่วยความจำอ่าน (geo / event / autocomplete / rerank catalog)
+CATALOG_ENTITIES = ("castles", "locations", "events", "keywords")
+
+
+def read_records(path):
+    """Yield dict rows from a .csv or .jsonl/.ndjson file without loading it all."""
+    if path.endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                yield {key: (value if value != "" else None) for key, value in row.items()}
+
+
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _int(value):
+    return None if value is None or value == "" else int(value)
+
+
+def _float(value):
+    return None if value is None or value == "" else float(value)
+
+
+def _datetime(value):
+    if value is None or value == "" or isinstance(value, datetime.datetime):
+        return value or None
+    return datetime.datetime.fromisoformat(value)
+
+
+##### Writer: COPY สำหรับ Postgres / executemany สำหรับ DB อื่น
+
+def _copy_text(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class Writer:
+    def __init__(self, conn, upsert=False, use_copy=None):
+        self.conn = conn
+        self.upsert = upsert
+        self.is_postgres = conn.dialect.name == "postgresql"
+        self.use_copy = self.is_postgres if use_copy is None else use_copy
+        self.explicit_ids = set()
+
+    def _dialect_insert(self, table):
+        if self.is_postgres:
+            return postgresql.insert(table)
+        if self.conn.dialect.name == "sqlite":
+            return sqlite.insert(table)
+        return insert(table)
+
+    def _conflict(self, stmt, columns, conflict_cols, update):
+        if not hasattr(stmt, "on_conflict_do_update"):
+            return stmt
+        columns = [c for c in columns if c not in conflict_cols]
+        if update and columns:
+            return stmt.on_conflict_do_update(
+                index_elements=conflict_cols, set_={c: stmt.excluded[c] for c in columns})
+        return stmt.on_conflict_do_nothing(index_elements=conflict_cols)
+
+    def write(self, table, rows, conflict_cols=None, update=None):
+        """Insert ``rows`` (dicts with identical keys).
+
+        ``conflict_cols`` + ``update``: upsert (True) or skip duplicates (False).
+        """
+        if not rows:
+            return
+        update = self.upsert if update is None else update
+        pk = [c.name for c in table.primary_key.columns]
+        if len(pk) == 1 and pk[0] in rows[0]:
+            self.explicit_ids.add(table)
+        if self.use_copy:
+            self._copy(table, rows, conflict_cols, update)
+        else:
+            stmt = self._dialect_insert(table)
+            if conflict_cols:
+                stmt = self._conflict(stmt, rows[0].keys(), conflict_cols, update)
+            self.conn.execute(stmt, rows)
+
+    def write_returning(self, table, rows):
+        """executemany INSERT .. RETURNING pk (ใช้เมื่อต้องเอา id ไปสร้าง link ต่อ)"""
+        if not rows:
+            return []
+        pk = list(table.primary_key.columns)[0]
+        stmt = insert(table).returning(pk, sort_by_parameter_order=True)
+        return self.conn.execute(stmt, rows).scalars().all()
+
+    def _copy(self, table, rows, conflict_cols, update):
+        columns = list(rows[0].keys())
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(_copy_text(row.get(c)) for c in columns))
+            buffer.write("\n")
+        buffer.seek(0)
+        column_sql = ", ".join(columns)
+        cursor = self.conn.connection.driver_connection.cursor()
+        try:
+            if not conflict_cols:
+                cursor.copy_expert(f"COPY {table.name} ({column_sql}) FROM STDIN", buffer)
+                return
+            staging = f"_import_{table.name}"
+            cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP")
+            cursor.execute(f"TRUNCATE {staging}")
+            cursor.copy_expert(f"COPY {staging} ({column_sql}) FROM STDIN", buffer)
+            conflict_sql = ", ".join(conflict_cols)
+            if update:
+                assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in conflict_cols)
+                action = f"DO UPDATE SET {assignments}" if assignments else "DO NOTHING"
+            else:
+                action = "DO NOTHING"
+            cursor.execute(
+                f"INSERT INTO {table.name} ({column_sql}) SELECT {column_sql} FROM {staging} "
+                f"ON CONFLICT ({conflict_sql}) {action}")
+        finally:
+            cursor.close()
+
+    def fix_sequences(self):
+        """Insert แบบระบุ id เอง -> sequence ของ Postgres ไม่ขยับ ต้อง setval ให้ตามทัน"""
+        if not self.is_postgres:
+            return
+        for table in self.explicit_ids:
+            pk = list(table.primary_key.columns)[0].name
+            self.conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', '{pk}'), "
+                f"COALESCE((SELECT MAX({pk}) FROM {table.name}), 1))"))
+
+
+##### Foreign-key resolution (batch + cache ตลอดการ import)
+
+class Resolver:
+    def __init__(self, conn, writer):
+        self.conn = conn
+        self.writer = writer
+        self.castles = {}
+        self.documents = {}
+        self.keywords = {}
+        self.types = dict((detail, type_id) for type_id, detail in conn.execute(
+            select(model.CastleType.type_id, model.CastleType.type_detail)))
+        self.skipped = 0
+        # castle ที่แถวที่ import อ้างถึง -> invalidate response cache หลัง import
+        self.touched = set()
+
+    def _lookup(self, cache, names, column, key_column):
+        missing = [n for n in set(names) if n is not None and n not in cache]
+        for start in range(0, len(missing), 1000):
+            batch = missing[start:start + 1000]
+            for name, item_id in self.conn.execute(select(column, key_column).where(column.in_(batch))):
+                cache.setdefault(name, item_id)
+
+    def castle_ids(self, records):
+        """castle_id ของแต่ละ record (จาก castle_id หรือ castle_name); None = หาไม่เจอ"""
+        self._lookup(self.castles, [r.get("castle_name") for r in records if r.get("castle_id") is None],
+                     model.Castle.castle_name, model.Castle.castle_id)
+        ids = [_int(r.get("castle_id")) if r.get("castle_id") is not None else self.castles.get(r.get("castle_name"))
+               for r in records]
+        self.skipped += sum(1 for i in ids if i is None)
+        return ids
+
+    def document_ids(self, records):
+        self._lookup(self.documents, [r.get("document_name") for r in records if r.get("document_id") is None],
+                     model.Document.document_name, model.Document.document_id)
+        ids = [_int(r.get("document_id")) if r.get("document_id") is not None else self.documents.get(r.get("document_name"))
+               for r in records]
+        self.skipped += sum(1 for i in ids if i is None)
+        return ids
+
+    def type_ids(self, names):
+        missing = sorted({n for n in names if n is not None and n not in self.types})
+        if missing:
+            new_ids = self.writer.write_returning(model.CastleType.__table__, [{"type_detail": n} for n in missing])
+            self.types.update(zip(missing, new_ids))
+        return [self.types.get(n) for n in names]
+
+    def location_ids(self, castle_ids):
+        """castle_id -> location_id ของ castle ที่ลิงก์ location ไว้แล้ว"""
+        found = {}
+        castle_ids = sorted(set(castle_ids))
+        for start in range(0, len(castle_ids), 1000):
+            found.update(self.conn.execute(
+                select(model.LocationCastle.castle_id, model.LocationCastle.location_id)
+                .where(model.LocationCastle.castle_id.in_(castle_ids[start:start + 1000]))).all())
+        return found
+
+    def keyword_ids(self, words):
+        self._lookup(self.keywords, words, model.Keyword.keyword, model.Keyword.keyword_id)
+        missing = sorted({w for w in words if w not in self.keywords})
+        if missing:
+            self.writer.write(model.Keyword.__table__, [{"keyword": w} for w in missing],
+                              conflict_cols=["keyword"], update=False)
+            self._lookup(self.keywords, missing, model.Keyword.keyword, model.Keyword.keyword_id)
+        return [self.keywords[w] for w in words]
+
+
+def _split_keywords(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        words = value
+    else:
+        words = value.split(KEYWORD_SEPARATOR)
+    return [w.strip() for w in words if w and w.strip()]
+
+
+##### Entity loaders: records -> rows ของตาราง
+
+def _optional_pk(rows, records, pk):
+    # ใส่ pk เฉพาะเมื่อทุกแถวใน chunk มีค่า (COPY / executemany ต้องใช้ column ชุดเดียวกัน)
+    if records and all(r.get(pk) is not None for r in records):
+        for row, record in zip(rows, records):
+            row[pk] = _int(record[pk])
+    return rows
+
+
+def _present_only(rows, records, aliases=None):
+    # ตัด column ที่ไม่มีใน input ออก -> upsert ไม่ไปทับค่าเดิมด้วย NULL
+    aliases = aliases or {}
+    keys = set().union(*records) if records else set()
+    keys.update(column for column, source in aliases.items() if keys & set(source))
+    return [{k: v for k, v in row.items() if k in keys} for row in rows]
+
+
+def _castle_pairs(resolver, records):
+    pairs = [(c, r) for c, r in zip(resolver.castle_ids(records), records) if c is not None]
+    resolver.touched.update(c for c, _ in pairs)
+    return pairs
+
+
+def load_castles(writer, resolver, records):
+    type_ids = resolver.type_ids([r.get("castle_type") for r in records])
+    rows = [{
+        "castle_name": r["castle_name"],
+        "castle_description": r.get("castle_description"),
+        "era": r.get("era"),
+        "type_id": _int(r.get("type_id")) if r.get("type_id") is not None else type_id,
+    } for r, type_id in zip(records, type_ids)]
+    rows = _optional_pk(_present_only(rows, records, {"type_id": ["castle_type"]}), records, "castle_id")
+    writer.write(model.Castle.__table__, rows, conflict_cols=["castle_id"] if "castle_id" in rows[0] else None)
+    for row in rows:
+        if "castle_id" in row:
+            resolver.castles[row["castle_name"]] = row["castle_id"]
+            resolver.touched.add(row["castle_id"])
+    return len(rows)
+
+
+def load_locations(writer, resolver, records):
+    pairs = _castle_pairs(resolver, records)
+    rows = _optional_pk([{
+        "latitude": _float(r.get("latitude")),
+        "longitude": _float(r.get("longitude")),
+        "sub_district": r.get("sub_district"),
+        "district": r.get("district"),
+        "province": r.get("province"),
+    } for _, r in pairs], [r for _, r in pairs], "location_id")
+    if rows and "location_id" in rows[0]:
+        rows = _present_only(rows, [r for _, r in pairs], {"location_id": ["location_id"]})
+        writer.write(model.Location.__table__, rows, conflict_cols=["location_id"])
+        links = [{"castle_id": c, "location_id": row["location_id"]} for (c, _), row in zip(pairs, rows)]
+        writer.write(model.LocationCastle.__table__, links, conflict_cols=["castle_id"])
+        return len(rows)
+
+    # ไม่มี location_id -> castle ที่มี location อยู่แล้ว (1-to-1) แก้แถวเดิม (upsert) / ข้าม
+    # insert ใหม่เฉพาะ castle ที่ยังไม่มี -> ไม่เหลือ location ที่ไม่มี castle ลิงก์
+    latest = dict(zip([c for c, _ in pairs], zip(rows, [r for _, r in pairs])))  # castle ซ้ำใน chunk -> แถวหลังสุด
+    existing = resolver.location_ids(list(latest))
+    known = [(existing[c], row, r) for c, (row, r) in latest.items() if c in existing]
+    new = [(c, row) for c, (row, r) in latest.items() if c not in existing]
+    if known and writer.upsert:
+        updates = _present_only([row for _, row, _ in known], [r for _, _, r in known])
+        writer.write(model.Location.__table__, [dict(row, location_id=loc) for row, (loc, _, _) in zip(updates, known)],
+                     conflict_cols=["location_id"], update=True)
+    elif known:
+        resolver.skipped += len(known)
+    location_ids = writer.write_returning(model.Location.__table__, [row for _, row in new])
+    links = [{"castle_id": c, "location_id": loc} for (c, _), loc in zip(new, location_ids)]
+    writer.write(model.LocationCastle.__table__, links, conflict_cols=["castle_id"])
+    return len(new) + (len(known) if writer.upsert else 0)
+
+
+def _simple_castle_loader(table, pk, build):
+    def load(writer, resolver, records):
+        pairs = _castle_pairs(resolver, records)
+        found = [r for _, r in pairs]
+        rows = _present_only([build(r) for r in found], found)
+        rows = _optional_pk([dict(row, castle_id=c) for row, (c, _) in zip(rows, pairs)], found, pk)
+        writer.write(table, rows, conflict_cols=[pk] if rows and pk in rows[0] else None)
+        return len(rows)
+    return load
+
+
+def load_keywords(writer, resolver, records):
+    words = sorted({w for r in records for w in _split_keywords(r.get("keyword"))})
+    resolver.keyword_ids(words)
+    return len(words)
+
+
+def load_places(writer, resolver, records):
+    """places_rag + keywords (column "keywords": list หรือ "a|b|c")"""
+    pairs = [(d, r) for d, r in zip(resolver.document_ids(records), records) if d is not None]
+    rows = _optional_pk([{"document_id": d, "castle_id": _int(r.get("castle_id"))} for d, r in pairs],
+                        [r for _, r in pairs], "place_id")
+    if rows and "place_id" in rows[0]:
+        writer.write(model.Place.__table__, rows, conflict_cols=["place_id"])
+        place_ids = [row["place_id"] for row in rows]
+    else:
+        place_ids = writer.write_returning(model.Place.__table__, rows)
+
+    words_per_place = [_split_keywords(r.get("keywords")) for _, r in pairs]
+    words = sorted({w for ws in words_per_place for w in ws})
+    keyword_ids = dict(zip(words, resolver.keyword_ids(words)))
+    links = sorted({(p, keyword_ids[w]) for p, ws in zip(place_ids, words_per_place) for w in ws})
+    writer.write(model.PlaceKeyword.__table__, [{"place_id": p, "keyword_id": k} for p, k in links],
+                 conflict_cols=["place_id", "keyword_id"], update=False)
+    return len(rows)
+
+
+LOADERS = {
+    "castles": load_castles,
+    "locations": load_locations,
+    "architectures": _simple_castle_loader(model.Architecture.__table__, "architec_id", lambda r: {
+        "architec_detail": r.get("architec_detail")}),
+    "images": _simple_castle_loader(model.Image.__table__, "img_id", lambda r: {
+        "img_description": r.get("img_description")}),
+    "events": _simple_castle_loader(model.Event.__table__, "event_id", lambda r: {
+        "event_name": r.get("event_name"),
+        "event_description": r.get("event_description"),
+        "event_start": _datetime(r.get("event_start")),
+        "event_end": _datetime(r.get("event_end")),
+        "event_time": r.get("event_time"),
+    }),
+    "nearby_places": _simple_castle_loader(model.NearbyPlace.__table__, "place_id", lambda r: {
+        "place_name": r.get("place_name"),
+        "nearby_detail": r.get("nearby_detail")}),
+    "documents": _simple_castle_loader(model.Document.__table__, "document_id", lambda r: {
+        "document_name": r.get("document_name")}),
+    "keywords": load_keywords,
+    "places": load_places,
+}
+
+
+def run_import(engine, entity, path, chunk_size=DEFAULT_CHUNK_SIZE, upsert=False, use_copy=None, progress=print):
+    """Import ``path`` into ``entity``; one transaction per chunk. Returns rows written."""
+    loader = LOADERS[entity]
+    started = time.perf_counter()
+    total = 0
+    resolver = None
+    # ตารางที่ใส่ pk เอง รวมทุก chunk (Writer ใหม่ทุก transaction)
+    explicit_ids = set()
+    for chunk in chunked(read_records(path), chunk_size):
+        with engine.begin() as conn:
+            writer = Writer(conn, upsert=upsert, use_copy=use_copy)
+            writer.explicit_ids = explicit_ids
+            if resolver is None:
+                resolver = Resolver(conn, writer)
+            resolver.conn, resolver.writer = conn, writer
+            total += loader(writer, resolver, chunk)
+        if progress:
+            elapsed = time.perf_counter() - started
+            progress(f"{entity}: {total} rows ({total / elapsed:.0f} rows/s), skipped {resolver.skipped}")
+    if explicit_ids:
+        with engine.begin() as conn:
+            fixer = Writer(conn)
+            fixer.explicit_ids = explicit_ids
+            fixer.fix_sequences()
+    if total:
+        announce(entity, resolver.touched)
+    return total
+
+
+def announce(entity, castle_ids):
+    """Make running servers drop what the import made stale: cached responses and in-memory indexes."""
+    groups = {group for castle_id in castle_ids for group in cache.castle_groups(castle_id)}
+    if entity == "castles":
+        # castle ใหม่เปลี่ยนผล similar ของทุก castle / type ใหม่เปลี่ยน list ของ type
+        groups.update((cache.SIMILAR_GROUP, "castle_types"))
+    cache.response_cache.invalidate(groups)
+    if entity in CATALOG_ENTITIES:
+        startup.publish_catalog_version()
+    if entity in PLACES_ENTITIES:
+        retrieval.publish_places_version()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import catalog data from CSV / JSONL")
+    parser.add_argument("entity", choices=sorted(LOADERS))
+    parser.add_argument("path")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--upsert", action="store_true", help="update rows whose primary key already exists")
+    parser.add_argument("--no-copy", action="store_true", help="use executemany even on Postgres")
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} not found")
+
+    from db import engine
+
+    run_import(engine, args.entity, args.path, args.chunk_size, args.upsert, False if args.no_copy else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+import model
+
+
+### Response cache: in-process LRU/TTL + (optional) Redis tier
+# key ต่อ entity เช่น "castle:5:detail" และแต่ละ key อยู่ใน group ของ entity นั้น ("castle:5")
+# เขียน Castle / Event / Image / Location / Interest / VisitHistory -> invalidate group ที่เกี่ยวข้องหลัง commit
+
+CACHE_LOCAL_SIZE = int(os.getenv("CACHE_LOCAL_SIZE", "10000"))
+# worker อื่นไม่รู้ว่ามีการ invalidate -> local tier ใช้ TTL สั้น, Redis tier เป็นตัวหลัก
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "30"))
+CACHE_REMOTE_TTL = int(os.getenv("CACHE_REMOTE_TTL", "600"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+
+class TTLCache:
+    def __init__(self, maxsize=CACHE_LOCAL_SIZE, ttl=CACHE_LOCAL_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        _, _, groups = self._data.pop(key)
+        for group in groups:
+            members = self._groups.get(group)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._groups[group]
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] < time.monotonic():
+                self._drop(key)
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, groups=(), ttl=None):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, time.monotonic() + (ttl or self.ttl), tuple(groups))
+            for group in groups:
+                self._groups.setdefault(group, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def invalidate(self, groups):
+        with self._lock:
+            for group in groups:
+                for key in list(self._groups.get(group, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._groups.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FakeRedis:
+    """In-memory stand-in for the subset of redis-py used here (tests / local dev)."""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(name):
+        # redis ถือว่า str กับ bytes เป็น key เดียวกัน
+        return name.decode("utf-8") if isinstance(name, bytes) else name
+
+    def _alive(self, name):
+        expires = self._expires.get(name)
+        if expires is not None and expires < time.monotonic():
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    def get(self, name):
+        name = self._name(name)
+        with self._lock:
+            return self._data[name] if self._alive(name) else None
+
+    def set(self, name, value, ex=None):
+        name = self._name(name)
+        with self._lock:
+            self._data[name] = value
+            if ex:
+                self._expires[name] = time.monotonic() + ex
+            else:
+                self._expires.pop(name, None)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in map(self._name, names):
+                removed += self._data.pop(name, None) is not None
+                self._expires.pop(name, None)
+            return removed
+
+    def sadd(self, name, *values):
+        name = self._name(name)
+        with self._lock:
+            members = self._data.setdefault(name, set())
+            before = len(members)
+            members.update(v.encode("utf-8") if isinstance(v, str) else v for v in values)
+            return len(members) - before
+
+    def smembers(self, name):
+        name = self._name(name)
+        with self._lock:
+            return set(self._data.get(name, ())) if self._alive(name) else set()
+
+    def expire(self, name, seconds):
+        name = self._name(name)
+        with self._lock:
+            if name in self._data:
+                self._expires[name] = time.monotonic() + seconds
+                return True
+            return False
+
+
+class CacheEntry:
+    __slots__ = ("etag", "body")
+
+    def __init__(self, etag, body):
+        self.etag = etag
+        self.body = body
+
+    @classmethod
+    def from_data(cls, data):
+        body = json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return cls(f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"', body)
+
+    def dumps(self):
+        return self.etag.encode("ascii") + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, raw):
+        etag, _, body = raw.partition(b"\n")
+        return cls(etag.decode("ascii"), body)
+
+
+class ResponseCache:
+    def __init__(self, local=None, remote=None, remote_ttl=CACHE_REMOTE_TTL, prefix="cache:"):
+        self.local = local if local is not None else TTLCache()
+        self.remote = remote
+        self.remote_ttl = remote_ttl
+        self.prefix = prefix
+        self.stats = {"local_hits": 0, "remote_hits": 0, "misses": 0, "sets": 0, "invalidations": 0, "remote_errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        entry = self.local.get(key)
+        if entry is not None:
+            self._count("local_hits")
+            return entry
+        if self.remote is not None:
+            try:
+                raw = self.remote.get(self.prefix + key)
+            except Exception:
+                # Redis ล่ม -> ทำงานต่อแบบไม่มี remote tier
+                raw = None
+                self._count("remote_errors")
+            if raw is not None:
+                entry = CacheEntry.loads(raw)
+                self.local.set(key, entry)
+                self._count("remote_hits")
+                return entry
+        self._count("misses")
+        return None
+
+    def set(self, key, entry, groups=()):
+        self.local.set(key, entry, groups)
+        self._count("sets")
+        if self.remote is not None:
+            try:
+                self.remote.set(self.prefix + key, entry.dumps(), ex=self.remote_ttl)
+                for group in groups:
+                    self.remote.sadd(self.prefix + "group:" + group, self.prefix + key)
+                    self.remote.expire(self.prefix + "group:" + group, self.remote_ttl)
+            except Exception:
+                self._count("remote_errors")
+
+    def invalidate(self, groups):
+        groups = list(groups)
+        if not groups:
+            return
+        self.local.invalidate(groups)
+        self._count("invalidations")
+        if self.remote is not None:
+            try:
+                for group in groups:
+                    group_key = self.prefix + "group:" + group
+                    keys = self.remote.smembers(group_key)
+                    self.remote.delete(group_key, *keys)
+            except Exception:
+                self._count("remote_errors")
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["local_hits"] + stats["remote_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["local_hits"] + stats["remote_hits"]) / lookups if lookups else 0.0
+        stats["local_entries"] = len(self.local)
+        return stats
+
+
+def _remote_from_env():
+    if not CACHE_REDIS_URL:
+        return None
+    if CACHE_REDIS_URL == "fake://":
+        return FakeRedis()
+    import redis
+    return redis.Redis.from_url(CACHE_REDIS_URL)
+
+
+response_cache = ResponseCache(remote=_remote_from_env())
+
+
+async def cached_json(request, key, groups, build):
+    """Serve ``key`` from the cache (building it with ``await build()`` on a miss).
+
+    Adds an ETag and answers ``If-None-Match`` with 304.
+    """
+    entry = response_cache.get(key)
+    status = "HIT"
+    if entry is None:
+        status = "MISS"
+        entry = CacheEntry.from_data(await build())
+        response_cache.set(key, entry, groups)
+    headers = {"ETag": entry.etag, "X-Cache": status}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match == "*" or entry.etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+##### Invalidation จาก ORM session
+# เขียนแถวไหน -> invalidate เฉพาะ castle/user ที่แถวนั้นอ้างถึง
+# ผลที่ขึ้นกับ castle อื่นด้วย (similar) อยู่ใน SIMILAR_GROUP เพิ่ม -> เขียน Castle ใดๆ invalidate ทั้ง group
+
+SIMILAR_GROUP = "castles:similar"
+
+_CASTLE_CHILDREN = (model.Event, model.Image, model.Architecture, model.NearbyPlace, model.LocationCastle)
+_USER_CHILDREN = (model.Interest, model.VisitHistory)
+
+
+def castle_groups(castle_id):
+    return [f"castle:{castle_id}"]
+
+
+def similar_groups(castle_id):
+    return [f"castle:{castle_id}", SIMILAR_GROUP]
+
+
+def user_groups(user_id):
+    return [f"user:{user_id}"]
+
+
+def _castle_ids(cls, criteria):
+    # CastleType / Location ไม่มี castle_id -> หา castle ที่ลิงก์อยู่ (detail ฝังทั้งสองอย่าง)
+    if cls is model.CastleType:
+        return select(model.Castle.castle_id).join(model.CastleType).where(*criteria)
+    if cls is model.Location:
+        return select(model.LocationCastle.castle_id).join(model.Location).where(*criteria)
+    return select(cls.castle_id).where(*criteria)
+
+
+def _groups_where(session, cls, criteria):
+    """Groups touched by writing the rows of ``cls`` matching ``criteria``."""
+    if cls in _USER_CHILDREN:
+        ids = session.connection().execute(select(cls.user_id).where(*criteria).distinct()).scalars()
+        return [group for user_id in ids for group in user_groups(user_id)]
+    if cls is not model.Castle and cls not in _CASTLE_CHILDREN and cls not in (model.CastleType, model.Location):
+        return []
+    ids = session.connection().execute(_castle_ids(cls, criteria).distinct()).scalars()
+    groups = [group for castle_id in ids for group in castle_groups(castle_id)]
+    if cls is model.Castle:
+        groups.append(SIMILAR_GROUP)
+    elif cls is model.CastleType:
+        groups.append("castle_types")
+    return groups
+
+
+def _referenced_ids(obj, key):
+    # แถวที่ย้ายไป castle/user อื่น -> invalidate ทั้งค่าเดิมและค่าใหม่ (ใน after_flush history ยังไม่ถูกล้าง)
+    ids = set(inspect(obj).attrs[key].history.sum()) or {getattr(obj, key)}
+    ids.discard(None)
+    return ids
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    pass
+
+
+# active_history: set ตอน attribute ยัง expired (เช่นหลัง commit) -> โหลดค่าเดิมก่อน ไม่งั้น history ไม่มีค่าเดิม
+for _cls in _CASTLE_CHILDREN:
+    event.listen(_cls.castle_id, "set", _load_old_value, active_history=True)
+for _cls in _USER_CHILDREN:
+    event.listen(_cls.user_id, "set", _load_old_value, active_history=True)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_groups(session, flush_context):
+    groups = session.info.setdefault("cache_invalidate", set())
+    type_ids, location_ids = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, model.Castle):
+            groups.update(castle_groups(obj.castle_id))
+            groups.add(SIMILAR_GROUP)
+        elif isinstance(obj, _CASTLE_CHILDREN):
+            groups.update(group for castle_id in _referenced_ids(obj, "castle_id") for group in castle_groups(castle_id))
+        elif isinstance(obj, _USER_CHILDREN):
+            groups.update(group for user_id in _referenced_ids(obj, "user_id") for group in user_groups(user_id))
+        elif isinstance(obj, model.CastleType):
+            type_ids.add(obj.type_id)
+        elif isinstance(obj, model.Location):
+            location_ids.add(obj.location_id)
+    if type_ids:
+        groups.update(_groups_where(session, model.CastleType, [model.CastleType.type_id.in_(type_ids)]))
+    if location_ids:
+        groups.update(_groups_where(session, model.Location, [model.Location.location_id.in_(location_ids)]))
+
+
+def _bulk_criteria(orm_execute_state, cls):
+    # bulk UPDATE by primary key (executemany) -> pk อยู่ใน params / นอกนั้นใช้ WHERE ของ statement
+    where = orm_execute_state.statement.whereclause
+    if where is not None:
+        return [where]
+    params = orm_execute_state.parameters
+    if isinstance(params, dict):
+        params = [params]
+    pk = inspect(cls).primary_key
+    if params and len(pk) == 1 and all(pk[0].key in row for row in params):
+        return [pk[0].in_([row[pk[0].key] for row in params])]
+    return []
+
+
+# bulk UPDATE/DELETE (เช่น embedding backfill) ไม่ผ่าน session.dirty -> หาแถวที่โดนก่อน execute
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_groups(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is None:
+            return
+        cls = mapper.class_
+        groups = _groups_where(orm_execute_state.session, cls, _bulk_criteria(orm_execute_state, cls))
+        if groups:
+            orm_execute_state.session.info.setdefault("cache_invalidate", set()).update(groups)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate(session):
+    groups = session.info.pop("cache_invalidate", None)
+    if groups:
+        response_cache.invalidate(groups)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_groups(session):
+    session.info.pop("cache_invalidate", None)
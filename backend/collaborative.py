@@ -0,0 +1,317 @@
+import argparse
+import copy
+import os
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+import model
+from startup import building, startup
+
+
+### Collaborative filtering (implicit-feedback ALS) จาก VisitHistory + Interest
+# ทุก interaction -> ค่า r_ui ใน user x castle CSR matrix, confidence c_ui = 1 + alpha * r_ui
+# แก้ least squares ของ user/castle ทั้งหมดพร้อมกันด้วย conjugate gradient (sparse matmul)
+
+CF_MODEL_PATH = os.getenv("CF_MODEL_PATH", "indexes/cf_als.npz")
+RELOAD_CHECK_SECONDS = 5.0 # เช็ค mtime ของ CF_MODEL_PATH (materialize / refresh เขียนไฟล์ใหม่)
+VISIT_WEIGHT = 1.0
+INTEREST_WEIGHT = 3.0
+LOAD_BATCH_SIZE = 10000
+CG_STEPS = 3
+_SDDMM_CHUNK = 1 << 18 # จำนวน interaction ต่อรอบตอนคำนวณ dot product (คุม memory)
+
+
+def _sampled_dot(rows, cols, left, right):
+    """left[rows[n]] . right[cols[n]] for every stored interaction, chunked."""
+    out = np.empty(rows.shape[0], dtype=np.float32)
+    for start in range(0, rows.shape[0], _SDDMM_CHUNK):
+        end = start + _SDDMM_CHUNK
+        out[start:end] = np.einsum("nf,nf->n", left[rows[start:end]], right[cols[start:end]])
+    return out
+
+
+def _solve_side(matrix, current, fixed, regularization, alpha, steps=CG_STEPS):
+    """One ALS half-step for every row of ``matrix`` at once, via conjugate gradient.
+
+    Solves (YtY + Y^T (C_u - I) Y + reg*I) x_u = Y^T C_u p_u starting from the
+    current factors, so a warm start converges in a few steps. Each step is one
+    sampled dot product plus one sparse x dense matmul; no per-user loop.
+    """
+    gram = fixed.T @ fixed + regularization * np.eye(fixed.shape[1], dtype=np.float32)
+    confidence = (alpha * matrix.data).astype(np.float32)
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    cols = matrix.indices
+
+    def apply(x):
+        weights = confidence * _sampled_dot(rows, cols, x, fixed)
+        return x @ gram + sp.csr_matrix((weights, cols, matrix.indptr), shape=matrix.shape) @ fixed
+
+    target = sp.csr_matrix((1.0 + confidence, cols, matrix.indptr), shape=matrix.shape) @ fixed
+    x = current.copy()
+    residual = target - apply(x)
+    direction = residual.copy()
+    rs_old = np.einsum("nf,nf->n", residual, residual)
+    for _ in range(steps):
+        a_dir = apply(direction)
+        denom = np.einsum("nf,nf->n", direction, a_dir)
+        step = np.divide(rs_old, denom, out=np.zeros_like(rs_old), where=denom > 1e-20)
+        x += step[:, None] * direction
+        residual -= step[:, None] * a_dir
+        rs_new = np.einsum("nf,nf->n", residual, residual)
+        beta = np.divide(rs_new, rs_old, out=np.zeros_like(rs_new), where=rs_old > 1e-20)
+        direction = residual + beta[:, None] * direction
+        rs_old = rs_new
+    return x.astype(np.float32)
+
+
+class ALSRecommender:
+    def __init__(self, factors=64, regularization=0.1, alpha=20.0, iterations=10, seed=0):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.seed = seed
+        self._reset()
+
+    def _reset(self):
+        self.rng = np.random.default_rng(self.seed)
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.castle_ids = np.empty(0, dtype=np.int64)
+        self._user_pos = {}
+        self._castle_pos = {}
+        self.matrix = sp.csr_matrix((0, 0), dtype=np.float32)
+        self.user_factors = np.empty((0, self.factors), dtype=np.float32)
+        self.castle_factors = np.empty((0, self.factors), dtype=np.float32)
+        self.popularity = np.empty(0, dtype=np.float32)
+        self.watermarks = {"visit_id": 0, "interest_id": 0}
+
+    def _positions(self, ids, positions, known):
+        """Map external ids to rows, appending unseen ids. Returns (rows, new id array)."""
+        new_ids = [i for i in dict.fromkeys(ids.tolist()) if i not in positions]
+        for i in new_ids:
+            positions[i] = len(positions)
+        known = np.concatenate([known, np.asarray(new_ids, dtype=np.int64)])
+        rows = np.fromiter((positions[i] for i in ids.tolist()), dtype=np.int64, count=ids.shape[0])
+        return rows, known, len(new_ids)
+
+    def _init_factors(self, count):
+        return (self.rng.standard_normal((count, self.factors)) * 0.01).astype(np.float32)
+
+    def _add(self, user_ids, castle_ids, weights):
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        castle_ids = np.asarray(castle_ids, dtype=np.int64)
+        user_rows, self.user_ids, new_users = self._positions(user_ids, self._user_pos, self.user_ids)
+        castle_rows, self.castle_ids, new_castles = self._positions(castle_ids, self._castle_pos, self.castle_ids)
+        shape = (self.user_ids.shape[0], self.castle_ids.shape[0])
+        delta = sp.csr_matrix((np.asarray(weights, dtype=np.float32), (user_rows, castle_rows)), shape=shape)
+        old = self.matrix
+        old.resize(shape)
+        self.matrix = (old + delta).tocsr()
+        self.matrix.sum_duplicates()
+        self.user_factors = np.vstack([self.user_factors, self._init_factors(new_users)])
+        self.castle_factors = np.vstack([self.castle_factors, self._init_factors(new_castles)])
+        self.popularity = np.asarray(self.matrix.sum(axis=0)).ravel().astype(np.float32)
+
+    def _iterate(self, iterations):
+        transposed = self.matrix.T.tocsr()
+        for _ in range(iterations):
+            self.user_factors = _solve_side(
+                self.matrix, self.user_factors, self.castle_factors, self.regularization, self.alpha)
+            self.castle_factors = _solve_side(
+                transposed, self.castle_factors, self.user_factors, self.regularization, self.alpha)
+
+    def copy(self):
+        """Copy that ``partial_fit`` can grow without touching this model (matrix is resized in place)."""
+        rec = copy.copy(self)
+        rec.rng = copy.deepcopy(self.rng)
+        rec._user_pos = dict(self._user_pos)
+        rec._castle_pos = dict(self._castle_pos)
+        rec.matrix = self.matrix.copy()
+        rec.watermarks = dict(self.watermarks)
+        return rec
+
+    def fit(self, user_ids, castle_ids, weights):
+        self._reset()
+        self._add(user_ids, castle_ids, weights)
+        self._iterate(self.iterations)
+        return self
+
+    def partial_fit(self, user_ids, castle_ids, weights, iterations=2):
+        """Warm-start retrain: add interactions, keep existing factors, run a few sweeps."""
+        if len(user_ids) == 0:
+            return self
+        self._add(user_ids, castle_ids, weights)
+        self._iterate(iterations)
+        return self
+
+    def recommend(self, user_id, k=10, exclude_seen=True):
+        """Top-k (castle_id, score); unknown users get the most popular castles."""
+        row = self._user_pos.get(int(user_id))
+        if row is None:
+            scores = self.popularity.copy()
+        else:
+            scores = self.castle_factors @ self.user_factors[row]
+            if exclude_seen:
+                seen = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]
+                scores[seen] = -np.inf
+        k = min(k, scores.shape[0])
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        best = best[np.isfinite(scores[best])]
+        return list(zip(self.castle_ids[best].tolist(), scores[best].tolist()))
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                params=np.array([self.factors, self.regularization, self.alpha, self.iterations], dtype=np.float64),
+                user_ids=self.user_ids, castle_ids=self.castle_ids,
+                user_factors=self.user_factors, castle_factors=self.castle_factors,
+                indptr=self.matrix.indptr, indices=self.matrix.indices, data=self.matrix.data,
+                watermarks=np.array([self.watermarks["visit_id"], self.watermarks["interest_id"]], dtype=np.int64),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            factors, regularization, alpha, iterations = data["params"].tolist()
+            rec = cls(int(factors), regularization, alpha, int(iterations))
+            rec.user_ids = data["user_ids"]
+            rec.castle_ids = data["castle_ids"]
+            rec._user_pos = {i: row for row, i in enumerate(rec.user_ids.tolist())}
+            rec._castle_pos = {i: row for row, i in enumerate(rec.castle_ids.tolist())}
+            rec.user_factors = data["user_factors"]
+            rec.castle_factors = data["castle_factors"]
+            shape = (rec.user_ids.shape[0], rec.castle_ids.shape[0])
+            rec.matrix = sp.csr_matrix((data["data"], data["indices"], data["indptr"]), shape=shape)
+            rec.popularity = np.asarray(rec.matrix.sum(axis=0)).ravel().astype(np.float32)
+            visit_id, interest_id = data["watermarks"].tolist()
+            rec.watermarks = {"visit_id": visit_id, "interest_id": interest_id}
+        return rec
+
+
+##### โหลด interaction จาก DB (ตาม watermark ของ primary key -> refresh เฉพาะแถวใหม่)
+
+def load_interactions(db, watermarks=None):
+    watermarks = dict(watermarks or {"visit_id": 0, "interest_id": 0})
+    users, castles, weights = [], [], []
+    visits = (
+        db.query(model.VisitHistory.visit_id, model.VisitHistory.user_id, model.VisitHistory.castle_id)
+        .filter(model.VisitHistory.visit_id > watermarks["visit_id"])
+        .yield_per(LOAD_BATCH_SIZE)
+    )
+    for visit_id, user_id, castle_id in visits:
+        watermarks["visit_id"] = max(watermarks["visit_id"], visit_id)
+        if user_id is not None and castle_id is not None:
+            users.append(user_id)
+            castles.append(castle_id)
+            weights.append(VISIT_WEIGHT)
+    interests = (
+        db.query(model.Interest.interest_id, model.Interest.user_id, model.Interest.castle_id)
+        .filter(model.Interest.interest_id > watermarks["interest_id"])
+        .yield_per(LOAD_BATCH_SIZE)
+    )
+    for interest_id, user_id, castle_id in interests:
+        watermarks["interest_id"] = max(watermarks["interest_id"], interest_id)
+        if user_id is not None and castle_id is not None:
+            users.append(user_id)
+            castles.append(castle_id)
+            weights.append(INTEREST_WEIGHT)
+    return users, castles, weights, watermarks
+
+
+def train(db):
+    users, castles, weights, watermarks = load_interactions(db)
+    rec = ALSRecommender().fit(users, castles, weights)
+    rec.watermarks = watermarks
+    return rec
+
+
+def refresh(db, rec):
+    """Model with interactions newer than ``rec``'s watermarks folded in.
+
+    ``rec`` is left untouched (requests may be reading it); nothing new
+    returns ``rec`` itself.
+    """
+    users, castles, weights, watermarks = load_interactions(db, rec.watermarks)
+    if watermarks == rec.watermarks:
+        return rec
+    fresh = rec.copy().partial_fit(users, castles, weights)
+    fresh.watermarks = watermarks
+    return fresh
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+_recommender_mtime = None
+_checked_at = 0.0
+
+
+def _model_mtime():
+    try:
+        return os.stat(CF_MODEL_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_recommender(db):
+    global _recommender, _recommender_mtime, _checked_at
+    if _recommender is None:
+        with building(_recommender_lock, "collaborative"):
+            if _recommender is None:
+                with startup.timed("collaborative"):
+                    _recommender_mtime = _model_mtime()
+                    if _recommender_mtime is not None:
+                        _recommender = ALSRecommender.load(CF_MODEL_PATH)
+                    else:
+                        _recommender = train(db)
+                        _recommender.save(CF_MODEL_PATH)
+                        _recommender_mtime = _model_mtime()
+                _checked_at = time.monotonic()
+    elif time.monotonic() - _checked_at > RELOAD_CHECK_SECONDS and _recommender_lock.acquire(blocking=False):
+        # มีคนโหลดอยู่แล้ว -> ใช้ model เดิมไปก่อน
+        try:
+            _checked_at = time.monotonic()
+            mtime = _model_mtime()
+            if mtime is not None and mtime != _recommender_mtime:
+                # ไฟล์ใหม่จาก materialize.py / python collaborative.py refresh -> โหลดแล้วสลับ
+                with startup.timed("collaborative"):
+                    fresh = ALSRecommender.load(CF_MODEL_PATH)
+                _recommender, _recommender_mtime = fresh, mtime
+        finally:
+            _recommender_lock.release()
+    return _recommender
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train / refresh the collaborative-filtering model")
+    parser.add_argument("command", choices=["train", "refresh"])
+    args = parser.parse_args()
+
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "train" or not os.path.exists(CF_MODEL_PATH):
+            rec = train(db)
+        else:
+            rec = refresh(db, ALSRecommender.load(CF_MODEL_PATH))
+        rec.save(CF_MODEL_PATH)
+        print(f"users={rec.user_ids.shape[0]} castles={rec.castle_ids.shape[0]} "
+              f"interactions={rec.matrix.nnz} watermarks={rec.watermarks}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+import argparse
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import func
+
+import model
+from startup import building, startup
+
+
+### Co-visitation graph: castle x castle (CSR) จากลำดับการเที่ยวของ user + ลำดับ castle ใน route
+# edge = castle ที่เที่ยวต่อกันภายใน COVISIT_WINDOW_STEPS ครั้ง / COVISIT_WINDOW_DAYS วัน (น้ำหนัก 1/ระยะห่าง)
+# "คนที่ไป X ไปที่ไหนต่อ" = random walk with restart (personalized PageRank) จาก X ด้วย sparse matmul
+# visit ใหม่ -> refresh ตาม watermark ของ visit_id (บวก delta เข้า matrix เดิม ไม่สร้างใหม่ทั้งก้อน)
+
+COVISIT_GRAPH_PATH = os.getenv("COVISIT_GRAPH_PATH", "indexes/covisit_graph.npz")
+COVISIT_WINDOW_STEPS = int(os.getenv("COVISIT_WINDOW_STEPS", "3"))
+COVISIT_WINDOW_DAYS = float(os.getenv("COVISIT_WINDOW_DAYS", "14"))
+COVISIT_ROUTE_WEIGHT = float(os.getenv("COVISIT_ROUTE_WEIGHT", "5"))
+COVISIT_RESTART = float(os.getenv("COVISIT_RESTART", "0.3"))
+# หารคะแนนด้วย degree^penalty -> castle ยอดนิยมไม่ขึ้นทุกรายการ (0 = PageRank ล้วน)
+COVISIT_DEGREE_PENALTY = float(os.getenv("COVISIT_DEGREE_PENALTY", "0.5"))
+COVISIT_REFRESH_SECONDS = float(os.getenv("COVISIT_REFRESH_SECONDS", "60"))
+RWR_ITERATIONS = 30
+RWR_TOLERANCE = 1e-6
+USER_HISTORY = 50
+USER_RECENCY_DECAY = 0.9
+LOAD_BATCH_SIZE = 10000
+_IN_CHUNK = 1000
+_NAT = np.iinfo(np.int64).min
+
+
+def window_pairs(groups, nodes, times=None, window=None, steps=COVISIT_WINDOW_STEPS, fresh=None):
+    """Co-occurrence pairs between each item and the next ``steps`` items of its group.
+
+    Inputs are sorted by (group, time). Pairs more than ``window`` seconds apart
+    are dropped (unknown times always pass); with ``fresh`` only pairs touching
+    a fresh item are kept. Returns ``(left, right, weight)`` with weight ``1 / offset``.
+    """
+    lefts, rights, weights = [], [], []
+    for offset in range(1, steps + 1):
+        if groups.shape[0] <= offset:
+            break
+        keep = (groups[offset:] == groups[:-offset]) & (nodes[offset:] != nodes[:-offset])
+        if times is not None and window is not None:
+            before, after = times[:-offset], times[offset:]
+            known = (before != _NAT) & (after != _NAT)
+            keep &= ~known | (after - before <= window)
+        if fresh is not None:
+            keep &= fresh[:-offset] | fresh[offset:]
+        lefts.append(nodes[:-offset][keep])
+        rights.append(nodes[offset:][keep])
+        weights.append(np.full(int(keep.sum()), 1.0 / offset, dtype=np.float32))
+    if not lefts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return np.concatenate(lefts), np.concatenate(rights), np.concatenate(weights)
+
+
+def _sorted_visits(visit_ids, users, castles, dates):
+    visit_ids = np.asarray(visit_ids, dtype=np.int64)
+    users = np.asarray(users, dtype=np.int64)
+    castles = np.asarray(castles, dtype=np.int64)
+    times = np.array(dates, dtype="datetime64[s]").astype(np.int64)
+    # ไม่มี visit_date -> ใช้ลำดับ visit_id แทน (NaT เป็นค่าติดลบสุด จึงอยู่หน้ากลุ่ม)
+    order = np.lexsort((visit_ids, times, users))
+    return visit_ids[order], users[order], castles[order], times[order]
+
+
+class CoVisitGraph:
+    """Symmetric weighted castle graph: visit edges + route edges, kept as two CSR matrices.
+
+    Visit edges grow incrementally (``refresh``); route edges are small and are
+    rebuilt whenever the RouteCastle table changes.
+    """
+
+    def __init__(self, window_steps=COVISIT_WINDOW_STEPS, window_days=COVISIT_WINDOW_DAYS,
+                 route_weight=COVISIT_ROUTE_WEIGHT):
+        self.window_steps = window_steps
+        self.window_days = window_days
+        self.route_weight = route_weight
+        self.castle_ids = np.empty(0, dtype=np.int64)
+        self._pos = {}
+        self.visits = sp.csr_matrix((0, 0), dtype=np.float32)
+        self.routes = sp.csr_matrix((0, 0), dtype=np.float32)
+        self.route_sets = []
+        self.route_signature = None
+        self.watermarks = {"visit_id": 0}
+        self._transition = None
+        self._degree = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.castle_ids.shape[0]
+
+    def _positions(self, castle_ids):
+        castle_ids = np.asarray(castle_ids, dtype=np.int64)
+        new = [i for i in np.unique(castle_ids).tolist() if i not in self._pos]
+        if new:
+            # ขยาย matrix ทั้งสองพร้อมกันใต้ lock -> transition() ไม่เห็นขนาดไม่ตรงกัน
+            with self._lock:
+                self.castle_ids = np.concatenate([self.castle_ids, np.asarray(new, dtype=np.int64)])
+                self.visits = self._resized(self.visits)
+                self.routes = self._resized(self.routes)
+                for castle_id in new:
+                    self._pos[castle_id] = len(self._pos)
+        return np.fromiter((self._pos[i] for i in castle_ids.tolist()), dtype=np.int64, count=castle_ids.shape[0])
+
+    def _resized(self, matrix):
+        size = self.size
+        indptr = np.concatenate([matrix.indptr, np.full(size - matrix.shape[0], matrix.indptr[-1], dtype=matrix.indptr.dtype)])
+        return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=(size, size))
+
+    def _edges(self, left, right, weights):
+        # เก็บทั้งสองทิศ -> matrix สมมาตร (ใช้เป็น transition ของ random walk ได้ตรงๆ)
+        rows = np.concatenate([left, right])
+        cols = np.concatenate([right, left])
+        data = np.concatenate([weights, weights]).astype(np.float32)
+        return sp.csr_matrix((data, (rows, cols)), shape=(self.size, self.size))
+
+    def add_visits(self, visit_ids, users, castles, dates, after=None):
+        """Add edges from visit rows; with ``after`` only pairs that touch a visit newer than it."""
+        if not len(visit_ids):
+            return 0
+        visit_ids, users, castles, times = _sorted_visits(visit_ids, users, castles, dates)
+        nodes = self._positions(castles)
+        fresh = visit_ids > after if after is not None else None
+        left, right, weights = window_pairs(
+            users, nodes, times, self.window_days * 86400, self.window_steps, fresh)
+        if left.size:
+            with self._lock:
+                self.visits = self.visits + self._edges(left, right, weights)
+                self._transition = None
+        return int(left.size)
+
+    def set_routes(self, route_ids, castles, orders, signature=None):
+        """Replace route edges; castles of a route are chained in ``sequence_order``."""
+        route_ids = np.asarray(route_ids, dtype=np.int64)
+        castles = np.asarray(castles, dtype=np.int64)
+        orders = np.asarray([-1 if o is None else o for o in orders], dtype=np.int64)
+        order = np.lexsort((castles, orders, route_ids))
+        route_ids, castles = route_ids[order], castles[order]
+        nodes = self._positions(castles)
+        left, right, weights = window_pairs(route_ids, nodes, steps=self.window_steps)
+        starts = np.flatnonzero(np.r_[True, route_ids[1:] != route_ids[:-1]]) if route_ids.size else []
+        with self._lock:
+            self.routes = self._edges(left, right, weights)
+            self.route_sets = [frozenset(part.tolist()) for part in np.split(castles, starts[1:])] if route_ids.size else []
+            self.route_signature = signature
+            self._transition = None
+
+    ##### Random walk with restart
+
+    def transition(self):
+        """Column-stochastic transition matrix (transpose of the row-normalized adjacency) + degrees."""
+        with self._lock:
+            if self._transition is None:
+                adjacency = (self.visits + self.route_weight * self.routes).tocsr()
+                degree = np.asarray(adjacency.sum(axis=1)).ravel().astype(np.float32)
+                inverse = np.divide(1.0, degree, out=np.zeros_like(degree), where=degree > 0)
+                # adjacency สมมาตร -> P^T = A D^-1 = scale แต่ละ column ด้วย 1/degree
+                self._transition = sp.csr_matrix(
+                    (adjacency.data * inverse[adjacency.indices], adjacency.indices, adjacency.indptr),
+                    shape=adjacency.shape)
+                self._degree = degree
+            return self._transition, self._degree
+
+    def walk(self, restart_vectors, restart=COVISIT_RESTART, iterations=RWR_ITERATIONS, tol=RWR_TOLERANCE,
+             transition=None):
+        """Personalized PageRank for every column of ``restart_vectors`` (n x s) at once.
+
+        Each iteration is one sparse x dense product; mass that reaches a castle
+        with no edges goes back to the restart distribution.
+        """
+        matrix, degree = transition or self.transition()
+        restart_vectors = np.asarray(restart_vectors, dtype=np.float32)
+        totals = restart_vectors.sum(axis=0, keepdims=True)
+        seeds = np.divide(restart_vectors, totals, out=np.zeros_like(restart_vectors), where=totals > 0)
+        dangling = degree == 0
+        scores = seeds.copy()
+        for _ in range(iterations):
+            lost = scores[dangling].sum(axis=0, keepdims=True)
+            step = (1.0 - restart) * (matrix @ scores) + (restart + (1.0 - restart) * lost) * seeds
+            change = float(np.abs(step - scores).sum(axis=0).max()) if scores.size else 0.0
+            scores = step
+            if change < tol:
+                break
+        return scores
+
+    def _ranked(self, scores, degree, exclude, k, degree_penalty):
+        if degree_penalty:
+            scores = scores / np.maximum(degree, 1.0) ** degree_penalty
+        scores = np.where(scores > 0, scores, -np.inf)
+        if exclude:
+            positions = [self._pos[i] for i in exclude if self._pos.get(i, scores.shape[0]) < scores.shape[0]]
+            scores[positions] = -np.inf
+        k = min(k, scores.shape[0])
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        best = best[np.isfinite(scores[best])]
+        return list(zip(self.castle_ids[best].tolist(), scores[best].tolist()))
+
+    def personalized(self, seeds, k=10, exclude=None, degree_penalty=COVISIT_DEGREE_PENALTY):
+        """Top ``k`` (castle_id, score) for a restart distribution ``{castle_id: weight}``; seeds are excluded."""
+        transition = self.transition()
+        degree = transition[1]
+        vector = np.zeros((degree.shape[0], 1), dtype=np.float32)
+        for castle_id, weight in seeds.items():
+            # castle ที่เพิ่งเพิ่มระหว่าง refresh ยังไม่อยู่ใน matrix ชุดนี้ -> ข้าม
+            if self._pos.get(castle_id, degree.shape[0]) < degree.shape[0]:
+                vector[self._pos[castle_id], 0] += weight
+        if not vector.any():
+            return []
+        scores = self.walk(vector, transition=transition)[:, 0]
+        return self._ranked(scores, degree, set(seeds) | set(exclude or ()), k, degree_penalty)
+
+    def also_visited(self, castle_id, k=10):
+        """"People who visited X also visited" (empty when X has never been co-visited)."""
+        return self.personalized({castle_id: 1.0}, k)
+
+    ##### Route suggestions
+
+    def suggest_routes(self, k=5, size=4, seeds=50, max_overlap=0.5, seed_castle=None,
+                       degree_penalty=COVISIT_DEGREE_PENALTY):
+        """Candidate routes: a seed castle plus its strongest PageRank neighbourhood.
+
+        All seeds are walked in one batched sparse x dense product; members are
+        picked on degree-penalized scores, like ``personalized``. A candidate is
+        skipped when it overlaps an existing route or an earlier suggestion by more
+        than ``max_overlap`` (Jaccard). Castles are ordered by a greedy walk along
+        the heaviest edges from the seed.
+        """
+        transition = self.transition()
+        matrix, degree = transition
+        if seed_castle is not None:
+            if self._pos.get(seed_castle, degree.shape[0]) >= degree.shape[0]:
+                return []
+            starts = np.asarray([self._pos[seed_castle]])
+        else:
+            connected = np.flatnonzero(degree > 0)
+            starts = connected[np.argsort(-degree[connected])[:seeds]]
+        if starts.size == 0 or size < 2:
+            return []
+        restart_vectors = np.zeros((degree.shape[0], starts.size), dtype=np.float32)
+        restart_vectors[starts, np.arange(starts.size)] = 1.0
+        scores = self.walk(restart_vectors, transition=transition)
+        scores[starts, np.arange(starts.size)] = 0.0
+        taken = list(self.route_sets)
+        suggestions = []
+        # เลือกสมาชิกด้วยคะแนนที่หาร degree แล้ว -> ไม่ได้ castle ยอดนิยมชุดเดิมทุก seed
+        distinct = scores / np.maximum(degree, 1.0)[:, None] ** degree_penalty
+        for column, start in enumerate(starts.tolist()):
+            column_scores = scores[:, column]
+            count = min(size - 1, int(np.count_nonzero(column_scores > 0)))
+            if count == 0:
+                continue
+            members = np.argpartition(-distinct[:, column], count - 1)[:count]
+            path = self._order(start, members.tolist(), matrix)
+            castles = frozenset(self.castle_ids[path].tolist())
+            if any(len(castles & other) / len(castles | other) > max_overlap for other in taken):
+                continue
+            taken.append(castles)
+            suggestions.append({
+                "castle_ids": self.castle_ids[path].tolist(),
+                "score": float(column_scores[members].sum()),
+                "seed_castle_id": int(self.castle_ids[start]),
+            })
+            if len(suggestions) == k:
+                break
+        return sorted(suggestions, key=lambda s: s["score"], reverse=True)
+
+    def _order(self, start, members, matrix):
+        path, remaining = [start], set(members)
+        while remaining:
+            row = matrix.getrow(path[-1])
+            weights = dict(zip(row.indices.tolist(), row.data.tolist()))
+            # ไม่มี edge ตรงไปยังที่เหลือ -> ต่อด้วยตัวที่คะแนนรวมสูงสุดตามลำดับ members
+            best = max(remaining, key=lambda p: (weights.get(p, 0.0), -members.index(p)))
+            path.append(best)
+            remaining.remove(best)
+        return path
+
+    ##### Save / load (npz, เขียนไฟล์ tmp แล้ว replace)
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        visits = self.visits.tocoo()
+        routes = self.routes.tocoo()
+        route_castles = [np.asarray(sorted(members), dtype=np.int64) for members in self.route_sets]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                params=np.array([self.window_steps, self.window_days, self.route_weight], dtype=np.float64),
+                castle_ids=self.castle_ids,
+                visit_edges=np.vstack([visits.row, visits.col]).astype(np.int64), visit_weights=visits.data,
+                route_edges=np.vstack([routes.row, routes.col]).astype(np.int64), route_weights=routes.data,
+                route_castles=np.concatenate(route_castles) if route_castles else np.empty(0, dtype=np.int64),
+                route_sizes=np.asarray([m.size for m in route_castles], dtype=np.int64),
+                route_signature=np.asarray(self.route_signature or (), dtype=np.int64),
+                watermarks=np.array([self.watermarks["visit_id"]], dtype=np.int64),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            window_steps, window_days, route_weight = data["params"].tolist()
+            graph = cls(int(window_steps), window_days, route_weight)
+            graph.castle_ids = data["castle_ids"]
+            graph._pos = {i: row for row, i in enumerate(graph.castle_ids.tolist())}
+            shape = (graph.size, graph.size)
+            edges = data["visit_edges"]
+            graph.visits = sp.csr_matrix((data["visit_weights"], (edges[0], edges[1])), shape=shape)
+            edges = data["route_edges"]
+            graph.routes = sp.csr_matrix((data["route_weights"], (edges[0], edges[1])), shape=shape)
+            sizes = data["route_sizes"]
+            graph.route_sets = [frozenset(part.tolist())
+                                for part in np.split(data["route_castles"], np.cumsum(sizes)[:-1])] if sizes.size else []
+            graph.route_signature = tuple(data["route_signature"].tolist()) or None
+            graph.watermarks = {"visit_id": int(data["watermarks"][0])}
+        return graph
+
+
+##### โหลดจาก DB
+
+def _visit_rows(query):
+    visit_ids, users, castles, dates = [], [], [], []
+    for visit_id, user_id, castle_id, visit_date in query.yield_per(LOAD_BATCH_SIZE):
+        if user_id is not None and castle_id is not None:
+            visit_ids.append(visit_id)
+            users.append(user_id)
+            castles.append(castle_id)
+            dates.append(visit_date)
+    return visit_ids, users, castles, dates
+
+
+def _visit_query(db):
+    visit = model.VisitHistory
+    return db.query(visit.visit_id, visit.user_id, visit.castle_id, visit.visit_date)
+
+
+def route_signature(db):
+    """Cheap fingerprint of RouteCastle: any insert / delete / reorder changes it."""
+    rc = model.RouteCastle
+    row = db.query(
+        func.count(), func.coalesce(func.sum(rc.route_id), 0), func.coalesce(func.sum(rc.castle_id), 0),
+        func.coalesce(func.sum(rc.route_id * rc.castle_id * (func.coalesce(rc.sequence_order, 0) + 1)), 0),
+    ).one()
+    return tuple(int(value) for value in row)
+
+
+def load_routes(db, graph, signature=None):
+    rc = model.RouteCastle
+    rows = db.query(rc.route_id, rc.castle_id, rc.sequence_order).filter(rc.castle_id.isnot(None)).all()
+    route_ids, castles, orders = zip(*rows) if rows else ((), (), ())
+    graph.set_routes(route_ids, castles, orders, signature or route_signature(db))
+
+
+def build(db):
+    graph = CoVisitGraph()
+    visit_ids, users, castles, dates = _visit_rows(_visit_query(db))
+    graph.add_visits(visit_ids, users, castles, dates)
+    graph.watermarks = {"visit_id": max(visit_ids, default=0)}
+    load_routes(db, graph)
+    return graph
+
+
+def refresh(db, graph):
+    """Fold visits newer than the watermark into ``graph``; reload routes only if they changed.
+
+    New visits pair with the user's earlier visits inside the time window, so only
+    the affected users' recent history is read back.
+    """
+    visit = model.VisitHistory
+    watermark = graph.watermarks["visit_id"]
+    new_ids, new_users, _, new_dates = _visit_rows(_visit_query(db).filter(visit.visit_id > watermark))
+    if new_ids:
+        known = [d for d in new_dates if d is not None]
+        since = min(known) - datetime.timedelta(days=graph.window_days) if known else None
+        visit_ids, users, castles, dates = [], [], [], []
+        user_list = sorted(set(new_users))
+        for start in range(0, len(user_list), _IN_CHUNK):
+            query = _visit_query(db).filter(visit.user_id.in_(user_list[start:start + _IN_CHUNK]))
+            if since is not None and len(known) == len(new_dates):
+                query = query.filter(visit.visit_date >= since)
+            for part, values in zip((visit_ids, users, castles, dates), _visit_rows(query)):
+                part.extend(values)
+        graph.add_visits(visit_ids, users, castles, dates, after=watermark)
+        graph.watermarks = {"visit_id": max(new_ids)}
+    signature = route_signature(db)
+    if signature != graph.route_signature:
+        load_routes(db, graph, signature)
+    return graph
+
+
+def user_seeds(db, user_id, limit=USER_HISTORY):
+    """Restart distribution for a user: recent visits weigh more (``USER_RECENCY_DECAY`` per step back)."""
+    visit = model.VisitHistory
+    rows = (
+        db.query(visit.castle_id)
+        .filter(visit.user_id == user_id, visit.castle_id.isnot(None))
+        .order_by(visit.visit_date.desc(), visit.visit_id.desc())
+        .limit(limit)
+        .all()
+    )
+    seeds = {}
+    for rank, (castle_id,) in enumerate(rows):
+        seeds[castle_id] = seeds.get(castle_id, 0.0) + USER_RECENCY_DECAY ** rank
+    return seeds
+
+
+##### Singleton: โหลดจากไฟล์ (หรือสร้างใหม่) แล้ว refresh ตาม watermark ทุก COVISIT_REFRESH_SECONDS
+
+_graph = None
+_graph_lock = threading.Lock()
+_refreshed_at = 0.0
+
+
+def get_graph(db):
+    global _graph, _refreshed_at
+    if _graph is None:
+        with building(_graph_lock, "covisit"):
+            if _graph is None:
+                with startup.timed("covisit"):
+                    if os.path.exists(COVISIT_GRAPH_PATH):
+                        graph = refresh(db, CoVisitGraph.load(COVISIT_GRAPH_PATH))
+                    else:
+                        graph = build(db)
+                        graph.save(COVISIT_GRAPH_PATH)
+                    graph.transition()
+                _refreshed_at = time.monotonic()
+                _graph = graph
+    elif time.monotonic() - _refreshed_at > COVISIT_REFRESH_SECONDS and _graph_lock.acquire(blocking=False):
+        # มีคน refresh อยู่แล้ว -> request นี้ใช้ graph เดิมไปก่อน ไม่ต้องรอ
+        try:
+            _refreshed_at = time.monotonic()
+            refresh(db, _graph).transition()
+        finally:
+            _graph_lock.release()
+    return _graph
+
+
+def recommend_for_user(db, user_id, k=10):
+    graph = get_graph(db)
+    seeds = user_seeds(db, user_id)
+    return graph.personalized(seeds, k) if seeds else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build / refresh the castle co-visitation graph")
+    parser.add_argument("command", choices=["build", "refresh", "suggest"])
+    parser.add_argument("--k", type=int, default=5, help="number of route suggestions")
+    parser.add_argument("--size", type=int, default=4, help="castles per suggested route")
+    args = parser.parse_args()
+
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        if args.command == "build" or not os.path.exists(COVISIT_GRAPH_PATH):
+            graph = build(db)
+        else:
+            graph = refresh(db, CoVisitGraph.load(COVISIT_GRAPH_PATH))
+        graph.save(COVISIT_GRAPH_PATH)
+        print(f"castles={graph.size} visit_edges={graph.visits.nnz} route_edges={graph.routes.nnz} "
+              f"routes={len(graph.route_sets)} watermarks={graph.watermarks}")
+        if args.command == "suggest":
+            for suggestion in graph.suggest_routes(args.k, args.size):
+                print(suggestion)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+import argparse
+import functools
+import hashlib
+import importlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select, update
+
+import model
+from startup import startup
+
+
+### Embedding pipeline (ข้อความ): Castle.text_vector / Place.document_vector
+
+EMBEDDING_ENCODER = os.getenv("EMBEDDING_ENCODER", "hashing")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "indexes/embedding_cache.sqlite3")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=1 << 18)
+def _feature_hash(feature):
+    # blake2b แทน hash() ของ Python เพื่อให้ผลเหมือนกันทุก process
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+##### Encoders
+# encoder ต้องมี: name (str), dim (int), encode(list[str]) -> float32 array (n, dim)
+
+class HashingEncoder:
+    """Deterministic feature-hashing encoder (words + character trigrams).
+
+    Character trigrams keep Thai text useful without a word segmenter.
+    """
+
+    def __init__(self, dim, ngram=3):
+        self.dim = dim
+        self.ngram = ngram
+        self.name = f"hashing-{dim}-{ngram}"
+
+    def _features(self, text):
+        text = " ".join(text.lower().split())
+        features = _WORD_RE.findall(text)
+        padded = f" {text} "
+        features.extend(padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1))
+        return features
+
+    def encode(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        rows, digests = [], []
+        for row, text in enumerate(texts):
+            features = self._features(text or "")
+            rows.extend([row] * len(features))
+            digests.extend(map(_feature_hash, features))
+        if rows:
+            digests = np.asarray(digests, dtype=np.uint64)
+            cols = (digests % np.uint64(self.dim)).astype(np.int64)
+            signs = np.where(digests >> np.uint64(63), 1.0, -1.0).astype(np.float32)
+            np.add.at(out, (np.asarray(rows), cols), signs)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+
+ENCODERS = {"hashing": HashingEncoder}
+
+
+def _create_encoder(name, dim):
+    if name in ENCODERS:
+        return ENCODERS[name](dim)
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown encoder {name!r}; use one of {sorted(ENCODERS)} or 'module:Class'")
+    return getattr(importlib.import_module(module_name), class_name)(dim)
+
+
+# encoder จริง (โหลด model) ช้า -> สร้างครั้งเดียวต่อ (name, dim) แล้วใช้ร่วมกัน
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(name, dim):
+    """Resolve an encoder by registry name or ``package.module:ClassName`` (one shared instance each)."""
+    key = (name, dim)
+    if key not in _encoders:
+        with _encoders_lock:
+            if key not in _encoders:
+                with startup.timed(f"encoder:{name}"):
+                    _encoders[key] = _create_encoder(name, dim)
+    return _encoders[key]
+
+
+##### Cache (content hash -> vector) เก็บใน sqlite file
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(encoder, text):
+        return hashlib.sha256(f"{encoder.name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            # sqlite จำกัดจำนวน parameter ต่อ statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for key, blob in self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", chunk):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+
+    def close(self):
+        self._conn.close()
+
+
+def embed_texts(texts, encoder, cache=None):
+    """Encode ``texts`` in one batch, skipping anything already cached.
+
+    Returns ``(vectors, n_cache_hits)``.
+    """
+    if cache is None:
+        return encoder.encode(texts), 0
+    keys = [EmbeddingCache.key(encoder, text) for text in texts]
+    found = cache.get_many(list(set(keys)))
+    vectors = np.empty((len(texts), encoder.dim), dtype=np.float32)
+    missing = {}
+    for i, key in enumerate(keys):
+        if key in found:
+            vectors[i] = found[key]
+        else:
+            missing.setdefault(key, []).append(i)
+    if missing:
+        miss_keys = list(missing)
+        encoded = encoder.encode([texts[missing[key][0]] for key in miss_keys])
+        for key, vector in zip(miss_keys, encoded):
+            vectors[missing[key]] = vector
+        cache.put_many(zip(miss_keys, encoded))
+    return vectors, len(texts) - sum(len(rows) for rows in missing.values())
+
+
+##### Sources: ข้อความที่ใช้ encode ของแต่ละตาราง
+
+def _castle_text(row):
+    return " ".join(part for part in (row.castle_name, row.era, row.castle_description) if part)
+
+
+class EmbeddingSource:
+    def __init__(self, orm_class, pk, vector_column, dim, columns, text, joins=()):
+        self.orm_class = orm_class
+        self.pk = pk
+        self.vector_column = vector_column
+        self.dim = dim
+        self.columns = columns
+        self.text = text
+        self.joins = joins
+
+    def batch_statement(self, after_id, limit):
+        # keyset pagination บน primary key -> resume ได้และไม่ต้อง OFFSET
+        stmt = select(self.pk, *self.columns)
+        for target, onclause in self.joins:
+            stmt = stmt.outerjoin(target, onclause)
+        return stmt.where(self.pk > after_id).order_by(self.pk).limit(limit)
+
+
+# Image.image_vector ไม่อยู่ที่นี่: เป็น vector ของรูป เขียนโดย image_search.py เท่านั้น (1 column = 1 model)
+SOURCES = {
+    "castle": EmbeddingSource(
+        model.Castle, model.Castle.castle_id, "text_vector", model.TEXT_VECTOR_DIM,
+        [model.Castle.castle_name, model.Castle.era, model.Castle.castle_description],
+        _castle_text,
+    ),
+    "place": EmbeddingSource(
+        model.Place, model.Place.place_id, "document_vector", model.DOCUMENT_VECTOR_DIM,
+        # passage จาก ingest.py ใช้เนื้อความ / แถวเก่าที่ไม่มี content ใช้ชื่อเอกสาร
+        [model.Place.content, model.Document.document_name],
+        lambda row: row.content or row.document_name or "",
+        joins=[(model.Document, model.Place.document_id == model.Document.document_id)],
+    ),
+}
+
+
+##### Bulk backfill job
+class BackfillStats:
+    def __init__(self):
+        self.rows = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.last_id = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (f"rows={self.rows} unchanged={self.skipped} cache_hits={self.cache_hits} last_id={self.last_id} "
+                f"elapsed={self.elapsed:.1f}s rate={self.rows_per_sec:.0f} rows/s")
+
+
+##### Checkpoint: digest ของข้อความที่ encode ไปแล้วต่อแถว (sqlite) + ตำแหน่งของรอบที่ยังไม่จบ
+# รอบถัดไปไล่ทุกแถวใหม่ แต่ encode/UPDATE เฉพาะแถวที่ข้อความเปลี่ยน (หรือ vector ยังว่าง)
+
+def _row_digest(text):
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=16).digest()
+
+
+class BackfillCheckpoint:
+    def __init__(self, path, kind, encoder):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embedded (pk INTEGER PRIMARY KEY, digest BLOB NOT NULL)")
+            # เปลี่ยน kind / encoder -> เริ่มใหม่ทั้งหมด
+            if self._state("kind") != kind or self._state("encoder") != encoder.name:
+                self._conn.execute("DELETE FROM embedded")
+                self._conn.execute("DELETE FROM state")
+                self._set_state(kind=kind, encoder=encoder.name, last_id="0")
+        self.last_id = int(self._state("last_id") or 0)
+
+    def _state(self, key):
+        row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, **values):
+        self._conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                               [(key, str(value)) for key, value in values.items()])
+
+    def digests(self, pks):
+        found = {}
+        for start in range(0, len(pks), 500):
+            chunk = pks[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            found.update(self._conn.execute(f"SELECT pk, digest FROM embedded WHERE pk IN ({marks})", chunk))
+        return found
+
+    def record(self, items, last_id):
+        """Store ``(pk, digest)`` of a committed batch and the resume position."""
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embedded (pk, digest) VALUES (?, ?)", items)
+            self._set_state(last_id=last_id)
+        self.last_id = last_id
+
+    def finish(self):
+        # รอบจบแล้ว -> รอบหน้าเริ่มไล่จากต้นตาราง (ข้ามแถวที่ digest ไม่เปลี่ยน)
+        self.record([], 0)
+
+    def close(self):
+        self._conn.close()
+
+
+def backfill(db, kind, encoder=None, cache=None, batch_size=EMBEDDING_BATCH_SIZE, checkpoint_path=None, progress=None):
+    """Stream rows of ``kind`` in primary-key order, encode them in micro-batches
+    and write the vectors back with one bulk UPDATE per batch.
+
+    With ``checkpoint_path`` an interrupted job resumes where it stopped, and
+    rows whose text is unchanged since they were embedded are skipped.
+    """
+    source = SOURCES[kind]
+    encoder = encoder or get_encoder(EMBEDDING_ENCODER, source.dim)
+    stats = BackfillStats()
+    checkpoint = BackfillCheckpoint(checkpoint_path, kind, encoder) if checkpoint_path else None
+    stats.last_id = checkpoint.last_id if checkpoint else 0
+    pk_name = source.pk.key
+    missing = getattr(source.orm_class, source.vector_column).is_(None)
+    try:
+        while True:
+            rows = db.execute(source.batch_statement(stats.last_id, batch_size).add_columns(missing)).all()
+            if not rows:
+                break
+            texts = [source.text(row) for row in rows]
+            digests = [_row_digest(text) for text in texts]
+            known = checkpoint.digests([row[0] for row in rows]) if checkpoint else {}
+            todo = [i for i, (row, digest) in enumerate(zip(rows, digests)) if row[-1] or known.get(row[0]) != digest]
+            if todo:
+                vectors, hits = embed_texts([texts[i] for i in todo], encoder, cache)
+                db.execute(
+                    update(source.orm_class),
+                    [{pk_name: rows[i][0], source.vector_column: vector} for i, vector in zip(todo, vectors)],
+                )
+                db.commit()
+                stats.cache_hits += hits
+            stats.rows += len(todo)
+            stats.skipped += len(rows) - len(todo)
+            stats.last_id = rows[-1][0]
+            if checkpoint:
+                checkpoint.record([(rows[i][0], digests[i]) for i in todo], stats.last_id)
+            if progress:
+                progress(stats)
+        if checkpoint:
+            checkpoint.finish()
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill embedding columns")
+    parser.add_argument("kind", choices=sorted(SOURCES))
+    parser.add_argument("--encoder", default=EMBEDDING_ENCODER)
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--cache", default=EMBEDDING_CACHE_PATH)
+    parser.add_argument("--checkpoint", default=None, help="checkpoint file (default: indexes/backfill_<kind>.sqlite3)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint (re-embed every row)")
+    args = parser.parse_args()
+
+    from db import SessionLocal
+
+    checkpoint = args.checkpoint or f"indexes/backfill_{args.kind}.sqlite3"
+    if args.restart:
+        for path in (checkpoint, f"{checkpoint}-wal", f"{checkpoint}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    encoder = get_encoder(args.encoder, SOURCES[args.kind].dim)
+    cache = EmbeddingCache(args.cache)
+    db = SessionLocal()
+    try:
+        stats = backfill(db, args.kind, encoder, cache, args.batch_size, checkpoint, progress=print)
+        print(f"done: {stats}")
+        # publish vector ชุดใหม่ให้ทุก worker (สลับ version เองโดยไม่ต้อง restart)
+        import embedding_store
+        print(f"published {embedding_store.export(db, args.kind)}")
+        if args.kind == "castle":
+            # index เดิมใช้ vector ชุดเก่า -> สร้างใหม่
+            import recommend
+            recommend.build_castle_index(db).save(recommend.CASTLE_INDEX_PATH)
+        elif args.kind == "place":
+            # bulk UPDATE ไม่ผ่าน ORM event -> บอก worker ให้สร้าง place searcher ใหม่
+            import retrieval
+            retrieval.publish_places_version()
+    finally:
+        db.close()
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import LargeBinary, Text, func, select, type_coerce
+
+import embedding
+import model
+from vector_index import normalize
+
+
+### Embedding store: vector ทั้งตารางในไฟล์ binary ไฟล์เดียวต่อ version -> np.memmap แบบ read-only
+# ทุก uvicorn worker map ไฟล์เดียวกัน -> ใช้ page cache ร่วมกัน ไม่ต้องโหลดจาก Postgres / copy ต่อ worker
+# layout: [magic | header json (ขนาด HEADER_SIZE)] [ids int64 เรียงแล้ว] [vectors float32 count x dim]
+# publish version ใหม่ = เขียนไฟล์ใหม่จนเสร็จ แล้ว os.replace ไฟล์ CURRENT -> reader สลับเองโดยไม่ต้อง restart
+
+EMBEDDING_STORE_ROOT = os.getenv("EMBEDDING_STORE_ROOT", "indexes/embeddings")
+MAGIC = b"CASTEMB1"
+HEADER_SIZE = 4096
+ALIGN = 64
+EXPORT_BATCH_SIZE = 5000
+RELOAD_CHECK_SECONDS = 1.0
+
+
+# column ที่ export ได้: vector ข้อความจาก embedding.py + vector รูปจาก image_search.py (ไม่มีข้อความให้ encode)
+SOURCES = dict(embedding.SOURCES, image=embedding.EmbeddingSource(
+    model.Image, model.Image.img_id, "image_vector", model.IMAGE_VECTOR_DIM, [], None))
+
+
+def store_path(kind):
+    return os.path.join(EMBEDDING_STORE_ROOT, kind)
+
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _current_path(folder):
+    return os.path.join(folder, "CURRENT")
+
+
+def current_version(folder):
+    try:
+        with open(_current_path(folder)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class StoreWriter:
+    """Write one version sequentially (ids must arrive in ascending order)."""
+
+    def __init__(self, folder, dim, capacity):
+        self.folder = folder
+        self.dim = dim
+        self.capacity = capacity
+        os.makedirs(folder, exist_ok=True)
+        existing = [int(name[1:-4]) for name in os.listdir(folder) if name.startswith("v") and name.endswith(".bin")]
+        self.version = f"v{max(existing, default=0) + 1}.bin"
+        self.path = os.path.join(folder, self.version)
+        self.ids_offset = HEADER_SIZE
+        self.vectors_offset = _align(self.ids_offset + 8 * max(capacity, 1))
+        with open(self.path, "wb") as f:
+            f.truncate(self.vectors_offset + 4 * dim * max(capacity, 1))
+        self._ids = np.memmap(self.path, dtype=np.int64, mode="r+", offset=self.ids_offset, shape=(max(capacity, 1),))
+        self._vectors = np.memmap(self.path, dtype=np.float32, mode="r+", offset=self.vectors_offset,
+                                  shape=(max(capacity, 1), dim))
+        self.count = 0
+        self._last_id = None
+
+    def append(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        n = min(ids.shape[0], self.capacity - self.count)
+        if n <= 0:
+            return 0
+        if (self._last_id is not None and ids[0] <= self._last_id) or np.any(np.diff(ids[:n]) <= 0):
+            raise ValueError("ids must be appended in ascending order")
+        self._ids[self.count:self.count + n] = ids[:n]
+        self._vectors[self.count:self.count + n] = normalize(np.asarray(vectors[:n], dtype=np.float32))
+        self.count += n
+        self._last_id = int(ids[n - 1])
+        return n
+
+    def publish(self):
+        """Flush, write the header and atomically point CURRENT at this version."""
+        self._ids.flush()
+        self._vectors.flush()
+        del self._ids, self._vectors
+        header = json.dumps({
+            "dim": self.dim, "count": self.count, "dtype": "float32", "normalized": True,
+            "ids_offset": self.ids_offset, "vectors_offset": self.vectors_offset,
+            "created": time.time(),
+        }).encode("utf-8")
+        with open(self.path, "r+b") as f:
+            f.write(MAGIC + len(header).to_bytes(4, "little") + header)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path = _current_path(self.folder) + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.version)
+        os.replace(tmp_path, _current_path(self.folder))
+        self._prune()
+        return self.version
+
+    def _prune(self, keep=2):
+        # เก็บ version ก่อนหน้าไว้ให้ worker ที่ยัง map อยู่ (ไฟล์ที่ถูกลบแต่ยัง map อยู่ยังอ่านได้บน Linux)
+        versions = sorted(int(name[1:-4]) for name in os.listdir(self.folder)
+                          if name.startswith("v") and name.endswith(".bin"))
+        for number in versions[:-keep]:
+            try:
+                os.remove(os.path.join(self.folder, f"v{number}.bin"))
+            except OSError:
+                pass
+
+
+def open_version(path):
+    """(header, ids, vectors) memory-mapped read-only."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an embedding store file")
+        header = json.loads(f.read(int.from_bytes(f.read(4), "little")))
+    count, dim = header["count"], header["dim"]
+    if count == 0:
+        return header, np.empty(0, dtype=np.int64), np.empty((0, dim), dtype=np.float32)
+    ids = np.memmap(path, dtype=np.int64, mode="r", offset=header["ids_offset"], shape=(count,))
+    vectors = np.memmap(path, dtype=np.float32, mode="r", offset=header["vectors_offset"], shape=(count, dim))
+    return header, ids, vectors
+
+
+class EmbeddingStore:
+    """Read-only view of the current version of one store; ``refresh()`` swaps to a newer one."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.version = None
+        self.dim = None
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def refresh(self, force=False):
+        """Reopen if CURRENT changed. Returns True when a new version was mapped."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return False
+        self._checked_at = now
+        version = current_version(self.folder)
+        if version is None or version == self.version:
+            return False
+        header, ids, vectors = open_version(os.path.join(self.folder, version))
+        with self._lock:
+            # สลับทั้งชุดพร้อมกัน; ใครถือ array เดิมอยู่ก็อ่านต่อได้จนปล่อย
+            self.ids, self.vectors, self.dim, self.version = ids, vectors, header["dim"], version
+        return True
+
+    def rows(self, ids):
+        """Row of each id in this version (-1 when missing)."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        with self._lock:
+            store_ids = self.ids
+        rows = np.searchsorted(store_ids, ids)
+        rows = np.minimum(rows, max(store_ids.shape[0] - 1, 0))
+        found = store_ids[rows] == ids if store_ids.shape[0] else np.zeros(ids.shape[0], dtype=bool)
+        return np.where(found, rows, -1)
+
+    def get(self, ids):
+        """(vectors, found) for ``ids``; missing ids get zero vectors."""
+        with self._lock:
+            vectors = self.vectors
+        rows = self.rows(ids)
+        found = rows >= 0
+        out = np.zeros((rows.shape[0], vectors.shape[1]), dtype=np.float32)
+        out[found] = vectors[rows[found]]
+        return out, found
+
+
+def exists(folder):
+    return current_version(folder) is not None
+
+
+##### Export จาก DB (keyset บน primary key -> ids เรียงอยู่แล้ว)
+
+def _vector_column(db, column):
+    # Postgres: vector_send() = binary (int16 dim, int16 unused, float4 big-endian) -> ไม่ต้อง parse ข้อความ
+    if db.get_bind().dialect.name == "postgresql":
+        return type_coerce(func.vector_send(column), LargeBinary)
+    return type_coerce(column, Text)
+
+
+def _parse_vectors(values, dim):
+    if values and isinstance(values[0], (bytes, bytearray, memoryview)):
+        out = np.empty((len(values), dim), dtype=np.float32)
+        for row, value in enumerate(values):
+            out[row] = np.frombuffer(value, dtype=">f4", count=dim, offset=4)
+        return out
+    # ข้อความ "[1,2,...]": parse ทั้ง batch ทีเดียว แทนทีละแถว
+    joined = ",".join(text.strip()[1:-1] for text in values)
+    return np.fromstring(joined, dtype=np.float32, sep=",").reshape(len(values), dim)
+
+
+def export(db, kind, folder=None, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    source = SOURCES[kind]
+    column = getattr(source.orm_class, source.vector_column)
+    folder = folder or store_path(kind)
+    capacity = db.scalar(select(func.count()).select_from(source.orm_class).where(column.isnot(None))) or 0
+    writer = StoreWriter(folder, source.dim, capacity)
+    last_id = 0
+    while writer.count < capacity:
+        rows = db.execute(
+            select(source.pk, _vector_column(db, column)).where(column.isnot(None)).where(source.pk > last_id)
+            .order_by(source.pk).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        writer.append([r[0] for r in rows], _parse_vectors([r[1] for r in rows], source.dim))
+        last_id = rows[-1][0]
+        if progress:
+            progress(f"{kind}: {writer.count}/{capacity}")
+    return writer.publish()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export embedding columns to the memory-mapped store")
+    parser.add_argument("kind", choices=sorted(SOURCES))
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        version = export(db, args.kind, batch_size=args.batch_size, progress=print)
+        print(f"published {store_path(args.kind)}/{version}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
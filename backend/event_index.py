@@ -0,0 +1,381 @@
+import datetime
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import model
+from startup import CatalogVersion, building, startup
+
+
+### Event time-window index: "มี event อะไรในช่วงวันที่นี้" / "ตอนนี้มีอะไรใกล้ๆ"
+# ทั้งหมด: แบ่ง event ตามความยาว (log2 ของ duration) แต่ละกลุ่มเรียงตาม start
+#   -> overlap [s, e] = start อยู่ใน [s - ความยาวสูงสุดของกลุ่ม, e] (searchsorted) แล้วกรอง end >= s
+#   event ยาวทั้งปีไม่ทำให้ event สั้นๆ ต้อง scan เยอะ เพราะอยู่คนละกลุ่ม
+# ต่อ castle / จังหวัด: แถวเรียงตาม (castle_id, start) + offsets -> ดึงช่วงของแต่ละ castle แบบ vectorized
+# เพิ่ม/แก้: เก็บใน delta + mark แถวเก่าว่าตาย -> rebuild เมื่อ delta ใหญ่ / event ที่จบนานแล้ว expire ออก
+
+EVENT_RETENTION_DAYS = float(os.getenv("EVENT_RETENTION_DAYS", "30")) # เก็บ event ที่จบไปแล้วไว้กี่วัน
+EXPIRE_INTERVAL_SECONDS = float(os.getenv("EVENT_EXPIRE_INTERVAL", "3600"))
+EVENT_BOOST_WEIGHT = float(os.getenv("EVENT_BOOST_WEIGHT", "0.1")) # สัดส่วนของช่วงคะแนนที่บวกให้ castle ที่มี event
+EVENT_BOOST_DAYS = float(os.getenv("EVENT_BOOST_DAYS", "14")) # event ที่เริ่มภายในกี่วันข้างหน้านับเป็น boost
+LOAD_BATCH_SIZE = 5000
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _seconds(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return int((value - _EPOCH).total_seconds())
+
+
+def _event_span(start, end):
+    """(start, end) datetimes; a missing end means the event lasts until the end of its start day."""
+    if end is None or end < start:
+        end = datetime.datetime.combine(start.date(), datetime.time.max, tzinfo=start.tzinfo)
+    return start, end
+
+
+class IntervalSet:
+    """Static overlap search over (start, end) seconds, bucketed by length class."""
+
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        length_class = np.floor(np.log2(np.maximum(ends - starts, 1))).astype(np.int64)
+        self.order = np.lexsort((starts, length_class))
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        classes = length_class[self.order]
+        bounds = np.flatnonzero(np.diff(classes)) + 1
+        edges = np.concatenate([[0], bounds, [classes.shape[0]]]).tolist()
+        self._buckets = [
+            (lo, hi, int((self.ends[lo:hi] - self.starts[lo:hi]).max()))
+            for lo, hi in zip(edges[:-1], edges[1:]) if hi > lo
+        ]
+
+    def overlapping(self, start, end):
+        """Original row numbers of intervals with start <= ``end`` and end >= ``start``."""
+        found = []
+        for lo, hi, longest in self._buckets:
+            a = lo + int(np.searchsorted(self.starts[lo:hi], start - longest, side="left"))
+            b = lo + int(np.searchsorted(self.starts[lo:hi], end, side="right"))
+            if b > a:
+                rows = np.arange(a, b)
+                found.append(rows[self.ends[rows] >= start])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return self.order[np.concatenate(found)]
+
+
+class EventIndex:
+    def __init__(self, rebuild_fraction=0.05, min_rebuild=500):
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self._events = {} # event_id -> (castle_id, start, end)
+        self.castle_location = {}
+        self.location_province = {}
+        self._ids = np.empty(0, dtype=np.int64)
+        self._castles = np.empty(0, dtype=np.int64)
+        self._starts = np.empty(0, dtype=np.int64)
+        self._ends = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._row_of = {}
+        self._all = IntervalSet([], [])
+        self._castle_keys = np.empty(0, dtype=np.int64)
+        self._castle_offsets = np.zeros(1, dtype=np.int64)
+        self._castle_rows = np.empty(0, dtype=np.int64)
+        self._delta = {}
+        self._province_castles = None
+        self.expired_before = None
+        self.expired_at = 0.0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._events)
+
+    def castle_province(self, castle_id):
+        return self.location_province.get(self.castle_location.get(castle_id))
+
+    def province_castles(self, province):
+        with self._lock:
+            if self._province_castles is None:
+                grouped = {}
+                for castle_id, location_id in self.castle_location.items():
+                    grouped.setdefault(self.location_province.get(location_id), []).append(castle_id)
+                self._province_castles = grouped
+            return self._province_castles.get(province, [])
+
+    def load(self, db):
+        for location_id, province in db.query(model.Location.location_id, model.Location.province):
+            self.location_province[location_id] = province
+        self.castle_location = dict(db.query(model.LocationCastle.castle_id, model.LocationCastle.location_id))
+        cutoff = self._cutoff()
+        query = (
+            db.query(model.Event.event_id, model.Event.castle_id, model.Event.event_start, model.Event.event_end)
+            .filter(model.Event.event_start.isnot(None))
+        )
+        if cutoff is not None:
+            query = query.filter((model.Event.event_end.is_(None)) | (model.Event.event_end >= cutoff))
+        for event_id, castle_id, start, end in query.yield_per(LOAD_BATCH_SIZE):
+            self._events[event_id] = (castle_id, *_event_span(start, end))
+        self.expired_before = cutoff
+        self.expired_at = time.monotonic()
+        self.rebuild()
+        return self
+
+    def rebuild(self):
+        with self._lock:
+            n = len(self._events)
+            self._ids = np.fromiter(self._events.keys(), dtype=np.int64, count=n)
+            values = list(self._events.values())
+            self._castles = np.array([v[0] or 0 for v in values], dtype=np.int64)
+            self._starts = np.array([_seconds(v[1]) for v in values], dtype=np.int64)
+            self._ends = np.array([_seconds(v[2]) for v in values], dtype=np.int64)
+            self._alive = np.ones(n, dtype=bool)
+            self._row_of = {event_id: row for row, event_id in enumerate(self._ids.tolist())}
+            self._all = IntervalSet(self._starts, self._ends)
+            # แถวเรียงตาม (castle, start) + offset ของแต่ละ castle
+            self._castle_rows = np.lexsort((self._starts, self._castles))
+            sorted_castles = self._castles[self._castle_rows]
+            self._castle_keys, first = np.unique(sorted_castles, return_index=True)
+            self._castle_offsets = np.append(first, n).astype(np.int64)
+            self._delta = {}
+
+    ##### เพิ่ม / ลบ / expire
+
+    def upsert(self, rows):
+        """rows: [(event_id, castle_id, event_start, event_end), ...]"""
+        with self._lock:
+            for event_id, castle_id, start, end in rows:
+                self._kill(event_id)
+                if start is None:
+                    self._events.pop(event_id, None)
+                    continue
+                span = (castle_id, *_event_span(start, end))
+                self._events[event_id] = span
+                self._delta[event_id] = span
+            self._maybe_rebuild()
+
+    def remove(self, event_ids):
+        with self._lock:
+            for event_id in event_ids:
+                self._kill(event_id)
+                self._events.pop(event_id, None)
+            self._maybe_rebuild()
+
+    def _kill(self, event_id):
+        row = self._row_of.get(event_id)
+        if row is not None:
+            self._alive[row] = False
+        self._delta.pop(event_id, None)
+
+    def _maybe_rebuild(self):
+        dead = self._alive.shape[0] - int(self._alive.sum())
+        if len(self._delta) + dead > max(self.min_rebuild, self.rebuild_fraction * self._ids.shape[0]):
+            self.rebuild()
+
+    def _cutoff(self, now=None):
+        if EVENT_RETENTION_DAYS < 0:
+            return None
+        return (now or datetime.datetime.now()) - datetime.timedelta(days=EVENT_RETENTION_DAYS)
+
+    def expire(self, now=None):
+        """Drop events that ended before the retention cutoff; returns how many went."""
+        cutoff = self._cutoff(now)
+        self.expired_at = time.monotonic()
+        if cutoff is None:
+            return 0
+        limit = _seconds(cutoff)
+        with self._lock:
+            old = self._ids[self._alive & (self._ends < limit)].tolist()
+            old += [event_id for event_id, (_, _, end) in self._delta.items() if _seconds(end) < limit]
+            self.remove(old)
+            self.expired_before = cutoff
+        return len(old)
+
+    ##### Query
+
+    def _delta_arrays(self):
+        if not self._delta:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        values = list(self._delta.values())
+        return (np.fromiter(self._delta.keys(), dtype=np.int64, count=len(values)),
+                np.array([v[0] or 0 for v in values], dtype=np.int64),
+                np.array([_seconds(v[1]) for v in values], dtype=np.int64),
+                np.array([_seconds(v[2]) for v in values], dtype=np.int64))
+
+    def _castle_candidate_rows(self, castle_ids):
+        positions = np.searchsorted(self._castle_keys, castle_ids)
+        valid = positions < self._castle_keys.shape[0]
+        positions = positions[valid]
+        positions = positions[self._castle_keys[positions] == castle_ids[valid]]
+        if positions.size == 0:
+            return np.empty(0, dtype=np.int64)
+        lo, hi = self._castle_offsets[positions], self._castle_offsets[positions + 1]
+        # ต่อช่วง [lo, hi) ของทุก castle เป็น array เดียว (ไม่วน python ต่อ castle)
+        lengths = hi - lo
+        starts_of = np.repeat(lo - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return self._castle_rows[np.arange(lengths.sum()) + starts_of]
+
+    def _matching(self, start, end, castle_ids=None):
+        """(event ids, castle ids, start seconds) overlapping [start, end] given in seconds."""
+        with self._lock:
+            if castle_ids is None:
+                rows = self._all.overlapping(start, end)
+            else:
+                wanted = np.asarray(castle_ids if isinstance(castle_ids, np.ndarray) else list(castle_ids),
+                                    dtype=np.int64)
+                if wanted.shape[0] * 4 > self._castle_keys.shape[0]:
+                    # castle เยอะ (เช่น candidate ทั้งชุดของ re-ranker) -> ค้นทั้งหมดแล้วกรองถูกกว่า
+                    rows = self._all.overlapping(start, end)
+                    rows = rows[np.isin(self._castles[rows], wanted)]
+                else:
+                    wanted = np.unique(wanted)
+                    rows = self._castle_candidate_rows(wanted)
+                    rows = rows[(self._starts[rows] <= end) & (self._ends[rows] >= start)]
+            rows = rows[self._alive[rows]]
+            delta_ids, delta_castles, delta_starts, delta_ends = self._delta_arrays()
+            keep = (delta_starts <= end) & (delta_ends >= start)
+            if castle_ids is not None:
+                keep &= np.isin(delta_castles, wanted)
+            return (np.concatenate([self._ids[rows], delta_ids[keep]]),
+                    np.concatenate([self._castles[rows], delta_castles[keep]]),
+                    np.concatenate([self._starts[rows], delta_starts[keep]]))
+
+    def overlapping(self, start, end, castle_ids=None, province=None, limit=None):
+        """Events overlapping [start, end] -> [(event_id, castle_id, event_start, event_end)] by start."""
+        if province is not None:
+            in_province = self.province_castles(province)
+            castle_ids = in_province if castle_ids is None else sorted(set(castle_ids) & set(in_province))
+        with self._lock:
+            ids, _, begins = self._matching(_seconds(start), _seconds(end), castle_ids)
+            order = np.argsort(begins, kind="stable")
+            if limit is not None:
+                order = order[:limit]
+            return [(event_id, *self._events[event_id]) for event_id in ids[order].tolist()]
+
+    def castle_windows(self, castle_ids, start, end):
+        """First-ending event per castle overlapping [start, end] -> {castle_id: (event_id, start, end)}."""
+        windows = {}
+        for event_id, castle_id, event_start, event_end in sorted(
+                self.overlapping(start, end, castle_ids), key=lambda row: (row[3], row[0])):
+            windows.setdefault(castle_id, (event_id, event_start, event_end))
+        return windows
+
+    def active_counts(self, castle_ids, start, end):
+        """Number of events overlapping [start, end] for each of ``castle_ids`` (numpy array)."""
+        castle_ids = np.asarray(castle_ids, dtype=np.int64)
+        counts = np.zeros(castle_ids.shape[0], dtype=np.int64)
+        if castle_ids.size == 0:
+            return counts
+        _, found, _ = self._matching(_seconds(start), _seconds(end), castle_ids)
+        unique, per_castle = np.unique(found, return_counts=True)
+        if unique.size == 0:
+            return counts
+        positions = np.minimum(np.searchsorted(unique, castle_ids), unique.shape[0] - 1)
+        hit = unique[positions] == castle_ids
+        counts[hit] = per_castle[positions[hit]]
+        return counts
+
+    def happening_now(self, geo, lat, lon, radius_km=50.0, now=None, limit=None):
+        """Events running at ``now`` at castles within ``radius_km`` -> [(event_id, castle_id, start, end, km)]."""
+        now = now or datetime.datetime.now()
+        nearby = dict(geo.within(lat, lon, radius_km))
+        if not nearby:
+            return []
+        rows = self.overlapping(now, now, list(nearby))
+        rows.sort(key=lambda row: (nearby[row[1]], row[3]))
+        if limit is not None:
+            rows = rows[:limit]
+        return [(*row, nearby[row[1]]) for row in rows]
+
+    def apply_location_changes(self, locations, links, unlinked):
+        with self._lock:
+            self.location_province.update(locations)
+            for castle_id, location_id in links:
+                self.castle_location[castle_id] = location_id
+            for castle_id in unlinked:
+                self.castle_location.pop(castle_id, None)
+            if locations or links or unlinked:
+                self._province_castles = None
+
+
+def boost_by_events(index, ranked, start=None, days=EVENT_BOOST_DAYS, weight=EVENT_BOOST_WEIGHT):
+    """Re-rank [(castle_id, score), ...] adding ``weight`` x score range to castles with upcoming events."""
+    if not ranked or weight <= 0:
+        return ranked
+    start = start or datetime.datetime.now()
+    castle_ids = np.array([c for c, _ in ranked], dtype=np.int64)
+    scores = np.array([s for _, s in ranked], dtype=np.float64)
+    active = index.active_counts(castle_ids, start, start + datetime.timedelta(days=days)) > 0
+    if not active.any():
+        return ranked
+    span = scores.max() - scores.min() if scores.shape[0] > 1 else abs(scores[0])
+    boosted = scores + weight * (span or 1.0) * active
+    order = np.argsort(-boosted, kind="stable")
+    return [(int(castle_ids[i]), float(boosted[i])) for i in order]
+
+
+_event_index = None
+_event_index_lock = threading.Lock()
+_event_index_version = CatalogVersion()
+
+
+def get_event_index(db):
+    global _event_index
+    if _event_index is None:
+        with building(_event_index_lock, "event_index"):
+            if _event_index is None:
+                _event_index_version.mark()
+                with startup.timed("event_index"):
+                    _event_index = EventIndex().load(db)
+    elif _event_index_version.changed() and _event_index_lock.acquire(blocking=False):
+        # bulk import จาก process อื่น -> โหลดใหม่แล้วสลับ
+        try:
+            _event_index_version.mark()
+            with startup.timed("event_index"):
+                _event_index = EventIndex().load(db)
+        finally:
+            _event_index_lock.release()
+    elif time.monotonic() - _event_index.expired_at > EXPIRE_INTERVAL_SECONDS:
+        _event_index.expire()
+    return _event_index
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_event_changes(session, flush_context):
+    if _event_index is None:
+        return
+    pending = session.info.setdefault(
+        "event_index_pending", {"events": [], "removed": [], "locations": {}, "links": [], "unlinked": []})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, model.Event):
+            pending["events"].append((obj.event_id, obj.castle_id, obj.event_start, obj.event_end))
+        elif isinstance(obj, model.Location):
+            pending["locations"][obj.location_id] = obj.province
+        elif isinstance(obj, model.LocationCastle):
+            pending["links"].append((obj.castle_id, obj.location_id))
+    for obj in session.deleted:
+        if isinstance(obj, model.Event):
+            pending["removed"].append(obj.event_id)
+        elif isinstance(obj, model.LocationCastle):
+            pending["unlinked"].append(obj.castle_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_event_changes(session):
+    pending = session.info.pop("event_index_pending", None)
+    if pending and _event_index is not None:
+        _event_index.apply_location_changes(pending["locations"], pending["links"], pending["unlinked"])
+        _event_index.upsert(pending["events"])
+        _event_index.remove(pending["removed"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_event_changes(session):
+    session.info.pop("event_index_pending", None)
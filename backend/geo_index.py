@@ -0,0 +1,242 @@
+import threading
+
+import numpy as np
+from scipy.spatial import cKDTree
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import model
+from startup import CatalogVersion, building, startup
+
+
+### Geospatial index สำหรับ "castle ใกล้ฉัน" / "ภายใน X km"
+# แปลง lat/lon เป็นจุดบน unit sphere (x, y, z) แล้วใช้ KD-tree
+# ระยะ chord บน sphere สัมพันธ์กับระยะ great-circle แบบ monotonic -> query ได้ตรง แล้ว refine ด้วย haversine
+
+EARTH_RADIUS_KM = 6371.0088
+LOAD_BATCH_SIZE = 10000
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _unit_xyz(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def _chord(distance_km):
+    return 2.0 * np.sin(np.minimum(distance_km / EARTH_RADIUS_KM, np.pi) / 2.0)
+
+
+class GeoIndex:
+    """Point index keyed by integer id with radius and k-nearest queries.
+
+    Points live in a static KD-tree plus a small delta buffer. Updates and
+    deletes mark the old tree entry stale; the tree is rebuilt once the delta
+    grows past ``rebuild_fraction`` of the tree size.
+    """
+
+    def __init__(self, rebuild_fraction=0.05, min_rebuild=1000):
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+        self._points = {}
+        self._tree = None
+        self._tree_ids = np.empty(0, dtype=np.int64)
+        self._tree_lat = np.empty(0)
+        self._tree_lon = np.empty(0)
+        self._delta = {}
+        self._stale = set()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def rebuild(self):
+        with self._lock:
+            ids = np.fromiter(self._points.keys(), dtype=np.int64, count=len(self._points))
+            coords = np.array(list(self._points.values()), dtype=np.float64).reshape(-1, 2)
+            self._tree_ids = ids
+            self._tree_lat = coords[:, 0]
+            self._tree_lon = coords[:, 1]
+            self._tree = cKDTree(_unit_xyz(coords[:, 0], coords[:, 1])) if ids.size else None
+            self._delta = {}
+            self._stale = set()
+
+    def upsert(self, ids, lats, lons):
+        with self._lock:
+            for item_id, lat, lon in zip(np.asarray(ids).tolist(), np.asarray(lats).tolist(), np.asarray(lons).tolist()):
+                if lat is None or lon is None:
+                    self.remove([item_id])
+                    continue
+                if item_id in self._points:
+                    self._stale.add(item_id)
+                self._points[item_id] = (lat, lon)
+                self._delta[item_id] = (lat, lon)
+            self._maybe_rebuild()
+
+    def remove(self, ids):
+        with self._lock:
+            for item_id in ids:
+                if self._points.pop(item_id, None) is not None:
+                    self._stale.add(item_id)
+                    self._delta.pop(item_id, None)
+            self._maybe_rebuild()
+
+    def _maybe_rebuild(self):
+        if len(self._delta) + len(self._stale) > max(self.min_rebuild, self.rebuild_fraction * self._tree_ids.size):
+            self.rebuild()
+
+    def _delta_arrays(self):
+        if not self._delta:
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+        ids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+        coords = np.array(list(self._delta.values()), dtype=np.float64)
+        return ids, coords[:, 0], coords[:, 1]
+
+    def _fresh(self, rows):
+        # ตัด entry ใน tree ที่ถูกแก้/ลบไปแล้ว
+        if not self._stale or rows.size == 0:
+            return rows
+        stale = np.fromiter(self._stale, dtype=np.int64, count=len(self._stale))
+        return rows[~np.isin(self._tree_ids[rows], stale)]
+
+    def _merge(self, ids, distances, limit):
+        order = np.argsort(distances, kind="stable")
+        if limit is not None:
+            order = order[:max(limit, 0)]
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+    def within(self, lat, lon, radius_km, limit=None):
+        """All (id, distance_km) within ``radius_km``, nearest first."""
+        with self._lock:
+            ids, dists = [], []
+            if self._tree is not None:
+                rows = np.asarray(self._tree.query_ball_point(_unit_xyz(lat, lon)[0], _chord(radius_km)), dtype=np.int64)
+                rows = self._fresh(rows)
+                ids.append(self._tree_ids[rows])
+                dists.append(haversine_km(lat, lon, self._tree_lat[rows], self._tree_lon[rows]))
+            delta_ids, delta_lat, delta_lon = self._delta_arrays()
+            delta_dist = haversine_km(lat, lon, delta_lat, delta_lon)
+            keep = delta_dist <= radius_km
+            ids.append(delta_ids[keep])
+            dists.append(delta_dist[keep])
+        ids, dists = np.concatenate(ids), np.concatenate(dists)
+        inside = dists <= radius_km
+        return self._merge(ids[inside], dists[inside], limit)
+
+    def nearest(self, lat, lon, k=10):
+        """The ``k`` nearest (id, distance_km), nearest first."""
+        if k <= 0:
+            return []
+        with self._lock:
+            ids, dists = [], []
+            if self._tree is not None:
+                want = min(k + len(self._stale), self._tree_ids.size)
+                _, rows = self._tree.query(_unit_xyz(lat, lon)[0], k=want)
+                rows = self._fresh(np.atleast_1d(rows).astype(np.int64))
+                ids.append(self._tree_ids[rows])
+                dists.append(haversine_km(lat, lon, self._tree_lat[rows], self._tree_lon[rows]))
+            delta_ids, delta_lat, delta_lon = self._delta_arrays()
+            ids.append(delta_ids)
+            dists.append(haversine_km(lat, lon, delta_lat, delta_lon))
+        return self._merge(np.concatenate(ids), np.concatenate(dists), k)
+
+
+##### Castle index (castle_id -> พิกัดจาก Location ผ่าน LocationCastle)
+
+class CastleGeoIndex(GeoIndex):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.locations = {}
+        self.castle_location = {}
+
+    def load(self, db):
+        for location_id, lat, lon in db.query(
+                model.Location.location_id, model.Location.latitude, model.Location.longitude).yield_per(LOAD_BATCH_SIZE):
+            self.locations[location_id] = (lat, lon)
+        for castle_id, location_id in db.query(
+                model.LocationCastle.castle_id, model.LocationCastle.location_id).yield_per(LOAD_BATCH_SIZE):
+            self.castle_location[castle_id] = location_id
+            lat, lon = self.locations.get(location_id, (None, None))
+            if lat is not None and lon is not None:
+                self._points[castle_id] = (lat, lon)
+        self.rebuild()
+        return self
+
+    def apply_changes(self, locations, links, unlinked):
+        """Apply committed Location / LocationCastle changes."""
+        with self._lock:
+            self.locations.update(locations)
+            for castle_id, location_id in links:
+                self.castle_location[castle_id] = location_id
+            for castle_id in unlinked:
+                self.castle_location.pop(castle_id, None)
+            changed_locations = set(locations)
+            touched = {castle_id for castle_id, _ in links}
+            touched.update(c for c, loc in self.castle_location.items() if loc in changed_locations)
+            self.remove(list(unlinked))
+            ids, lats, lons = [], [], []
+            for castle_id in touched:
+                lat, lon = self.locations.get(self.castle_location.get(castle_id), (None, None))
+                ids.append(castle_id)
+                lats.append(lat)
+                lons.append(lon)
+            if ids:
+                self.upsert(ids, lats, lons)
+
+
+_castle_index = None
+_castle_index_lock = threading.Lock()
+_castle_index_version = CatalogVersion()
+
+
+def get_castle_geo_index(db):
+    global _castle_index
+    if _castle_index is None:
+        with building(_castle_index_lock, "geo_index"):
+            if _castle_index is None:
+                _castle_index_version.mark()
+                with startup.timed("geo_index"):
+                    _castle_index = CastleGeoIndex().load(db)
+    elif _castle_index_version.changed() and _castle_index_lock.acquire(blocking=False):
+        # bulk import จาก process อื่น -> โหลดใหม่แล้วสลับ ระหว่างโหลด request อื่นใช้ตัวเดิม
+        try:
+            _castle_index_version.mark()
+            with startup.timed("geo_index"):
+                _castle_index = CastleGeoIndex().load(db)
+        finally:
+            _castle_index_lock.release()
+    return _castle_index
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_location_changes(session, flush_context):
+    if _castle_index is None:
+        return
+    pending = session.info.setdefault("geo_pending", {"locations": {}, "links": [], "unlinked": []})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, model.Location):
+            pending["locations"][obj.location_id] = (obj.latitude, obj.longitude)
+        elif isinstance(obj, model.LocationCastle):
+            pending["links"].append((obj.castle_id, obj.location_id))
+    for obj in session.deleted:
+        if isinstance(obj, model.LocationCastle):
+            pending["unlinked"].append(obj.castle_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_location_changes(session):
+    pending = session.info.pop("geo_pending", None)
+    if pending and _castle_index is not None:
+        _castle_index.apply_changes(pending["locations"], pending["links"], pending["unlinked"])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_location_changes(session):
+    session.info.pop("geo_pending", None)
@@ -0,0 +1,364 @@
+import argparse
+import importlib
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select, update
+
+import embedding_store
+import model
+from startup import building, startup
+from vector_index import normalize
+
+
+### Image similarity: "castle ไหนหน้าตาเหมือนรูปนี้"
+# encoder (batch, เปลี่ยนได้) -> image_vector -> index แบบ int8 scalar quantization (memory 1/4 ของ float32)
+# ผลลัพธ์ระดับรูป -> รวมเป็นระดับ castle (score สูงสุดของรูปในแต่ละ castle)
+# backend: local (ใน process) หรือ milvus (IMAGE_INDEX_BACKEND=milvus, ต้อง pip install pymilvus)
+
+IMAGE_ENCODER = os.getenv("IMAGE_ENCODER", "stub")
+IMAGE_INDEX_BACKEND = os.getenv("IMAGE_INDEX_BACKEND", "local")
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+MILVUS_COLLECTION = os.getenv("MILVUS_COLLECTION", "castle_images")
+IMAGE_BATCH_SIZE = int(os.getenv("IMAGE_BATCH_SIZE", "64"))
+# ขนาดรูปสูงสุดที่ POST /images/search รับ (เกิน -> 413)
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+RERANK_FACTOR = 4 # ดึง candidate จาก index int8 มากกว่าที่ต้องการ แล้วเรียงใหม่ด้วย vector เต็ม (ถ้ามี)
+LOAD_BATCH_SIZE = 5000
+_SCAN_CHUNK = 65536
+
+
+##### Encoders: encode(list of image bytes) -> (n, dim) float32 normalized
+
+class StubImageEncoder:
+    """Deterministic stand-in for a real image model (tests / local dev).
+
+    Byte histogram plus hashed byte 4-grams, so identical and near-identical
+    files land close together. Not a perceptual model.
+    """
+
+    def __init__(self, dim=model.IMAGE_VECTOR_DIM):
+        self.dim = dim
+        self.name = f"stub-image-{dim}"
+
+    def encode(self, images):
+        out = np.zeros((len(images), self.dim), dtype=np.float32)
+        histogram_dim = min(256, self.dim // 2)
+        for row, data in enumerate(images):
+            data = np.frombuffer(bytes(data), dtype=np.uint8)
+            if data.size == 0:
+                continue
+            out[row, :histogram_dim] = np.bincount(data.astype(np.int64) * histogram_dim // 256,
+                                                   minlength=histogram_dim) / data.size
+            if data.size >= 4:
+                grams = data[:-3].astype(np.uint32) << 24 | data[1:-2].astype(np.uint32) << 16 \
+                    | data[2:-1].astype(np.uint32) << 8 | data[3:].astype(np.uint32)
+                buckets = (grams * np.uint32(2654435761)) % np.uint32(self.dim - histogram_dim)
+                out[row, histogram_dim:] = np.bincount(buckets, minlength=self.dim - histogram_dim) / grams.size
+        return normalize(out)
+
+
+IMAGE_ENCODERS = {"stub": StubImageEncoder}
+
+
+def _create_image_encoder(name, dim):
+    if name in IMAGE_ENCODERS:
+        return IMAGE_ENCODERS[name](dim)
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown image encoder {name!r}; use one of {sorted(IMAGE_ENCODERS)} or 'module:Class'")
+    return getattr(importlib.import_module(module_name), class_name)(dim)
+
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def get_image_encoder(name=IMAGE_ENCODER, dim=model.IMAGE_VECTOR_DIM):
+    """Resolve an encoder by registry name or ``package.module:ClassName`` (one shared instance each)."""
+    key = (name, dim)
+    if key not in _encoders:
+        with _encoders_lock:
+            if key not in _encoders:
+                with startup.timed(f"image_encoder:{name}"):
+                    _encoders[key] = _create_image_encoder(name, dim)
+    return _encoders[key]
+
+
+##### Local backend: int8 scalar quantization
+
+class Int8ImageIndex:
+    """Cosine search over int8 codes with a per-dimension scale.
+
+    ``vectors`` (optional, e.g. the mmap embedding store) are used only to
+    re-rank the top candidates exactly; the codes alone are 1/4 the size of
+    float32 vectors.
+    """
+
+    def __init__(self, dim=model.IMAGE_VECTOR_DIM):
+        self.dim = dim
+        self.ids = np.empty(0, dtype=np.int64)
+        self.castle_ids = np.empty(0, dtype=np.int64)
+        self.codes = np.empty((0, dim), dtype=np.int8)
+        self.scale = np.ones(dim, dtype=np.float32)
+        self.exact = None
+        self._positions = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def _encode(self, vectors):
+        return np.clip(np.rint(vectors / self.scale * 127.0), -127, 127).astype(np.int8)
+
+    def build(self, ids, castle_ids, vectors, exact=None):
+        vectors = normalize(vectors)
+        with self._lock:
+            self.ids = np.asarray(ids, dtype=np.int64)
+            self.castle_ids = np.asarray(castle_ids, dtype=np.int64)
+            peak = np.abs(vectors).max(axis=0) if vectors.shape[0] else np.ones(self.dim, dtype=np.float32)
+            self.scale = np.where(peak > 0, peak, 1.0).astype(np.float32)
+            self.codes = self._encode(vectors)
+            self.exact = exact
+            self._positions = {item_id: row for row, item_id in enumerate(self.ids.tolist())}
+        return self
+
+    def add(self, ids, castle_ids, vectors):
+        """Upsert with the existing scale (values past the scale are clipped)."""
+        vectors = normalize(vectors)
+        with self._lock:
+            codes = self._encode(vectors)
+            self.exact = None # vector ใน store เก่ากว่า code ที่เพิ่งเขียน -> ใช้ code อย่างเดียว
+            new_rows = []
+            for i, (item_id, castle_id) in enumerate(zip(np.asarray(ids).tolist(), np.asarray(castle_ids).tolist())):
+                row = self._positions.get(item_id)
+                if row is None:
+                    new_rows.append(i)
+                else:
+                    self.codes[row] = codes[i]
+                    self.castle_ids[row] = castle_id
+            if new_rows:
+                start = self.ids.shape[0]
+                self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)[new_rows]])
+                self.castle_ids = np.concatenate([self.castle_ids, np.asarray(castle_ids, dtype=np.int64)[new_rows]])
+                self.codes = np.concatenate([self.codes, codes[new_rows]])
+                for offset, i in enumerate(new_rows):
+                    self._positions[int(np.asarray(ids)[i])] = start + offset
+
+    def search(self, vector, k=10):
+        """[(img_id, castle_id, score), ...] best first."""
+        query = normalize(vector)[0] * self.scale / 127.0
+        with self._lock:
+            n = self.ids.shape[0]
+            if n == 0:
+                return []
+            scores = np.empty(n, dtype=np.float32)
+            for start in range(0, n, _SCAN_CHUNK):
+                scores[start:start + _SCAN_CHUNK] = self.codes[start:start + _SCAN_CHUNK].astype(np.float32) @ query
+            want = min(n, k * RERANK_FACTOR if self.exact is not None else k)
+            best = np.argpartition(-scores, want - 1)[:want]
+            if self.exact is not None:
+                exact_vectors, found = self.exact.get(self.ids[best])
+                scores[best[found]] = exact_vectors[found] @ normalize(vector)[0]
+            best = best[np.argsort(-scores[best])][:k]
+            return list(zip(self.ids[best].tolist(), self.castle_ids[best].tolist(), scores[best].tolist()))
+
+
+class LocalImageBackend:
+    def __init__(self, dim=model.IMAGE_VECTOR_DIM):
+        self.index = Int8ImageIndex(dim)
+        self.store = None
+        self._checked_at = time.monotonic()
+
+    def changed(self):
+        """True once a store version newer than the loaded data is published."""
+        if self.store is not None:
+            return self.store.refresh()
+        # โหลดจาก DB -> เช็คว่ามีการ export store ครั้งแรกหรือยัง (ไม่บ่อยกว่า RELOAD_CHECK_SECONDS)
+        now = time.monotonic()
+        if now - self._checked_at < embedding_store.RELOAD_CHECK_SECONDS:
+            return False
+        self._checked_at = now
+        return embedding_store.exists(embedding_store.store_path("image"))
+
+    def load(self, db):
+        """From the mmap embedding store when exported, otherwise from Image.image_vector."""
+        folder = embedding_store.store_path("image")
+        castle_of = dict(db.execute(select(model.Image.img_id, model.Image.castle_id)).all())
+        if embedding_store.exists(folder):
+            store = self.store = embedding_store.EmbeddingStore(folder)
+            ids = np.asarray(store.ids)
+            castles = np.array([castle_of.get(i) or 0 for i in ids.tolist()], dtype=np.int64)
+            self.index.build(ids, castles, np.asarray(store.vectors), exact=store)
+            return self
+        ids, castles, vectors = [], [], []
+        rows = (
+            db.query(model.Image.img_id, model.Image.castle_id, model.Image.image_vector)
+            .filter(model.Image.image_vector.isnot(None))
+            .order_by(model.Image.img_id)
+            .yield_per(LOAD_BATCH_SIZE)
+        )
+        for img_id, castle_id, vector in rows:
+            ids.append(img_id)
+            castles.append(castle_id or 0)
+            vectors.append(vector)
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, self.index.dim)
+        self.index.build(ids, castles, matrix)
+        return self
+
+    def add(self, ids, castle_ids, vectors):
+        self.index.add(ids, castle_ids, vectors)
+
+    def search(self, vector, k=10):
+        return self.index.search(vector, k)
+
+
+class MilvusImageBackend:
+    """Same interface backed by a Milvus collection (IVF_SQ8, inner product)."""
+
+    def __init__(self, dim=model.IMAGE_VECTOR_DIM, uri=MILVUS_URI, collection=MILVUS_COLLECTION):
+        from pymilvus import DataType, MilvusClient
+
+        self.dim = dim
+        self.collection = collection
+        self.client = MilvusClient(uri=uri)
+        if not self.client.has_collection(collection):
+            schema = self.client.create_schema(auto_id=False)
+            schema.add_field("img_id", DataType.INT64, is_primary=True)
+            schema.add_field("castle_id", DataType.INT64)
+            schema.add_field("vector", DataType.FLOAT_VECTOR, dim=dim)
+            index_params = self.client.prepare_index_params()
+            index_params.add_index(field_name="vector", index_type="IVF_SQ8", metric_type="IP", params={"nlist": 1024})
+            self.client.create_collection(collection, schema=schema, index_params=index_params)
+
+    def load(self, db):
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(model.Image.img_id, model.Image.castle_id, model.Image.image_vector)
+                .where(model.Image.image_vector.isnot(None), model.Image.img_id > last_id)
+                .order_by(model.Image.img_id).limit(LOAD_BATCH_SIZE)
+            ).all()
+            if not rows:
+                return self
+            self.add([r[0] for r in rows], [r[1] or 0 for r in rows], np.asarray([r[2] for r in rows], dtype=np.float32))
+            last_id = rows[-1][0]
+
+    def add(self, ids, castle_ids, vectors):
+        vectors = normalize(vectors)
+        self.client.upsert(self.collection, [
+            {"img_id": int(i), "castle_id": int(c), "vector": v.tolist()}
+            for i, c, v in zip(np.asarray(ids).tolist(), np.asarray(castle_ids).tolist(), vectors)
+        ])
+
+    def changed(self):
+        # collection ใน Milvus คือข้อมูลชุดปัจจุบันอยู่แล้ว
+        return False
+
+    def search(self, vector, k=10):
+        hits = self.client.search(
+            self.collection, data=[normalize(vector)[0].tolist()], limit=k,
+            output_fields=["castle_id"], search_params={"metric_type": "IP", "params": {"nprobe": 16}})[0]
+        return [(hit["id"], hit["entity"]["castle_id"], hit["distance"]) for hit in hits]
+
+
+IMAGE_BACKENDS = {"local": LocalImageBackend, "milvus": MilvusImageBackend}
+
+
+##### Search: รูป -> castle
+
+def group_by_castle(hits, k=10):
+    """Image hits -> [(castle_id, best score, [img_id, ...]), ...] ranked by best score."""
+    castles = {}
+    for img_id, castle_id, score in hits:
+        if not castle_id:
+            continue
+        best, images = castles.get(castle_id, (-np.inf, []))
+        images.append(img_id)
+        castles[castle_id] = (max(best, score), images)
+    ranked = sorted(castles.items(), key=lambda item: -item[1][0])[:k]
+    return [(castle_id, float(score), images) for castle_id, (score, images) in ranked]
+
+
+class ImageSearcher:
+    def __init__(self, backend, encoder):
+        self.backend = backend
+        self.encoder = encoder
+
+    def search_castles(self, image_bytes, k=10, images_per_castle=5):
+        vector = self.encoder.encode([image_bytes])
+        hits = self.backend.search(vector, k=k * images_per_castle)
+        return group_by_castle(hits, k)
+
+
+_searcher = None
+_searcher_lock = threading.Lock()
+
+
+def get_image_searcher(db):
+    global _searcher
+    if _searcher is not None and _searcher_lock.acquire(blocking=False):
+        # export version ใหม่ (python image_search.py) -> สร้าง index ใหม่แล้วสลับ / มีคนสร้างอยู่ -> ใช้ตัวเดิมไปก่อน
+        try:
+            if _searcher.backend.changed():
+                with startup.timed("image_search"):
+                    backend = IMAGE_BACKENDS[IMAGE_INDEX_BACKEND]().load(db)
+                _searcher = ImageSearcher(backend, _searcher.encoder)
+        finally:
+            _searcher_lock.release()
+    if _searcher is None:
+        with building(_searcher_lock, "image_search"):
+            if _searcher is None:
+                with startup.timed("image_search"):
+                    backend = IMAGE_BACKENDS[IMAGE_INDEX_BACKEND]().load(db)
+                    _searcher = ImageSearcher(backend, get_image_encoder())
+    return _searcher
+
+
+##### Encode รูปจาก folder (ชื่อไฟล์ = img_id เช่น 42.jpg) -> Image.image_vector
+
+def encode_folder(db, folder, encoder=None, batch_size=IMAGE_BATCH_SIZE, progress=None):
+    encoder = encoder or get_image_encoder()
+    files = sorted(
+        (int(os.path.splitext(name)[0]), os.path.join(folder, name))
+        for name in os.listdir(folder) if os.path.splitext(name)[0].isdigit())
+    known = set(db.scalars(select(model.Image.img_id)))
+    files = [(img_id, path) for img_id, path in files if img_id in known]
+    done = 0
+    for start in range(0, len(files), batch_size):
+        batch = files[start:start + batch_size]
+        images = []
+        for _, path in batch:
+            with open(path, "rb") as f:
+                images.append(f.read())
+        vectors = encoder.encode(images)
+        db.execute(update(model.Image), [
+            {"img_id": img_id, "image_vector": vector.tolist()} for (img_id, _), vector in zip(batch, vectors)])
+        db.commit()
+        done += len(batch)
+        if progress:
+            progress(f"images: {done}/{len(files)}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode castle images into Image.image_vector")
+    parser.add_argument("folder", help="folder of image files named <img_id>.<ext>")
+    parser.add_argument("--encoder", default=IMAGE_ENCODER)
+    parser.add_argument("--batch-size", type=int, default=IMAGE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        done = encode_folder(db, args.folder, get_image_encoder(args.encoder), args.batch_size, progress=print)
+        print(f"encoded {done} images; published {embedding_store.export(db, 'image')}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+import argparse
+import hashlib
+import os
+import re
+import time
+from collections import Counter
+
+from sqlalchemy import delete, insert, select, update
+
+import embedding
+import model
+import retrieval
+from bulk_import import Resolver, Writer
+
+
+### Document ingestion: ไฟล์ข้อความ -> passage ที่ซ้อนกัน (overlap) -> keyword + embedding -> places_rag
+# - อ่านแบบ stream ทีละย่อหน้า, embed / insert ทีละ batch -> memory คงที่ไม่ว่าเอกสารจะมากหรือใหญ่แค่ไหน
+# - จุดตัด passage ขึ้นกับเนื้อหา (content-defined) -> แก้เอกสารตรงไหน passage ที่เปลี่ยนก็มีแค่แถวๆ นั้น
+#   ingest ซ้ำ: ไฟล์ hash เดิม = ข้าม / passage hash เดิม = เก็บแถวเดิม (ไม่ embed ใหม่) / passage ที่หายไป = ลบ
+# - ภาษาไทยไม่มีช่องว่างระหว่างคำ: ใช้ pythainlp ถ้าติดตั้งไว้ (pip install pythainlp)
+#   ไม่มี -> longest match กับคำที่รู้จัก (keyword ใน DB + ชื่อ castle + คำพื้นฐาน) ส่วนที่ไม่รู้จักตัดเป็นชิ้นสั้นๆ
+#   โดยไม่ตัดกลางพยางค์ (สระ / วรรณยุกต์ไม่แยกจากพยัญชนะ)
+#
+# run (ใน backend/): python ingest.py data/docs               (data/docs/<castle_id หรือ ชื่อ castle>/<เอกสาร>.txt)
+#                    python ingest.py data/docs/history.md --castle-id 12
+
+INGEST_PASSAGE_TOKENS = int(os.getenv("INGEST_PASSAGE_TOKENS", "200"))
+INGEST_MIN_TOKENS = int(os.getenv("INGEST_MIN_TOKENS", "80"))
+INGEST_OVERLAP_TOKENS = int(os.getenv("INGEST_OVERLAP_TOKENS", "40"))
+INGEST_KEYWORDS_PER_PASSAGE = int(os.getenv("INGEST_KEYWORDS_PER_PASSAGE", "8"))
+# auto = pythainlp ถ้ามี ไม่งั้น dict
+INGEST_THAI_TOKENIZER = os.getenv("INGEST_THAI_TOKENIZER", "auto")
+INGEST_EXTENSIONS = (".txt", ".md")
+# ย่อหน้ายาวเกินนี้ (ตัวอักษร) ส่งต่อเป็นก้อนย่อยที่ขอบบรรทัด
+MAX_BLOCK_CHARS = 1 << 16
+READ_CHUNK_BYTES = 1 << 20
+# ขอบประโยคที่ hash % CUT_MODULUS == 0 เป็นจุดตัด (เฉลี่ยตัดทุก ~4 ประโยคหลังถึง INGEST_MIN_TOKENS)
+CUT_MODULUS = 4
+UNKNOWN_PIECE_CHARS = 4
+
+# คำ (ไทยทั้งก้อน / ตัวอักษร-ตัวเลขภาษาอื่น) + ช่องว่าง / เครื่องหมายที่ตามมา
+_SEGMENT_RE = re.compile("([\u0e00-\u0e7f]+|[^\\W_]+)((?:(?![\u0e00-\u0e7f])[\\W_])*)")
+_SENTENCE_END_RE = re.compile("[.!?;:\u0e2f\u0e5a\u0e5b]")
+# สระหลัง / สระบน-ล่าง / วรรณยุกต์: ห้ามตัดก่อนตัวเหล่านี้ / สระหน้า: ห้ามตัดหลัง
+_NO_BREAK_BEFORE = frozenset("\u0e30\u0e31\u0e32\u0e33\u0e34\u0e35\u0e36\u0e37\u0e38\u0e39\u0e3a\u0e45"
+                             "\u0e47\u0e48\u0e49\u0e4a\u0e4b\u0e4c\u0e4d\u0e4e")
+_NO_BREAK_AFTER = frozenset("\u0e40\u0e41\u0e42\u0e43\u0e44")
+
+# token = (text, ช่องว่าง/เครื่องหมายที่ตามมา, kind) -- PIECE = ชิ้นไทยที่ไม่รู้จัก (นับขนาดได้ แต่ไม่ใช้เป็น keyword)
+WORD = "word"
+PIECE = "piece"
+
+# คำพื้นฐานให้ตัวตัดคำสำรองรู้จัก (โบราณสถาน / ประวัติศาสตร์ / ที่ตั้ง)
+THAI_BASE_WORDS = (
+    "ปราสาท", "ปราสาทหิน", "โบราณสถาน", "โบราณ", "ศิลปะ", "สถาปัตยกรรม", "ขอม", "เขมร", "ทวารวดี", "ลพบุรี",
+    "สุโขทัย", "อยุธยา", "ล้านนา", "สมัย", "พุทธศตวรรษ", "ศตวรรษ", "พระ", "พระเจ้า", "กษัตริย์", "ศาสนา", "ฮินดู",
+    "พุทธ", "พราหมณ์", "เทวาลัย", "ศิวลึงค์", "ทับหลัง", "ปรางค์", "ระเบียงคด", "โคปุระ", "บาราย", "ศิลาแลง",
+    "หินทราย", "จารึก", "ประวัติ", "ประวัติศาสตร์", "วัด", "เมือง", "จังหวัด", "อำเภอ", "ตำบล", "ภูเขา", "ภูเขาไฟ",
+    "ขุดค้น", "บูรณะ", "อุทยาน", "อุทยานประวัติศาสตร์", "เทศกาล", "พิธี", "นักท่องเที่ยว", "สร้าง", "ตั้งอยู่",
+)
+STOPWORDS = frozenset((
+    "the", "and", "of", "to", "in", "a", "an", "is", "was", "are", "were", "for", "on", "at", "by", "with", "from",
+    "as", "it", "its", "this", "that", "be", "or", "which", "has", "had", "have", "not", "but", "their", "also",
+    "และ", "ที่", "ของ", "ใน", "เป็น", "มี", "ได้", "การ", "จาก", "ว่า", "ซึ่ง", "กับ", "ให้", "ไป", "มา", "นี้", "นั้น",
+    "แล้ว", "อยู่", "โดย", "หรือ", "ก็", "จะ", "ไม่", "แต่", "เมื่อ", "อย่าง", "ความ", "คือ", "ถึง", "ยัง", "ทั้ง", "กัน",
+    "เพื่อ", "ตาม", "หลัง", "ก่อน", "ทาง", "แห่ง", "ไว้", "ต่อ", "เคย", "ด้วย", "อีก", "ๆ",
+))
+
+
+##### Tokenization
+
+def _is_thai(text):
+    return "\u0e00" <= text[0] <= "\u0e7f"
+
+
+def _safe_break(text, i):
+    return 0 < i < len(text) and text[i] not in _NO_BREAK_BEFORE and text[i - 1] not in _NO_BREAK_AFTER
+
+
+def _pieces(text, size=UNKNOWN_PIECE_CHARS):
+    """Split unknown Thai text into short pieces without breaking a syllable cluster."""
+    start = 0
+    for i in range(1, len(text)):
+        if i - start >= size and _safe_break(text, i):
+            yield text[start:i]
+            start = i
+    if start < len(text):
+        yield text[start:]
+
+
+class ThaiSegmenter:
+    """Word segmentation for Thai runs: pythainlp when available, else dictionary longest match."""
+
+    def __init__(self, words=(), engine=INGEST_THAI_TOKENIZER):
+        self.vocab = set()
+        # prefix ทุกตัวของคำใน vocab -> หยุดไล่ความยาวทันทีที่ไม่มีคำไหนขึ้นต้นแบบนี้
+        self._prefixes = set()
+        self.add_words(THAI_BASE_WORDS)
+        self.add_words(words)
+        self._word_tokenize = None
+        if engine in ("auto", "pythainlp"):
+            try:
+                from pythainlp.tokenize import word_tokenize
+            except ImportError:
+                if engine == "pythainlp":
+                    raise
+            else:
+                self._word_tokenize = word_tokenize
+        self.engine = "pythainlp" if self._word_tokenize else "dict"
+
+    def add_words(self, words):
+        for word in words:
+            word = (word or "").strip().lower()
+            if word and _is_thai(word) and " " not in word:
+                self.vocab.add(word)
+                self._prefixes.update(word[:i] for i in range(1, len(word) + 1))
+
+    def segment(self, run):
+        """[(word, kind)] for one Thai run (no spaces inside)."""
+        if self._word_tokenize is not None:
+            return [(word, WORD) for word in self._word_tokenize(run, keep_whitespace=False) if word.strip()]
+        out = []
+        unknown_start = None
+        i = 0
+        while i < len(run):
+            match = 0
+            length = 1
+            while i + length <= len(run) and run[i:i + length] in self._prefixes:
+                if length > 1 and run[i:i + length] in self.vocab:
+                    match = length
+                length += 1
+            if match and (i == 0 or _safe_break(run, i)) and (i + match == len(run) or _safe_break(run, i + match)):
+                if unknown_start is not None:
+                    out.extend((piece, PIECE) for piece in _pieces(run[unknown_start:i]))
+                    unknown_start = None
+                out.append((run[i:i + match], WORD))
+                i += match
+            else:
+                if unknown_start is None:
+                    unknown_start = i
+                i += 1
+        if unknown_start is not None:
+            out.extend((piece, PIECE) for piece in _pieces(run[unknown_start:]))
+        return out
+
+
+def read_blocks(path, max_chars=MAX_BLOCK_CHARS):
+    """Yield paragraphs (blank-line separated) of a UTF-8 text file without reading it whole."""
+    lines, size = [], 0
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                if lines:
+                    yield "".join(lines)
+                    lines, size = [], 0
+                continue
+            lines.append(line)
+            size += len(line)
+            if size >= max_chars:
+                yield "".join(lines)
+                lines, size = [], 0
+    if lines:
+        yield "".join(lines)
+
+
+def tokenize(blocks, segmenter):
+    """Stream (text, trailing, kind) tokens; the last token of each block gets a paragraph break."""
+    previous = None
+    for block in blocks:
+        for match in _SEGMENT_RE.finditer(block):
+            word, gap = match.group(1), match.group(2)
+            parts = segmenter.segment(word) if _is_thai(word) else [(word, WORD)]
+            for i, (text, kind) in enumerate(parts):
+                if previous is not None:
+                    yield previous
+                previous = (text, gap if i == len(parts) - 1 else "", kind)
+        if previous is not None:
+            text, trailing, kind = previous
+            previous = (text, trailing.rstrip() + "\n\n", kind)
+    if previous is not None:
+        yield previous
+
+
+##### Passage splitting (content-defined)
+
+def _boundary(token):
+    """2 = paragraph end, 1 = sentence end (Thai: a space after a Thai word), 0 = inside a sentence."""
+    text, trailing, _ = token
+    if "\n" in trailing:
+        return 2
+    if _SENTENCE_END_RE.search(trailing) or (trailing[:1].isspace() and _is_thai(text)):
+        return 1
+    return 0
+
+
+def _is_cut(token):
+    return embedding._feature_hash(token[0]) % CUT_MODULUS == 0
+
+
+def split_passages(tokens, size=INGEST_PASSAGE_TOKENS, min_size=INGEST_MIN_TOKENS, overlap=INGEST_OVERLAP_TOKENS):
+    """Group tokens into passages of ``min_size``..``size`` tokens; consecutive passages share ``overlap`` tokens.
+
+    Cuts land on paragraph ends, or on sentence ends chosen by a hash of the
+    sentence's last word, so they depend only on nearby text: editing one part
+    of a document leaves the passages elsewhere byte-identical.
+    """
+    if not 0 <= overlap < min_size <= size:
+        raise ValueError("need 0 <= overlap < min_size <= size")
+    window = []
+    fresh = 0
+    last_sentence = None
+    for token in tokens:
+        window.append(token)
+        fresh += 1
+        n = len(window)
+        cut = None
+        if n >= min_size:
+            kind = _boundary(token)
+            if kind == 2 or (kind == 1 and _is_cut(token)):
+                cut = n
+            elif kind == 1:
+                last_sentence = n
+        if cut is None and n >= size:
+            cut = last_sentence or n
+        if cut is not None:
+            yield window[:cut]
+            # overlap เริ่มที่ต้นประโยคถ้ามี (ไม่ให้ passage ถัดไปเริ่มกลางประโยค) แต่ยังคงอย่างน้อยครึ่งหนึ่ง
+            start = cut - overlap
+            for j in range(start, cut - overlap // 2):
+                if _boundary(window[j - 1]):
+                    start = j
+                    break
+            window = window[start:]
+            fresh = n - cut
+            last_sentence = None
+    if fresh:
+        yield window
+
+
+def passage_text(tokens):
+    return "".join(text + trailing for text, trailing, _ in tokens).strip()
+
+
+def extract_keywords(tokens, limit=INGEST_KEYWORDS_PER_PASSAGE, stopwords=STOPWORDS):
+    """Most frequent content words of a passage (ties: longer first)."""
+    counts = Counter()
+    for text, _, kind in tokens:
+        if kind != WORD:
+            continue
+        word = text.lower()
+        if word in stopwords or word.isdigit() or len(word) < (2 if _is_thai(word) else 3):
+            continue
+        counts[word] += 1
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], -len(item[0]), item[0]))
+    return [word for word, _ in ranked[:limit]]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+##### Ingestion job
+
+class IngestStats:
+    def __init__(self):
+        self.documents = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.passages = 0
+        self.embedded = 0
+        self.kept = 0
+        self.deleted = 0
+        self.cache_hits = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        return (f"documents={self.documents} unchanged={self.unchanged} skipped={self.skipped} "
+                f"passages={self.passages} embedded={self.embedded} kept={self.kept} deleted={self.deleted} "
+                f"cache_hits={self.cache_hits} elapsed={self.elapsed:.1f}s")
+
+
+def iter_files(root):
+    """Yield (path, source key, castle folder name or None) for every text file under ``root``."""
+    if os.path.isfile(root):
+        yield root, os.path.basename(root), None
+        return
+    for folder, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(INGEST_EXTENSIONS):
+                path = os.path.join(folder, name)
+                relative = os.path.relpath(path, root).replace(os.sep, "/")
+                parent = os.path.dirname(relative)
+                yield path, relative, parent.split("/")[0] if parent else None
+
+
+class Ingestor:
+    """Split, keyword and embed documents into places_rag, batching inserts across documents."""
+
+    def __init__(self, db, encoder=None, cache=None, segmenter=None, batch_size=embedding.EMBEDDING_BATCH_SIZE,
+                 size=INGEST_PASSAGE_TOKENS, min_size=INGEST_MIN_TOKENS, overlap=INGEST_OVERLAP_TOKENS,
+                 progress=None):
+        self.db = db
+        self.encoder = encoder or embedding.get_encoder(embedding.EMBEDDING_ENCODER, model.DOCUMENT_VECTOR_DIM)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.size, self.min_size, self.overlap = size, min_size, overlap
+        self.progress = progress
+        self.stats = IngestStats()
+        self._pending = []
+        self._castles = {}
+        self._resolver = None
+        if segmenter is None:
+            # คำที่รู้จักอยู่แล้ว -> ตัดคำไทยได้ตรงกับ keyword / ชื่อ castle เดิม
+            segmenter = ThaiSegmenter(db.scalars(select(model.Keyword.keyword)))
+            segmenter.add_words(db.scalars(select(model.Castle.castle_name)))
+        self.segmenter = segmenter
+
+    def resolve_castle(self, name):
+        """Folder name -> castle_id (a number, or a castle_name)."""
+        if name is None:
+            return None
+        if name.isdigit():
+            return int(name)
+        if name not in self._castles:
+            self._castles[name] = self.db.scalar(
+                select(model.Castle.castle_id).where(model.Castle.castle_name == name).limit(1))
+        return self._castles[name]
+
+    def _document(self, source, name, castle_id):
+        document = self.db.execute(
+            select(model.Document.document_id, model.Document.content_hash, model.Document.castle_id)
+            .where(model.Document.source_path == source)).first()
+        if document is not None:
+            return document
+        document_id = self.db.execute(insert(model.Document).values(
+            castle_id=castle_id, document_name=name, source_path=source).returning(model.Document.document_id)).scalar()
+        return document_id, None, castle_id
+
+    def ingest_file(self, path, source=None, castle_id=None):
+        source = source or os.path.basename(path)
+        if castle_id is None:
+            self.stats.skipped += 1
+            if self.progress:
+                self.progress(f"skip {source}: no castle (use a castle folder or --castle-id)")
+            return
+        digest = file_digest(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        document_id, old_digest, old_castle = self._document(source, name, castle_id)
+        self.stats.documents += 1
+        if old_digest == digest and old_castle == castle_id:
+            self.stats.unchanged += 1
+            return
+        if old_castle != castle_id:
+            self.db.execute(update(model.Place).where(model.Place.document_id == document_id).values(castle_id=castle_id))
+
+        # passage เดิมของเอกสาร: hash -> [(place_id, passage_index)]
+        existing = {}
+        for place_id, content_hash, index in self.db.execute(
+                select(model.Place.place_id, model.Place.content_hash, model.Place.passage_index)
+                .where(model.Place.document_id == document_id)):
+            existing.setdefault(content_hash, []).append((place_id, index))
+        moved = []
+        tokens = tokenize(read_blocks(path), self.segmenter)
+        for index, passage in enumerate(split_passages(tokens, self.size, self.min_size, self.overlap)):
+            text = passage_text(passage)
+            if not text:
+                continue
+            content_hash = text_digest(text)
+            self.stats.passages += 1
+            matches = existing.get(content_hash)
+            if matches:
+                place_id, old_index = matches.pop()
+                if not matches:
+                    del existing[content_hash]
+                if old_index != index:
+                    moved.append({"place_id": place_id, "passage_index": index})
+                self.stats.kept += 1
+                continue
+            self._pending.append({
+                "document_id": document_id, "castle_id": castle_id, "passage_index": index,
+                "content": text, "content_hash": content_hash, "keywords": extract_keywords(passage),
+            })
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+        self.flush()
+
+        stale = [place_id for matches in existing.values() for place_id, _ in matches]
+        for start in range(0, len(stale), 1000):
+            chunk = stale[start:start + 1000]
+            self.db.execute(delete(model.PlaceKeyword).where(model.PlaceKeyword.place_id.in_(chunk)))
+            self.db.execute(delete(model.Place).where(model.Place.place_id.in_(chunk)))
+        self.stats.deleted += len(stale)
+        if moved:
+            self.db.execute(update(model.Place), moved)
+        # บันทึก hash ของไฟล์ท้ายสุด -> ถ้าหยุดกลางทาง รอบหน้าจะทำไฟล์นี้ต่อ (passage ที่เขียนแล้วจับคู่ด้วย hash)
+        self.db.execute(update(model.Document).where(model.Document.document_id == document_id).values(
+            content_hash=digest, castle_id=castle_id, document_name=name))
+        self.db.commit()
+        if self.progress:
+            self.progress(f"{source}: {self.stats}")
+
+    def flush(self):
+        """Embed the pending passages in one batch and write places + keyword links."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        vectors, hits = embedding.embed_texts([p["content"] for p in pending], self.encoder, self.cache)
+        conn = self.db.connection()
+        writer = Writer(conn, use_copy=False)
+        if self._resolver is None:
+            self._resolver = Resolver(conn, writer)
+        self._resolver.conn, self._resolver.writer = conn, writer
+
+        rows = [dict({k: v for k, v in p.items() if k != "keywords"}, document_vector=vector)
+                for p, vector in zip(pending, vectors)]
+        place_ids = writer.write_returning(model.Place.__table__, rows)
+        words = sorted({word for p in pending for word in p["keywords"]})
+        keyword_ids = dict(zip(words, self._resolver.keyword_ids(words)))
+        links = sorted({(place_id, keyword_ids[word]) for place_id, p in zip(place_ids, pending) for word in p["keywords"]})
+        writer.write(model.PlaceKeyword.__table__, [{"place_id": p, "keyword_id": k} for p, k in links],
+                     conflict_cols=["place_id", "keyword_id"], update=False)
+        self.db.commit()
+        self.stats.embedded += len(pending)
+        self.stats.cache_hits += hits
+
+    def run(self, root, castle_id=None):
+        for path, source, folder in iter_files(root):
+            self.ingest_file(path, source, castle_id if castle_id is not None else self.resolve_castle(folder))
+        self.flush()
+        # server ที่ใช้ places_rag อยู่ -> สร้าง retrieval index ใหม่
+        retrieval.publish_places_version()
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest text documents into passages (places_rag)")
+    parser.add_argument("path", help="a file, or a folder of <castle_id or castle name>/<document>.txt|.md")
+    parser.add_argument("--castle-id", type=int, default=None, help="castle for every document in path")
+    parser.add_argument("--encoder", default=embedding.EMBEDDING_ENCODER)
+    parser.add_argument("--cache", default=embedding.EMBEDDING_CACHE_PATH)
+    parser.add_argument("--batch-size", type=int, default=embedding.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--passage-tokens", type=int, default=INGEST_PASSAGE_TOKENS)
+    parser.add_argument("--min-tokens", type=int, default=INGEST_MIN_TOKENS)
+    parser.add_argument("--overlap", type=int, default=INGEST_OVERLAP_TOKENS)
+    args = parser.parse_args()
+    if not os.path.exists(args.path):
+        parser.error(f"{args.path} not found")
+
+    from db import SessionLocal
+
+    encoder = embedding.get_encoder(args.encoder, model.DOCUMENT_VECTOR_DIM)
+    cache = embedding.EmbeddingCache(args.cache)
+    db = SessionLocal()
+    try:
+        ingestor = Ingestor(db, encoder, cache, batch_size=args.batch_size, size=args.passage_tokens,
+                            min_size=args.min_tokens, overlap=args.overlap, progress=print)
+        print(f"thai tokenizer: {ingestor.segmenter.engine}")
+        print(f"done: {ingestor.run(args.path, args.castle_id)}")
+    finally:
+        db.close()
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import delete, select
+
+import event_index
+import model
+from geo_index import haversine_km
+
+
+### Trip itinerary: เรียงลำดับ castle ใน TripPlan ให้เวลาเดินทางรวมน้อยที่สุด
+# distance/time matrix (vectorized) -> nearest neighbor -> 2-opt + Or-opt จนหมดเวลา (time budget)
+# castle ที่มี Event ในช่วงทริป -> ต้องไปถึงภายในช่วง event_start..event_end (ถ้าไปก่อนต้องรอ)
+
+AVERAGE_SPEED_KMH = float(os.getenv("ITINERARY_SPEED_KMH", "50"))
+ROAD_FACTOR = float(os.getenv("ITINERARY_ROAD_FACTOR", "1.3")) # ถนนจริงยาวกว่าเส้นตรง
+LATE_PENALTY = 1000.0 # น้ำหนักของเวลาที่สายเกิน event_end (ต่อวินาที)
+# ขนาดงานต่อ request (ต้องตรงกับ schemas.ItineraryRequest)
+MAX_STOPS = 100
+MAX_TIME_BUDGET_SECONDS = 5.0
+MATRIX_CACHE_SIZE = 256
+
+
+##### Distance / time matrix + cache ต่อชุด castle
+
+_matrix_cache = OrderedDict()
+_matrix_cache_lock = threading.Lock()
+
+
+def travel_matrix(points):
+    """Travel seconds between every pair of ``points`` [(castle_id, lat, lon), ...].
+
+    Cached per castle set (including coordinates, so a moved Location is a new key).
+    """
+    key = tuple(sorted(points))
+    with _matrix_cache_lock:
+        cached = _matrix_cache.get(key)
+        if cached is not None:
+            _matrix_cache.move_to_end(key)
+    if cached is None:
+        lat = np.array([p[1] for p in key])
+        lon = np.array([p[2] for p in key])
+        km = haversine_km(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+        cached = km * ROAD_FACTOR / AVERAGE_SPEED_KMH * 3600.0
+        with _matrix_cache_lock:
+            _matrix_cache[key] = cached
+            if len(_matrix_cache) > MATRIX_CACHE_SIZE:
+                _matrix_cache.popitem(last=False)
+    # จัดแถวให้ตรงกับลำดับ points ที่ขอมา
+    position = {p: i for i, p in enumerate(key)}
+    rows = np.array([position[p] for p in points])
+    return cached[np.ix_(rows, rows)]
+
+
+##### Solver
+
+class _Problem:
+    def __init__(self, travel, service, window_start, window_end):
+        self.travel = travel
+        self.service = service
+        self.window_start = window_start
+        self.window_end = window_end
+        self.has_windows = bool(np.isfinite(window_end).any() or (window_start > 0).any())
+
+    def schedule(self, order):
+        """Begin times (seconds from trip start), total duration and total lateness."""
+        begins = np.empty(len(order))
+        now = 0.0
+        late = 0.0
+        previous = None
+        for i, stop in enumerate(order):
+            if previous is not None:
+                now += self.travel[previous, stop]
+            now = max(now, self.window_start[stop])
+            late += max(0.0, now - self.window_end[stop])
+            begins[i] = now
+            now += self.service
+            previous = stop
+        return begins, now, late
+
+    def cost(self, order):
+        _, total, late = self.schedule(order)
+        return total + LATE_PENALTY * late
+
+
+def _nearest_neighbor(problem, start):
+    n = problem.travel.shape[0]
+    order = [start]
+    visited = np.zeros(n, dtype=bool)
+    visited[start] = True
+    now = max(0.0, problem.window_start[start]) + problem.service
+    for _ in range(n - 1):
+        arrival = now + problem.travel[order[-1]]
+        begin = np.maximum(arrival, problem.window_start)
+        score = begin + LATE_PENALTY * np.maximum(0.0, begin - problem.window_end)
+        score[visited] = np.inf
+        nxt = int(np.argmin(score))
+        order.append(nxt)
+        visited[nxt] = True
+        now = begin[nxt] + problem.service
+    return np.array(order)
+
+
+def _two_opt_pass(problem, order, cost, deadline):
+    """Reverse order[i..j] (open path, start fixed). Distance deltas for all j at once."""
+    d = problem.travel
+    n = len(order)
+    improved = False
+    for i in range(1, n - 1):
+        if time.perf_counter() > deadline:
+            break
+        j = np.arange(i + 1, n)
+        before = d[order[i - 1], order[i]]
+        after = np.where(j + 1 < n, d[order[j], order[np.minimum(j + 1, n - 1)]], 0.0)
+        new_before = d[order[i - 1], order[j]]
+        new_after = np.where(j + 1 < n, d[order[i], order[np.minimum(j + 1, n - 1)]], 0.0)
+        delta = new_before + new_after - before - after
+        # ไม่มี time window -> delta ของระยะทางคือคำตอบ / มี window -> ใช้ delta เป็นตัวกรองแล้วตรวจ cost จริง
+        candidates = j[np.argsort(delta)]
+        if not problem.has_windows:
+            candidates = candidates[np.sort(delta) < -1e-9][:1]
+        for jj in candidates[:8].tolist():
+            trial = order.copy()
+            trial[i:jj + 1] = trial[i:jj + 1][::-1]
+            trial_cost = problem.cost(trial)
+            if trial_cost < cost - 1e-9:
+                order, cost, improved = trial, trial_cost, True
+                break
+    return order, cost, improved
+
+
+def _or_opt_pass(problem, order, cost, deadline):
+    """Move a segment of 1-3 stops to another position."""
+    n = len(order)
+    improved = False
+    for length in (1, 2, 3):
+        for i in range(1, n - length + 1):
+            if time.perf_counter() > deadline:
+                return order, cost, improved
+            segment = order[i:i + length]
+            rest = np.concatenate([order[:i], order[i + length:]])
+            # ตำแหน่งแทรก: หลัง rest[p] (p >= 0 เพื่อไม่ย้ายจุดเริ่มต้น)
+            d = problem.travel
+            prev_stop = rest
+            next_stop = np.append(rest[1:], -1)
+            has_next = next_stop >= 0
+            insert = d[prev_stop, segment[0]] + np.where(has_next, d[segment[-1], np.maximum(next_stop, 0)], 0.0)
+            insert -= np.where(has_next, d[prev_stop, np.maximum(next_stop, 0)], 0.0)
+            for p in np.argsort(insert)[:4].tolist():
+                if p == i - 1:
+                    continue
+                trial = np.concatenate([rest[:p + 1], segment, rest[p + 1:]])
+                trial_cost = problem.cost(trial)
+                if trial_cost < cost - 1e-9:
+                    order, cost, improved = trial, trial_cost, True
+                    break
+            if improved:
+                return order, cost, improved
+    return order, cost, improved
+
+
+def solve(travel, service_seconds, window_start=None, window_end=None, start=0, time_budget=0.5):
+    """Order stops (indices into ``travel``) starting from ``start``.
+
+    Returns (order, begin_seconds, total_seconds, late_seconds).
+    """
+    n = travel.shape[0]
+    window_start = np.zeros(n) if window_start is None else np.asarray(window_start, dtype=np.float64)
+    window_end = np.full(n, np.inf) if window_end is None else np.asarray(window_end, dtype=np.float64)
+    problem = _Problem(travel, service_seconds, window_start, window_end)
+    deadline = time.perf_counter() + time_budget
+    order = _nearest_neighbor(problem, start)
+    cost = problem.cost(order)
+    if n > 3:
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            order, cost, improved = _two_opt_pass(problem, order, cost, deadline)
+            if not improved:
+                order, cost, improved = _or_opt_pass(problem, order, cost, deadline)
+    begins, total, late = problem.schedule(order)
+    return order, begins, total, late
+
+
+##### ใช้กับ TripPlan จริง
+
+def _event_windows(db, castle_ids, start, end):
+    """First event per castle overlapping the trip range -> (event_id, start, end)."""
+    if start is None or end is None:
+        return {}
+    index = event_index.get_event_index(db)
+    if index.expired_before is None or start >= index.expired_before:
+        return index.castle_windows(castle_ids, start, end)
+    # ทริปย้อนหลังเกินช่วงที่ index เก็บไว้ -> query ตรง
+    rows = db.execute(
+        select(model.Event.castle_id, model.Event.event_id, model.Event.event_start, model.Event.event_end)
+        .where(model.Event.castle_id.in_(castle_ids))
+        .where(model.Event.event_start <= end, model.Event.event_end >= start)
+        .order_by(model.Event.event_end)
+    ).all()
+    windows = {}
+    for castle_id, event_id, event_start, event_end in rows:
+        windows.setdefault(castle_id, (event_id, event_start, event_end))
+    return windows
+
+
+def plan_itinerary(db, plan, castle_ids=None, visit_minutes=90, time_budget=0.5):
+    """Order ``castle_ids`` (default: the plan's route) and rewrite the plan's TripItinerary rows.
+
+    The first castle is the starting point. The route itself is shared with
+    other plans, so its RouteCastle order is left untouched. Returns the new rows.
+    """
+    if not castle_ids and plan.route_id is not None:
+        castle_ids = db.scalars(
+            select(model.RouteCastle.castle_id)
+            .where(model.RouteCastle.route_id == plan.route_id)
+            .order_by(model.RouteCastle.sequence_order, model.RouteCastle.castle_id)
+        ).all()
+    castle_ids = list(dict.fromkeys(castle_ids or []))
+    if not castle_ids:
+        raise ValueError("No castles to plan")
+    if len(castle_ids) > MAX_STOPS:
+        raise ValueError(f"At most {MAX_STOPS} castles per itinerary")
+
+    coords = dict(
+        (castle_id, (lat, lon)) for castle_id, lat, lon in db.execute(
+            select(model.LocationCastle.castle_id, model.Location.latitude, model.Location.longitude)
+            .join(model.Location, model.Location.location_id == model.LocationCastle.location_id)
+            .where(model.LocationCastle.castle_id.in_(castle_ids))
+        ) if lat is not None and lon is not None
+    )
+    missing = [c for c in castle_ids if c not in coords]
+    if missing:
+        raise ValueError(f"Castles without location: {missing}")
+
+    trip_start = plan.start_date or datetime.datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    windows = _event_windows(db, castle_ids, plan.start_date, plan.end_date)
+    window_start = np.zeros(len(castle_ids))
+    window_end = np.full(len(castle_ids), np.inf)
+    for i, castle_id in enumerate(castle_ids):
+        if castle_id in windows:
+            _, event_start, event_end = windows[castle_id]
+            window_start[i] = max(0.0, (event_start - trip_start).total_seconds())
+            window_end[i] = (event_end - trip_start).total_seconds()
+
+    travel = travel_matrix([(c, *coords[c]) for c in castle_ids])
+    service = visit_minutes * 60.0
+    time_budget = min(time_budget, MAX_TIME_BUDGET_SECONDS)
+    order, begins, _, _ = solve(travel, service, window_start, window_end, start=0, time_budget=time_budget)
+
+    db.execute(delete(model.TripItinerary).where(model.TripItinerary.plan_id == plan.plan_id))
+    rows = []
+    for stop, begin in zip(order.tolist(), begins.tolist()):
+        castle_id = castle_ids[stop]
+        start_time = trip_start + datetime.timedelta(seconds=begin)
+        rows.append(model.TripItinerary(
+            plan_id=plan.plan_id,
+            castle_id=castle_id,
+            event_id=windows[castle_id][0] if castle_id in windows else None,
+            start_time=start_time,
+            end_time=start_time + datetime.timedelta(seconds=service),
+        ))
+    db.add_all(rows)
+    db.commit()
+    return rows
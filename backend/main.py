@@ -1,6 +1,97 @@
-from fastapi import FastAPI
+import time
 
-app = FastAPI()
+_imports_started = time.perf_counter()
+
+import datetime
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import configure_mappers
+from starlette.concurrency import run_in_threadpool
+
+from activity_log import activity_log
+from cache import cached_json, castle_groups, response_cache, similar_groups, user_groups
+import metrics
+import model
+import repository
+from responses import ORJSONResponse
+import schemas
+import db as database
+from db import get_async_db
+from startup import READY, Warming, lazy_import, request_path, startup
+
+# subsystem หนัก (numpy / scipy / index / encoder) -> import ตอนใช้ครั้งแรก หรือตอน warm-up
+autocomplete = lazy_import("autocomplete")
+collaborative = lazy_import("collaborative")
+covisit = lazy_import("covisit")
+event_index = lazy_import("event_index")
+geo_index = lazy_import("geo_index")
+image_search = lazy_import("image_search")
+itinerary = lazy_import("itinerary")
+materialize = lazy_import("materialize")
+recommend = lazy_import("recommend")
+rerank = lazy_import("rerank")
+retrieval = lazy_import("retrieval")
+
+startup.record("app", "import", time.perf_counter() - _imports_started, state=READY)
+
+# ลำดับ warm-up: ของที่ request ส่วนใหญ่ใช้ก่อน (WARMUP_COMPONENTS เลือกเฉพาะบางตัวได้)
+startup.register("mappers", lambda db: configure_mappers())
+startup.register("recommend", lambda db: recommend.get_castle_index(db))
+startup.register("geo_index", lambda db: geo_index.get_castle_geo_index(db))
+startup.register("event_index", lambda db: event_index.get_event_index(db))
+startup.register("autocomplete", lambda db: autocomplete.get_autocomplete(db))
+startup.register("materialize", lambda db: materialize.get_materialized())
+startup.register("collaborative", lambda db: collaborative.get_recommender(db))
+startup.register("covisit", lambda db: covisit.get_graph(db))
+startup.register("rerank", lambda db: rerank.get_catalog(db))
+startup.register("retrieval", lambda db: retrieval.get_place_searcher(db))
+startup.register("image_search", lambda db: image_search.get_image_searcher(db))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    activity_log.start()
+    # warm ใน thread แยก -> ไม่ block การเปิด port; ดูสถานะที่ /health/ready
+    startup.start_warmup(database.SessionLocal)
+    yield
+    startup.stop()
+    # เขียน SearchHistory / VisitHistory ที่ยังค้างใน queue ให้หมด
+    activity_log.stop()
+    # เขียน index ลง disk ก่อนปิด server (ถ้ามีการเพิ่มข้อมูล) -- ไม่เคยโหลด = ไม่มีอะไรต้องเขียน
+    if recommend.loaded:
+        recommend.save_castle_index()
+
+
+# จำนวนผลลัพธ์สูงสุดต่อ request ของ endpoint แบบ top-k
+MAX_K = 100
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.InstrumentationMiddleware)
+# instrument ทันทีที่ engine ถูกสร้าง (engine สร้างตอนใช้ครั้งแรก)
+database.on_engine_created(metrics.instrument_engine)
+
+async def offload(fn, *args, wait=False):
+    """Run ``fn(session, *args)`` in the threadpool with its own sync session.
+
+    Index builds, CF scoring, re-ranking and searches are CPU-bound;
+    ``AsyncSession.run_sync`` would run them on the event loop thread. While
+    another thread (normally warm-up) is still building a component the
+    request answers 503 instead of waiting, unless ``wait`` is set.
+    """
+    def call():
+        with database.SessionLocal() as session:
+            if wait:
+                return fn(session, *args)
+            with request_path():
+                return fn(session, *args)
+    try:
+        return await run_in_threadpool(call)
+    except Warming as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
 @app.get("/")
 def read_root():
@@ -10,5 +101,284 @@ def read_root():
 def read_item(item_id: int, q: str = None):
     return {"item_id": item_id, "q": q}
 
+##### Castle
+@app.post("/castles", response_model=schemas.CastleResponse)
+async def create_castle(castle: schemas.CastleCreate, db: AsyncSession = Depends(get_async_db)):
+    if castle.text_vector is not None and len(castle.text_vector) != model.TEXT_VECTOR_DIM:
+        raise HTTPException(status_code=422, detail=f"text_vector must have {model.TEXT_VECTOR_DIM} dimensions")
+    db_castle = model.Castle(**castle.model_dump())
+    db.add(db_castle)
+    await db.commit()
+    await db.refresh(db_castle, attribute_names=["location_link"]) # async โหลด lazy ไม่ได้
+    # รอ index ที่กำลังสร้างให้เสร็จก่อน ไม่งั้น castle ใหม่อาจหลุดจาก index
+    await offload(recommend.index_castle, db_castle, wait=True)
+    return schemas.CastleResponse.model_validate(db_castle)
+
+# ต้องประกาศก่อน /castles/{castle_id}
+def _page_size(limit):
+    if not 1 <= limit <= repository.MAX_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail=f"limit must be between 1 and {repository.MAX_PAGE_SIZE}")
+    return limit
+
+@app.get("/castles", response_model=schemas.CastlePage)
+async def list_castles(after: int = 0, limit: int = 20, db: AsyncSession = Depends(get_async_db)):
+    # lean path: column tuple -> dict -> orjson (ไม่ผ่าน ORM object / Pydantic)
+    return ORJSONResponse(await repository.list_castles_page_async(db, after, _page_size(limit)))
+
+@app.get("/castles/nearby", response_model=List[schemas.NearbyCastleResponse])
+async def read_castles_within(lat: float, lon: float, radius_km: float = 50.0,
+                              limit: int = Query(100, ge=1, le=repository.MAX_PAGE_SIZE)):
+    rows = await offload(lambda session: geo_index.get_castle_geo_index(session).within(lat, lon, radius_km, limit=limit))
+    return [{"castle_id": c, "distance_km": d} for c, d in rows]
+
+@app.get("/castles/nearest", response_model=List[schemas.NearbyCastleResponse])
+async def read_nearest_castles(lat: float, lon: float, k: int = Query(10, ge=1, le=MAX_K)):
+    rows = await offload(lambda session: geo_index.get_castle_geo_index(session).nearest(lat, lon, k=k))
+    return [{"castle_id": c, "distance_km": d} for c, d in rows]
+
+@app.get("/castles/{castle_id}", response_model=schemas.CastleDetailResponse)
+async def read_castle(castle_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def build():
+        castle = await repository.get_castle_detail_async(db, castle_id)
+        if castle is None:
+            raise HTTPException(status_code=404, detail="Castle not found")
+        return schemas.CastleDetailResponse.model_validate(castle)
+    return await cached_json(request, f"castle:{castle_id}:detail", castle_groups(castle_id), build)
+
+@app.get("/castles/{castle_id}/events", response_model=List[schemas.EventResponse])
+async def read_castle_events(castle_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def build():
+        events = await db.scalars(
+            select(model.Event).where(model.Event.castle_id == castle_id).order_by(model.Event.event_start))
+        return [schemas.EventResponse.model_validate(e) for e in events]
+    return await cached_json(request, f"castle:{castle_id}:events", castle_groups(castle_id), build)
+
+##### Castle Type
+@app.get("/castle-types", response_model=List[schemas.CastleTypeResponse])
+async def read_castle_types(request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def build():
+        types = await db.scalars(select(model.CastleType).order_by(model.CastleType.type_id))
+        return [schemas.CastleTypeResponse.model_validate(t) for t in types]
+    return await cached_json(request, "castle_types:list", ["castle_types"], build)
+
+##### Recommend
+@app.get("/castles/{castle_id}/similar", response_model=List[schemas.SimilarCastleResponse])
+async def read_similar_castles(castle_id: int, request: Request, k: int = Query(10, ge=1, le=MAX_K)):
+    async def build():
+        results = await offload(recommend.similar_castles, castle_id, k)
+        if results is None:
+            raise HTTPException(status_code=404, detail="Castle has no text_vector")
+        return [{"castle_id": castle_id, "score": score} for castle_id, score in results]
+    # castle อื่นเปลี่ยน -> ผลเปลี่ยนได้ จึงอยู่ใน SIMILAR_GROUP ด้วย
+    return await cached_json(request, f"castle:{castle_id}:similar:{k}", similar_groups(castle_id), build)
+
+@app.get("/castles/{castle_id}/also-visited", response_model=List[schemas.SimilarCastleResponse])
+async def read_also_visited(castle_id: int, k: int = Query(10, ge=1, le=MAX_K)):
+    # ไม่ cache: visit ใหม่เข้า graph ทุก COVISIT_REFRESH_SECONDS และ query ใช้เวลาไม่กี่ ms
+    rows = await offload(lambda session: covisit.get_graph(session).also_visited(castle_id, k))
+    return ORJSONResponse([{"castle_id": c, "score": score} for c, score in rows])
+
+@app.get("/users/{user_id}/recommendations", response_model=List[schemas.RecommendationResponse])
+async def read_user_recommendations(user_id: int, request: Request, k: int = Query(10, ge=1, le=MAX_K), event_boost: bool = True):
+    # ดึงมาเผื่อ 2 เท่า -> ดัน castle ที่มี event ในช่วงนี้ขึ้นมา แล้วตัดเหลือ k
+    want = k * 2 if event_boost else k
+
+    def boost(session, rows):
+        if event_boost:
+            rows = event_index.boost_by_events(event_index.get_event_index(session), rows)
+        return [{"castle_id": castle_id, "score": score} for castle_id, score in rows[:k]]
+
+    def from_materialized(session):
+        rows = materialize.get_materialized().lookup(user_id, want)
+        return None if rows is None else boost(session, rows)
+
+    def from_model(session):
+        return boost(session, collaborative.get_recommender(session).recommend(user_id, k=want))
+
+    # คำนวณไว้แล้ว (python materialize.py) -> lookup ตรงๆ / ยังไม่มี -> คำนวณสดจาก CF
+    rows = await offload(from_materialized)
+    if rows is not None:
+        return rows
+
+    async def build():
+        return await offload(from_model)
+    return await cached_json(
+        request, f"user:{user_id}:recommendations:{k}:{int(event_boost)}", user_groups(user_id), build)
+
+@app.get("/users/{user_id}/recommendations/explained", response_model=List[schemas.ExplainedRecommendationResponse])
+async def read_explained_recommendations(user_id: int, k: int = Query(10, ge=1, le=MAX_K), lat: float = None,
+                                         lon: float = None, diversity: float = None, weights: str = None):
+    # candidate จาก materialized / CF -> re-rank หลาย signal + MMR + เหตุผล
+    try:
+        weights = rerank.parse_weights(weights) if weights else None
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if diversity is not None and not 0.0 <= diversity <= 1.0:
+        raise HTTPException(status_code=422, detail="diversity must be between 0 and 1")
+    def rank(session):
+        candidates = materialize.get_materialized().lookup(user_id, rerank.CANDIDATES)
+        if not candidates:
+            candidates = collaborative.get_recommender(session).recommend(user_id, k=rerank.CANDIDATES)
+        return rerank.rerank_for_user(session, user_id, candidates, k, lat, lon, diversity, weights)
+
+    ranked = await offload(rank)
+    return ORJSONResponse([
+        {"castle_id": castle_id, "score": score, "contributions": contributions, "reasons": reasons}
+        for castle_id, score, contributions, reasons in ranked
+    ])
+
+@app.get("/users/{user_id}/recommendations/graph", response_model=List[schemas.RecommendationResponse])
+async def read_graph_recommendations(user_id: int, k: int = Query(10, ge=1, le=MAX_K)):
+    # personalized PageRank บน co-visitation graph เริ่มจาก castle ที่ user เพิ่งไป
+    rows = await offload(covisit.recommend_for_user, user_id, k)
+    return ORJSONResponse([{"castle_id": c, "score": score} for c, score in rows])
+
+@app.post("/visits", status_code=202)
+async def create_visit(visit: schemas.VisitHistoryCreate, db: AsyncSession = Depends(get_async_db)):
+    # ตรวจ FK ก่อนเข้า queue (query เดียว) -> แถวที่ผิดไม่ไปทำให้ batch ของ write-behind fail
+    user_exists, castle_exists = (await db.execute(select(
+        select(model.User.user_id).where(model.User.user_id == visit.user_id).exists(),
+        select(model.Castle.castle_id).where(model.Castle.castle_id == visit.castle_id).exists(),
+    ))).one()
+    if not user_exists:
+        raise HTTPException(status_code=422, detail="Unknown user_id")
+    if not castle_exists:
+        raise HTTPException(status_code=422, detail="Unknown castle_id")
+    # เขียนแบบ write-behind -> ตอบ 202 ทันที
+    activity_log.log_visit(visit.user_id, visit.castle_id, visit.visit_date)
+    return Response(status_code=202)
+
+@app.get("/events", response_model=schemas.EventPage)
+async def list_events(after: int = 0, limit: int = 20, castle_id: int = None, db: AsyncSession = Depends(get_async_db)):
+    return ORJSONResponse(await repository.list_page_async(db, "events", after, _page_size(limit), castle_id))
+
+@app.get("/events/overlapping", response_model=List[schemas.EventWindowResponse])
+async def read_overlapping_events(start: datetime.datetime, end: datetime.datetime, castle_id: int = None,
+                                  province: str = None, limit: int = Query(100, ge=1, le=repository.MAX_PAGE_SIZE)):
+    if end < start:
+        raise HTTPException(status_code=422, detail="end must not be before start")
+    castle_ids = [castle_id] if castle_id is not None else None
+    rows = await offload(
+        lambda session: event_index.get_event_index(session).overlapping(start, end, castle_ids, province, limit=limit))
+    return ORJSONResponse([
+        {"event_id": e, "castle_id": c, "event_start": s, "event_end": t} for e, c, s, t in rows])
+
+@app.get("/events/now", response_model=List[schemas.NearbyEventResponse])
+async def read_events_near_me(lat: float, lon: float, radius_km: float = 50.0,
+                              limit: int = Query(50, ge=1, le=repository.MAX_PAGE_SIZE)):
+    def happening(session):
+        geo = geo_index.get_castle_geo_index(session)
+        return event_index.get_event_index(session).happening_now(geo, lat, lon, radius_km, limit=limit)
+
+    return ORJSONResponse([
+        {"event_id": e, "castle_id": c, "event_start": s, "event_end": t, "distance_km": d}
+        for e, c, s, t, d in await offload(happening)
+    ])
+
+@app.get("/images", response_model=schemas.ImagePage)
+async def list_images(after: int = 0, limit: int = 20, castle_id: int = None, db: AsyncSession = Depends(get_async_db)):
+    return ORJSONResponse(await repository.list_page_async(db, "images", after, _page_size(limit), castle_id))
+
+@app.post("/images/search", response_model=List[schemas.ImageCastleMatchResponse])
+async def search_by_image(request: Request, k: int = Query(10, ge=1, le=MAX_K)):
+    # body = ไฟล์รูปดิบ (Content-Type: image/*) -> ไม่ต้องพึ่ง python-multipart
+    # อ่านทีละ chunk และหยุดทันทีที่เกิน IMAGE_MAX_BYTES (Content-Length อาจไม่มีหรือไม่ตรง)
+    limit = image_search.IMAGE_MAX_BYTES
+    too_large = HTTPException(status_code=413, detail=f"Image must be at most {limit} bytes")
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise too_large
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise too_large
+        chunks.append(chunk)
+    data = b"".join(chunks)
+    if not data:
+        raise HTTPException(status_code=400, detail="Request body must contain the image bytes")
+    matches = await offload(lambda session: image_search.get_image_searcher(session).search_castles(data, k=k))
+    return [{"castle_id": castle_id, "score": score, "img_ids": img_ids} for castle_id, score, img_ids in matches]
+
+@app.get("/nearby-places", response_model=schemas.NearbyPlacePage)
+async def list_nearby_places(after: int = 0, limit: int = 20, castle_id: int = None, db: AsyncSession = Depends(get_async_db)):
+    return ORJSONResponse(await repository.list_page_async(db, "nearby_places", after, _page_size(limit), castle_id))
+
+##### Route
+@app.get("/routes/suggestions", response_model=List[schemas.RouteSuggestionResponse])
+async def suggest_routes(k: int = Query(5, ge=1, le=MAX_K), size: int = Query(4, ge=2, le=20), castle_id: int = None):
+    # กลุ่ม castle ที่คนเที่ยวต่อกันบ่อยแต่ยังไม่มี route -> candidate สำหรับสร้าง Route ใหม่
+    return ORJSONResponse(await offload(
+        lambda session: covisit.get_graph(session).suggest_routes(k, size, seed_castle=castle_id)))
+
+##### Trip Plan
+@app.post("/trip-plans/{plan_id}/itinerary", response_model=List[schemas.TripItineraryResponse])
+async def create_itinerary(plan_id: int, request: schemas.ItineraryRequest):
+    # solver ใช้ CPU ได้ถึง time_budget_ms -> ทำใน threadpool ทั้งก้อน (อ่าน plan / เขียน TripItinerary ด้วย sync session)
+    def plan_trip(session):
+        plan = session.get(model.TripPlan, plan_id)
+        if plan is None:
+            return None
+        session.expire_on_commit = False # แปลงแถวที่เพิ่ง commit เป็น response โดยไม่ SELECT ซ้ำทีละแถว
+        rows = itinerary.plan_itinerary(
+            session, plan, request.castle_ids, request.visit_minutes, request.time_budget_ms / 1000.0)
+        return [schemas.TripItineraryResponse.model_validate(row) for row in rows]
+
+    try:
+        rows = await offload(plan_trip)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Trip plan not found")
+    return rows
+
+##### RAG search
+@app.get("/places/search", response_model=List[schemas.PlaceSearchResponse])
+async def search_places(q: str, k: int = Query(10, ge=1, le=MAX_K), user_id: int = None):
+    activity_log.log_search(q, user_id)
+    return await offload(lambda session: retrieval.get_place_searcher(session).search(q, k=k))
+
+@app.get("/search/autocomplete", response_model=List[schemas.AutocompleteResponse])
+async def read_autocomplete(q: str, k: int = Query(10, ge=1, le=MAX_K), kinds: str = None):
+    kinds = set(kinds.split(",")) if kinds else None
+    rows = await offload(lambda session: autocomplete.get_autocomplete(session).suggest(q, k, kinds))
+    return [{"text": text, "kind": kind, "ref_id": ref_id} for text, kind, ref_id in rows]
+
+@app.get("/search/trending", response_model=List[schemas.TrendingQueryResponse])
+def read_trending_queries(k: int = Query(10, ge=1, le=MAX_K), minutes: int = Query(60, ge=1, le=24 * 60)):
+    return [{"query": query, "count": count} for query, count in activity_log.top_queries.top(k, minutes * 60)]
+
+##### Monitoring
+# async + ไม่แตะ threadpool -> ตอบได้เสมอแม้ threadpool จะยุ่งกับการสร้าง index
+@app.get("/health/live")
+async def read_liveness():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def read_readiness():
+    # 503 ระหว่าง warm-up (load balancer ยังไม่ส่ง traffic มา) / component ที่ fail -> status "degraded"
+    snapshot = startup.snapshot()
+    return ORJSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
+@app.get("/db/pool")
+def read_pool_status():
+    # เหมือน /metrics: รายงานเฉพาะ engine ที่สร้างแล้ว ไม่สร้างใหม่
+    return {name: database.pool_status(engine) for name, engine in database.created_engines().items()}
+
+@app.get("/cache/stats")
+def read_cache_stats():
+    return response_cache.snapshot()
+
+@app.get("/activity/stats")
+def read_activity_stats():
+    return activity_log.snapshot()
+
+@app.get("/metrics")
+def read_metrics():
+    # ไม่สร้าง engine เพียงเพราะมีคน scrape
+    pools = {name: database.pool_status(engine) for name, engine in database.created_engines().items()}
+    body = metrics.render(response_cache.snapshot(), pools, startup.snapshot())
+    return Response(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # if __name__ == "__main__":
-#     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+#     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,355 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+from sqlalchemy import func, select
+
+import collaborative
+import embedding
+import model
+import recommend
+from startup import building, startup
+
+
+### Materialized recommendations: top-N castle ต่อ user คำนวณไว้ล่วงหน้า
+# score = CF (ALS) + content (profile จาก castle ที่เคยไป/สนใจ + คำค้นหา เทียบกับ text_vector)
+# เก็บเป็น .npy (user_ids เรียงแล้ว, castle_ids / scores [users x N]) -> endpoint แค่ searchsorted บน mmap
+# รอบถัดไปคำนวณใหม่เฉพาะ user ที่มี VisitHistory / SearchHistory / Interest ใหม่กว่า watermark
+
+USER_RECS_PATH = os.getenv("USER_RECS_PATH", "indexes/user_recs")
+USER_RECS_TOP_N = int(os.getenv("USER_RECS_TOP_N", "50"))
+CF_WEIGHT = 1.0
+CONTENT_WEIGHT = 0.5
+POPULARITY_WEIGHT = 0.1
+SEARCH_WEIGHT = 0.5 # น้ำหนักของคำค้นหาใน content profile เทียบกับ castle ที่เคยไป
+RECENT_SEARCHES = 20
+CHUNK_USERS = 2000
+RELOAD_CHECK_SECONDS = 1.0
+
+
+def _standardize(scores):
+    mean = scores.mean(axis=1, keepdims=True)
+    std = scores.std(axis=1, keepdims=True)
+    std[std == 0] = 1.0
+    return (scores - mean) / std
+
+
+##### คำนวณ (ใน worker process)
+
+_state = {}
+
+
+def _init_worker(state):
+    _state.clear()
+    _state.update(state)
+
+
+def _score_chunk(payload):
+    """Top-N (castle_ids, scores) for a chunk of users."""
+    user_factors, profiles, seen_indptr, seen_cols, top_n = payload
+    castle_ids = _state["castle_ids"]
+    if castle_ids.size == 0:
+        return np.empty((user_factors.shape[0], 0), dtype=np.int32), np.empty((user_factors.shape[0], 0), dtype=np.float32)
+    # popularity เป็นตัวตัดสินเมื่อ user ไม่มีสัญญาณอื่น
+    scores = np.repeat(POPULARITY_WEIGHT * _state["popularity"][None, :], user_factors.shape[0], axis=0)
+    if _state["castle_factors"] is not None:
+        scores += CF_WEIGHT * _standardize(user_factors @ _state["castle_factors"].T)
+    if _state["content"] is not None:
+        scores += CONTENT_WEIGHT * _standardize(profiles @ _state["content"].T)
+    rows = np.repeat(np.arange(scores.shape[0]), np.diff(seen_indptr))
+    scores[rows, seen_cols] = -np.inf
+    n = min(top_n, scores.shape[1])
+    best = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    best_scores = np.take_along_axis(scores, best, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    ids = castle_ids[best].astype(np.int32)
+    ids[~np.isfinite(best_scores)] = -1
+    return ids, np.where(np.isfinite(best_scores), best_scores, 0.0).astype(np.float32)
+
+
+##### เตรียมข้อมูลจาก DB
+
+# watermark เป็น primary key (เหมือน collaborative / covisit) ไม่ใช่เวลา:
+# visit_date มาจาก client และ activity_log เขียนแถวช้ากว่าเวลาจริงได้ -> แถวที่มาทีหลังแต่เวลาเก่ากว่าจะหลุด
+def current_watermarks(db):
+    return {
+        "visit_id": db.scalar(select(func.max(model.VisitHistory.visit_id))) or 0,
+        "search_id": db.scalar(select(func.max(model.SearchHistory.search_id))) or 0,
+        "interest_id": db.scalar(select(func.max(model.Interest.interest_id))) or 0,
+    }
+
+
+def changed_users(db, watermarks=None):
+    """Users with interactions newer than ``watermarks`` (None = every user with any)."""
+    watermarks = watermarks or {}
+    visits = select(model.VisitHistory.user_id)
+    searches = select(model.SearchHistory.user_id)
+    interests = select(model.Interest.user_id)
+    if watermarks.get("visit_id"):
+        visits = visits.where(model.VisitHistory.visit_id > watermarks["visit_id"])
+    if watermarks.get("search_id"):
+        searches = searches.where(model.SearchHistory.search_id > watermarks["search_id"])
+    if watermarks.get("interest_id"):
+        interests = interests.where(model.Interest.interest_id > watermarks["interest_id"])
+    users = set()
+    for statement in (visits, searches, interests):
+        users.update(user_id for user_id in db.scalars(statement.distinct()) if user_id is not None)
+    return np.array(sorted(users), dtype=np.int64)
+
+
+def _user_signals(db, user_ids, castle_pos):
+    """Seen castles (CSR rows aligned to ``user_ids``) and recent search texts per user."""
+    weights = {}
+    for statement, weight in (
+            (select(model.VisitHistory.user_id, model.VisitHistory.castle_id)
+             .where(model.VisitHistory.user_id.in_(user_ids)), collaborative.VISIT_WEIGHT),
+            (select(model.Interest.user_id, model.Interest.castle_id)
+             .where(model.Interest.user_id.in_(user_ids)), collaborative.INTEREST_WEIGHT)):
+        for user_id, castle_id in db.execute(statement):
+            col = castle_pos.get(castle_id)
+            if col is not None:
+                weights[(user_id, col)] = weights.get((user_id, col), 0.0) + weight
+    row_of = {user_id: row for row, user_id in enumerate(user_ids)}
+    if weights:
+        keys = list(weights)
+        seen = sp.csr_matrix(
+            (np.array([weights[k] for k in keys], dtype=np.float32),
+             ([row_of[u] for u, _ in keys], [c for _, c in keys])),
+            shape=(len(user_ids), len(castle_pos)))
+    else:
+        seen = sp.csr_matrix((len(user_ids), len(castle_pos)), dtype=np.float32)
+    searches = {}
+    for user_id, text in db.execute(
+            select(model.SearchHistory.user_id, model.SearchHistory.query_text)
+            .where(model.SearchHistory.user_id.in_(user_ids))
+            .order_by(model.SearchHistory.search_time.desc())):
+        texts = searches.setdefault(user_id, [])
+        if text and len(texts) < RECENT_SEARCHES:
+            texts.append(text)
+    return seen, searches
+
+
+def _build_state(db):
+    castle_ids = np.array(sorted(db.scalars(select(model.Castle.castle_id))), dtype=np.int64)
+    castle_pos = {castle_id: i for i, castle_id in enumerate(castle_ids.tolist())}
+    recommender = collaborative.refresh(db, collaborative.get_recommender(db))
+    recommender.save(collaborative.CF_MODEL_PATH)
+    popularity = np.zeros(castle_ids.shape[0], dtype=np.float32)
+    castle_factors = None
+    if recommender.castle_ids.size:
+        castle_factors = np.zeros((castle_ids.shape[0], recommender.factors), dtype=np.float32)
+        for row, castle_id in enumerate(recommender.castle_ids.tolist()):
+            if castle_id in castle_pos:
+                castle_factors[castle_pos[castle_id]] = recommender.castle_factors[row]
+                popularity[castle_pos[castle_id]] = recommender.popularity[row]
+    content = None
+    index_ids, index_vectors = recommend.get_castle_index(db).snapshot()
+    if index_ids.size:
+        content = np.zeros((castle_ids.shape[0], index_vectors.shape[1]), dtype=np.float32)
+        for castle_id, vector in zip(index_ids.tolist(), index_vectors):
+            if castle_id in castle_pos:
+                content[castle_pos[castle_id]] = vector
+    state = {
+        "castle_ids": castle_ids,
+        "castle_factors": castle_factors,
+        "content": content,
+        "popularity": _standardize(popularity[None, :])[0] if popularity.size else popularity,
+    }
+    return recommender, castle_pos, state
+
+
+def _payloads(db, user_ids, recommender, castle_pos, state, top_n):
+    encoder = embedding.get_encoder(embedding.EMBEDDING_ENCODER, model.TEXT_VECTOR_DIM)
+    factors = recommender.factors
+    for start in range(0, user_ids.shape[0], CHUNK_USERS):
+        chunk = user_ids[start:start + CHUNK_USERS]
+        seen, searches = _user_signals(db, chunk.tolist(), castle_pos)
+        user_factors = np.zeros((chunk.shape[0], factors), dtype=np.float32)
+        for row, user_id in enumerate(chunk.tolist()):
+            cf_row = recommender._user_pos.get(user_id)
+            if cf_row is not None:
+                user_factors[row] = recommender.user_factors[cf_row]
+        profiles = None
+        if state["content"] is not None:
+            profiles = np.asarray(seen @ state["content"], dtype=np.float32)
+            profiles /= np.maximum(np.linalg.norm(profiles, axis=1, keepdims=True), 1e-12)
+            for row, user_id in enumerate(chunk.tolist()):
+                if user_id in searches:
+                    profiles[row] += SEARCH_WEIGHT * encoder.encode(searches[user_id]).mean(axis=0)
+        yield chunk, (user_factors, profiles, seen.indptr, seen.indices, top_n)
+
+
+##### Storage: version directory + meta.json (เปลี่ยน meta.json = swap แบบ atomic)
+
+def _meta_path(path):
+    return os.path.join(path, "meta.json")
+
+
+def read_meta(path=USER_RECS_PATH):
+    if not os.path.exists(_meta_path(path)):
+        return None
+    with open(_meta_path(path)) as f:
+        return json.load(f)
+
+
+def write_version(path, user_ids, castle_ids, scores, watermarks, top_n):
+    meta = read_meta(path)
+    version = (meta["version"] + 1) if meta else 1
+    folder = os.path.join(path, f"v{version}")
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, "user_ids.npy"), user_ids)
+    np.save(os.path.join(folder, "castle_ids.npy"), castle_ids)
+    np.save(os.path.join(folder, "scores.npy"), scores)
+    tmp_path = _meta_path(path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version, "top_n": top_n, "users": int(user_ids.shape[0]),
+                   "watermarks": watermarks}, f)
+    os.replace(tmp_path, _meta_path(path))
+    # เก็บ version ก่อนหน้าไว้ 1 ชุด (worker ที่ยัง map อยู่อ่านต่อได้)
+    for name in os.listdir(path):
+        if name.startswith("v") and name[1:].isdigit() and int(name[1:]) < version - 1:
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    return version
+
+
+class MaterializedRecommendations:
+    """Read-only view of the latest version; reopens when meta.json changes."""
+
+    def __init__(self, path=USER_RECS_PATH):
+        self.path = path
+        self.version = None
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.castle_ids = np.empty((0, 0), dtype=np.int32)
+        self.scores = np.empty((0, 0), dtype=np.float32)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        meta = read_meta(self.path)
+        if meta is None or meta["version"] == self.version:
+            return
+        folder = os.path.join(self.path, f"v{meta['version']}")
+        user_ids = np.load(os.path.join(folder, "user_ids.npy"), mmap_mode="r")
+        castle_ids = np.load(os.path.join(folder, "castle_ids.npy"), mmap_mode="r")
+        scores = np.load(os.path.join(folder, "scores.npy"), mmap_mode="r")
+        with self._lock:
+            self.user_ids, self.castle_ids, self.scores = user_ids, castle_ids, scores
+            self.version = meta["version"]
+
+    def lookup(self, user_id, k=10):
+        """[(castle_id, score), ...] or None when the user is not materialized."""
+        now = time.monotonic()
+        if now - self._checked_at > RELOAD_CHECK_SECONDS:
+            self._checked_at = now
+            self.reload()
+        with self._lock:
+            user_ids, castle_ids, scores = self.user_ids, self.castle_ids, self.scores
+        row = int(np.searchsorted(user_ids, user_id))
+        if row >= user_ids.shape[0] or user_ids[row] != user_id:
+            return None
+        ids = castle_ids[row, :k]
+        keep = ids >= 0
+        return list(zip(ids[keep].tolist(), scores[row, :k][keep].tolist()))
+
+
+_materialized = None
+_materialized_lock = threading.Lock()
+
+
+def get_materialized():
+    global _materialized
+    if _materialized is None:
+        with building(_materialized_lock, "materialize"):
+            if _materialized is None:
+                with startup.timed("materialize"):
+                    _materialized = MaterializedRecommendations()
+    return _materialized
+
+
+##### Job
+
+def run(db, path=USER_RECS_PATH, full=False, workers=None, top_n=USER_RECS_TOP_N, progress=print):
+    """Recompute changed users (or everyone with ``full``) and write a new version."""
+    meta = None if full else read_meta(path)
+    watermarks = current_watermarks(db)
+    user_ids = changed_users(db, meta["watermarks"] if meta else None)
+    started = time.perf_counter()
+    recommender, castle_pos, state = _build_state(db)
+
+    new_ids, new_castles, new_scores = [], [], []
+    payloads = _payloads(db, user_ids, recommender, castle_pos, state, top_n)
+    if workers == 1 or user_ids.shape[0] <= CHUNK_USERS:
+        _init_worker(state)
+        results = ((chunk, _score_chunk(payload)) for chunk, payload in payloads)
+        for chunk, (ids, scores) in results:
+            new_ids.append(chunk)
+            new_castles.append(ids)
+            new_scores.append(scores)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,)) as pool:
+            futures = [(chunk, pool.submit(_score_chunk, payload)) for chunk, payload in payloads]
+            for chunk, future in futures:
+                ids, scores = future.result()
+                new_ids.append(chunk)
+                new_castles.append(ids)
+                new_scores.append(scores)
+
+    width = top_n
+    user_array = np.concatenate(new_ids) if new_ids else np.empty(0, dtype=np.int64)
+    castle_array = _pad(new_castles, width, -1, np.int32)
+    score_array = _pad(new_scores, width, 0.0, np.float32)
+    if meta is not None:
+        # รวมกับ version เดิม: user ที่ไม่เปลี่ยนใช้ค่าเดิม
+        old = MaterializedRecommendations(path)
+        keep = ~np.isin(old.user_ids, user_array)
+        user_array = np.concatenate([np.asarray(old.user_ids)[keep], user_array])
+        castle_array = np.concatenate([_pad([np.asarray(old.castle_ids)[keep]], width, -1, np.int32), castle_array])
+        score_array = np.concatenate([_pad([np.asarray(old.scores)[keep]], width, 0.0, np.float32), score_array])
+    order = np.argsort(user_array, kind="stable")
+    version = write_version(path, user_array[order], castle_array[order], score_array[order], watermarks, top_n)
+    if progress:
+        progress(f"version={version} refreshed={user_ids.shape[0]} users={user_array.shape[0]} "
+                 f"in {time.perf_counter() - started:.2f}s")
+    return version
+
+
+def _pad(blocks, width, fill, dtype):
+    blocks = [b for b in blocks if b.size]
+    if not blocks:
+        return np.empty((0, width), dtype=dtype)
+    out = np.full((sum(b.shape[0] for b in blocks), width), fill, dtype=dtype)
+    start = 0
+    for block in blocks:
+        n = min(width, block.shape[1])
+        out[start:start + block.shape[0], :n] = block[:, :n]
+        start += block.shape[0]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize top-N recommendations per user")
+    parser.add_argument("--full", action="store_true", help="recompute every user instead of changed ones")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top-n", type=int, default=USER_RECS_TOP_N)
+    args = parser.parse_args()
+
+    from db import SessionLocal
+
+    db = SessionLocal()
+    try:
+        run(db, full=args.full, workers=args.workers, top_n=args.top_n)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+
+import profiler
+
+
+### Instrumentation: latency ต่อ route, จำนวน/เวลา SQL ต่อ request, cache hit rate -> GET /metrics (Prometheus text)
+# ต้นทุนต่อ request = perf_counter ไม่กี่ครั้ง + bisect + lock สั้นๆ -> เปิดไว้ใน production ได้
+# SQL นับผ่าน engine event แล้วผูกกับ request ด้วย contextvar (ใช้ได้ทั้ง async, run_sync และ threadpool)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0")) # สุ่ม profile กี่ % ของ request (0.01 = 1%)
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "") # ว่าง = ปิดการสั่ง profile ผ่าน header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label tuple (Prometheus semantics)."""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total, n) for labels, (counts, total, n) in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, n) in sorted(self.snapshot().items()):
+            base = _labels(zip(self.label_names, labels))
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                lines.append(f"{self.name}_bucket{_labels(zip(self.label_names, labels), le=bound)} {running}")
+            lines.append(f"{self.name}_sum{base} {total}")
+            lines.append(f"{self.name}_count{base} {n}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs, **extra):
+    pairs = list(pairs) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _metric(name, kind, help_text, samples):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels.items())} {value}")
+    return lines
+
+
+##### SQL: engine events -> สถิติของ request ปัจจุบัน + ยอดรวมทั้ง process
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+class SQLTotals:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+
+
+sql_totals = SQLTotals()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    sql_totals.record(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += elapsed
+
+
+def _handle_error(context):
+    # statement ที่ error ไม่ผ่าน after_cursor_execute -> เอาเวลาเริ่มออกจาก stack
+    if context.connection is not None:
+        starts = context.connection.info.get("metrics_query_start")
+        if starts:
+            starts.pop()
+    with sql_totals._lock:
+        sql_totals.errors += 1
+
+
+def instrument_engine(engine):
+    engine = getattr(engine, "sync_engine", engine)
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+##### Registry + ASGI middleware
+
+request_latency = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "route", "status"), LATENCY_BUCKETS)
+request_sql_queries = Histogram(
+    "http_request_sql_queries", "SQL statements issued per request.", ("method", "route"), SQL_COUNT_BUCKETS)
+request_sql_seconds = Histogram(
+    "http_request_sql_duration_seconds", "Total SQL time per request.", ("method", "route"), LATENCY_BUCKETS)
+
+
+def _route_label(scope):
+    # ใช้ path template (/castles/{castle_id}) ไม่ใช่ path จริง -> จำนวน series ไม่บาน
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _profile_requested(scope):
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True
+    if not PROFILE_TOKEN:
+        return False
+    header = PROFILE_HEADER.lower().encode("latin-1")
+    for name, value in scope.get("headers", ()):
+        if name == header:
+            return value.decode("latin-1") == PROFILE_TOKEN
+    return False
+
+
+class InstrumentationMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware overhead, streaming untouched)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        session = profiler.start() if _profile_requested(scope) else None
+        status = [500]
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if SERVER_TIMING:
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    timing = (f'app;dur={elapsed_ms:.2f}, db;dur={stats.sql_seconds * 1000:.2f};'
+                              f'desc="{stats.sql_count} queries"').encode("latin-1")
+                    message["headers"] = list(message.get("headers", ())) + [(b"server-timing", timing)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            method, route = scope["method"], _route_label(scope)
+            request_latency.observe((method, route, str(status[0])), elapsed)
+            request_sql_queries.observe((method, route), stats.sql_count)
+            request_sql_seconds.observe((method, route), stats.sql_seconds)
+            if session is not None:
+                profiler.finish(session, f"{method} {route}", elapsed)
+
+
+def render(cache_stats=None, pools=None, startup=None):
+    """Prometheus text exposition (version 0.0.4)."""
+    lines = request_latency.render() + request_sql_queries.render() + request_sql_seconds.render()
+    with sql_totals._lock:
+        queries, seconds, errors = sql_totals.queries, sql_totals.seconds, sql_totals.errors
+    lines += _metric("db_queries_total", "counter", "SQL statements executed.", [({}, queries)])
+    lines += _metric("db_query_seconds_total", "counter", "Time spent in SQL statements.", [({}, seconds)])
+    lines += _metric("db_query_errors_total", "counter", "SQL statements that raised.", [({}, errors)])
+    if cache_stats is not None:
+        lines += _metric("cache_lookups_total", "counter", "Response cache lookups by result.", [
+            ({"result": "local_hit"}, cache_stats["local_hits"]),
+            ({"result": "remote_hit"}, cache_stats["remote_hits"]),
+            ({"result": "miss"}, cache_stats["misses"]),
+        ])
+        lines += _metric("cache_hit_ratio", "gauge", "Response cache hit ratio since start.",
+                         [({}, cache_stats["hit_rate"])])
+        lines += _metric("cache_local_entries", "gauge", "Entries in the in-process cache.",
+                         [({}, cache_stats["local_entries"])])
+        lines += _metric("cache_remote_errors_total", "counter", "Redis errors.", [({}, cache_stats["remote_errors"])])
+    pools = pools or {}
+    for metric, kind, help_text, key in (
+        ("db_pool_checkouts_total", "counter", "Pool checkouts.", "checkouts"),
+        ("db_pool_wait_seconds_total", "counter", "Time spent waiting for a connection.", "wait_seconds_total"),
+        ("db_pool_checked_out", "gauge", "Connections in use.", "checkedout"),
+    ):
+        samples = [({"engine": name}, status[key]) for name, status in pools.items() if key in status]
+        if samples:
+            lines += _metric(metric, kind, help_text, samples)
+    if startup is not None:
+        lines += _metric("app_ready", "gauge", "1 once background warm-up has finished.", [({}, int(startup["ready"]))])
+        samples = [({"component": name, "phase": phase}, round(component[f"{phase}_ms"] / 1000, 6))
+                   for name, component in startup["components"].items()
+                   for phase in ("import", "init") if component[f"{phase}_ms"] is not None]
+        if samples:
+            lines += _metric("app_component_load_seconds", "gauge", "Import / init time of each component.", samples)
+        lines += _metric("app_component_ready", "gauge", "1 if the component is loaded.", [
+            ({"component": name}, int(component["state"] == "ready"))
+            for name, component in startup["components"].items()])
+    return "\n".join(lines) + "\n"
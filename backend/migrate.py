@@ -0,0 +1,61 @@
+import argparse
+
+from sqlalchemy import text
+
+import model
+
+
+### Schema migration สำหรับ database ที่สร้างไว้ก่อนมี column ใหม่ (Postgres)
+# create_all สร้างเฉพาะตารางที่ยังไม่มี -> column ใหม่ในตารางเดิมต้อง ALTER เอง
+# ทุกคำสั่งเป็น IF NOT EXISTS -> รันซ้ำกี่ครั้งก็ได้ (เช่นทุกครั้งก่อน start)
+
+STATEMENTS = [
+    "CREATE EXTENSION IF NOT EXISTS vector",
+    # embedding (embedding.py / image_search.py)
+    f"ALTER TABLE castles ADD COLUMN IF NOT EXISTS text_vector vector({model.TEXT_VECTOR_DIM})",
+    f"ALTER TABLE images ADD COLUMN IF NOT EXISTS image_vector vector({model.IMAGE_VECTOR_DIM})",
+    f"ALTER TABLE places_rag ADD COLUMN IF NOT EXISTS document_vector vector({model.DOCUMENT_VECTOR_DIM})",
+    # ลำดับ castle ใน route (covisit.py / itinerary.py)
+    "ALTER TABLE route_castles ADD COLUMN IF NOT EXISTS sequence_order INTEGER",
+    # ingest.py: ไฟล์ต้นทาง + passage
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS source_path VARCHAR",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE places_rag ADD COLUMN IF NOT EXISTS passage_index INTEGER",
+    "ALTER TABLE places_rag ADD COLUMN IF NOT EXISTS content TEXT",
+    "ALTER TABLE places_rag ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    # ชื่อเดียวกับที่ create_all ตั้งให้ -> database ใหม่ไม่ได้ index ซ้ำ
+    "CREATE UNIQUE INDEX IF NOT EXISTS documents_source_path_key ON documents (source_path)",
+    "CREATE INDEX IF NOT EXISTS ix_places_rag_content_hash ON places_rag (content_hash)",
+]
+
+
+def migrate(engine):
+    """Create missing tables, then add the columns/indexes older databases lack."""
+    with engine.begin() as conn:
+        conn.execute(text(STATEMENTS[0]))
+    model.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for statement in STATEMENTS[1:]:
+            conn.execute(text(statement))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create / upgrade the database schema (idempotent)")
+    parser.add_argument("--sql", action="store_true", help="print the statements instead of running them")
+    args = parser.parse_args()
+
+    if args.sql:
+        for statement in STATEMENTS:
+            print(statement + ";")
+        return
+
+    from db import engine
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit(f"migrate.py supports PostgreSQL only (got {engine.dialect.name})")
+    migrate(engine)
+    print(f"applied {len(STATEMENTS)} statements")
+
+
+if __name__ == "__main__":
+    main()
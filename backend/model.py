@@ -1,9 +1,13 @@
 from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Float, Time
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
-# from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector
 from db import Base
 
+TEXT_VECTOR_DIM = 768
+IMAGE_VECTOR_DIM = 512
+DOCUMENT_VECTOR_DIM = 768
+
 
 ### ORM Class
 class User(Base):
@@ -108,7 +112,7 @@ class Castle(Base):
     castle_name = Column(String, index=True)
     castle_description = Column(Text)
     era = Column(String)    
-    # text_vector = Column(Vector(768))
+    text_vector = Column(Vector(TEXT_VECTOR_DIM), nullable=True)
 
     # Foreign Keys
     # ปรับปรุงจาก DBML: เอา type_id มาใส่ใน Castle (Many-to-One) ตาม Best Practice
@@ -128,6 +132,10 @@ class Castle(Base):
     # 1-to-1 Location logic (via Link Table or Direct FK, here using Link Table as per DBML)
     location_link = relationship("LocationCastle", back_populates="castle", uselist=False)
 
+    @property
+    def location(self): # ใช้กับ CastleResponse.location
+        return self.location_link.location if self.location_link is not None else None
+
 
 class Architecture(Base):
     __tablename__ = "architectures"
@@ -170,7 +178,7 @@ class Image(Base):
     img_id = Column(Integer, primary_key=True, index=True)
     castle_id = Column(Integer, ForeignKey("castles.castle_id"))
     img_description = Column(Text)    
-    # image_vector = Column(Vector(512))
+    image_vector = Column(Vector(IMAGE_VECTOR_DIM), nullable=True)
 
     castle = relationship("Castle", back_populates="images")
 
@@ -216,7 +224,7 @@ class RouteCastle(Base):
     # Composite Primary Key
     route_id = Column(Integer, ForeignKey("routes.route_id"), primary_key=True)
     castle_id = Column(Integer, ForeignKey("castles.castle_id"), primary_key=True)
-    # sequence_order = Column(Integer, nullable=True) # store order castle in route
+    sequence_order = Column(Integer, nullable=True) # store order castle in route
 
     route = relationship("Route", back_populates="castles")
     castle = relationship("Castle")
@@ -227,6 +235,9 @@ class Document(Base):
     document_id = Column(Integer, primary_key=True, index=True)
     castle_id = Column(Integer, ForeignKey("castles.castle_id"))
     document_name = Column(String)
+    # ingest.py: ไฟล์ต้นทาง + sha256 ของไฟล์ (เหมือนเดิม = ข้ามได้ทั้งไฟล์)
+    source_path = Column(String, unique=True, nullable=True)
+    content_hash = Column(String(64), nullable=True)
 
     places = relationship("Place", back_populates="document")
 
@@ -238,7 +249,11 @@ class Place(Base):
     # DBML: Ref : Place.place_id > Document.document_id
     document_id = Column(Integer, ForeignKey("documents.document_id"))
     castle_id = Column(Integer, nullable=True) 
-    # document_vector = Column(Vector(768))
+    document_vector = Column(Vector(DOCUMENT_VECTOR_DIM), nullable=True)
+    # passage ที่ตัดจากเอกสาร (ingest.py) -- hash ใช้จับคู่ passage เดิมตอน ingest ซ้ำ
+    passage_index = Column(Integer, nullable=True)
+    content = Column(Text, nullable=True)
+    content_hash = Column(String(64), nullable=True, index=True)
 
     document = relationship("Document", back_populates="places")
     keywords = relationship("PlaceKeyword", back_populates="place")
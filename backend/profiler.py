@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+### Sampling profiler ต่อ request (เปิดเฉพาะ request ที่สุ่มได้ / ส่ง header มา)
+# thread แยกอ่าน stack ของทุก thread ทุก PROFILE_INTERVAL วินาที ระหว่างที่ request ทำงาน
+# output = collapsed stacks ("a;b;c 12") -> flamegraph.pl / speedscope / inferno เปิดได้ตรงๆ
+# หมายเหตุ: event loop ใช้ thread เดียวร่วมกัน -> ถ้ามี request อื่นทำงานพร้อมกัน stack ของมันจะติดมาด้วย
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.002"))
+MAX_DEPTH = 128
+# leaf ที่อยู่ในไฟล์เหล่านี้ = thread ว่าง (รอ I/O / รองาน) -> ไม่นับ
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame):
+    if os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+        return None
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class ProfileSession:
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = _collapse(frame)
+                if stack:
+                    self.stacks[stack] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def start(interval=PROFILE_INTERVAL):
+    session = ProfileSession(interval)
+    session._thread.start()
+    return session
+
+
+def finish(session, label, elapsed, folder=PROFILE_DIR):
+    """Stop sampling and write ``<folder>/<timestamp>-<label>.folded``; returns the path."""
+    session.stop()
+    if not session.stacks:
+        return None
+    os.makedirs(folder, exist_ok=True)
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+    path = os.path.join(folder, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{name}.folded")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(session.collapsed())
+    os.replace(tmp_path, path)
+    return path
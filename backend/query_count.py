@@ -0,0 +1,37 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+### นับจำนวน SQL statement ที่ engine ส่งออกไป (ใช้ตรวจ N+1 ใน test / benchmark)
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    """Count statements executed on ``engine`` (sync or async) inside the block."""
+    engine = getattr(engine, "sync_engine", engine)
+    counter = QueryCounter()
+    event.listen(engine, "before_cursor_execute", counter._before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter._before_cursor_execute)
+
+
+@contextmanager
+def assert_max_queries(engine, expected):
+    """Fail if the block issues more than ``expected`` statements."""
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > expected:
+        listing = "\n".join(f"  {i + 1}. {sql}" for i, sql in enumerate(counter.statements))
+        raise AssertionError(f"expected at most {expected} queries, got {counter.count}:\n{listing}")
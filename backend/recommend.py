@@ -0,0 +1,151 @@
+import os
+import threading
+
+import numpy as np
+
+import embedding_store
+import model
+from startup import building, startup
+from vector_index import VectorIndex, normalize
+
+
+### Castle recommendation (content similarity บน text_vector)
+
+CASTLE_INDEX_PATH = os.getenv("CASTLE_INDEX_PATH", "indexes/castle_text.npz")
+# มี embedding store -> castle ที่เพิ่ม/แก้ตอน runtime ยังไม่อยู่ใน store จนกว่าจะ export ใหม่
+# เก็บแยกเป็น delta: ใส่ซ้ำบน store version ใหม่ทุกครั้งที่สลับ + เขียนลง disk ตอนปิด
+CASTLE_DELTA_PATH = os.getenv("CASTLE_DELTA_PATH", "indexes/castle_text_delta.npz")
+LOAD_BATCH_SIZE = 2000
+
+_castle_index = None
+_castle_index_lock = threading.Lock()
+_castle_store = None
+_castle_delta = {}
+_castle_delta_lock = threading.Lock()
+_castle_delta_dirty = False
+
+
+def build_castle_index(db):
+    """Stream every castle embedding out of Postgres into a fresh index."""
+    index = VectorIndex(model.TEXT_VECTOR_DIM)
+    rows = (
+        db.query(model.Castle.castle_id, model.Castle.text_vector)
+        .filter(model.Castle.text_vector.isnot(None))
+        .order_by(model.Castle.castle_id)
+        .yield_per(LOAD_BATCH_SIZE)
+    )
+    ids, vectors = [], []
+    for castle_id, vector in rows:
+        ids.append(castle_id)
+        vectors.append(vector)
+        if len(ids) == LOAD_BATCH_SIZE:
+            index.add(ids, np.asarray(vectors, dtype=np.float32))
+            ids, vectors = [], []
+    if ids:
+        index.add(ids, np.asarray(vectors, dtype=np.float32))
+    return index
+
+
+def _read_delta(path=CASTLE_DELTA_PATH):
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as data:
+        return dict(zip(data["ids"].tolist(), data["vectors"]))
+
+
+def _index_from_store(store):
+    """Index over ``store`` plus the runtime inserts it does not contain yet (call with the delta lock)."""
+    global _castle_delta_dirty
+    index = VectorIndex.from_arrays(store.ids, store.vectors)
+    if _castle_delta:
+        ids = list(_castle_delta)
+        vectors = normalize(np.stack([_castle_delta[i] for i in ids]))
+        stored, found = store.get(ids)
+        # version ใหม่มี vector เดียวกันแล้ว -> ไม่ต้องเก็บใน delta ต่อ
+        caught_up = found & np.all(np.abs(stored - vectors) < 1e-5, axis=1)
+        for castle_id in np.asarray(ids)[caught_up].tolist():
+            del _castle_delta[castle_id]
+            _castle_delta_dirty = True
+        if not caught_up.all():
+            index.add(np.asarray(ids)[~caught_up], vectors[~caught_up])
+    return index
+
+
+def get_castle_index(db):
+    """Return the process-wide index.
+
+    Prefers the shared memory-mapped embedding store (swapped in when a new
+    version is published, with runtime inserts re-applied), then the persisted
+    index, then a build from the DB.
+    """
+    global _castle_index, _castle_store
+    if _castle_store is not None and _castle_store.refresh():
+        with _castle_delta_lock:
+            _castle_index = _index_from_store(_castle_store)
+    if _castle_index is None:
+        with building(_castle_index_lock, "recommend"):
+            if _castle_index is None:
+                with startup.timed("recommend"):
+                    store_folder = embedding_store.store_path("castle")
+                    if embedding_store.exists(store_folder):
+                        store = embedding_store.EmbeddingStore(store_folder)
+                        with _castle_delta_lock:
+                            _castle_delta.update(_read_delta())
+                            _castle_index = _index_from_store(store)
+                        _castle_store = store
+                    elif os.path.exists(CASTLE_INDEX_PATH):
+                        _castle_index = VectorIndex.load(CASTLE_INDEX_PATH)
+                    else:
+                        _castle_index = build_castle_index(db)
+                        _castle_index.save(CASTLE_INDEX_PATH)
+    return _castle_index
+
+
+def _save_delta(path=CASTLE_DELTA_PATH):
+    global _castle_delta_dirty
+    with _castle_delta_lock:
+        if not _castle_delta_dirty:
+            return
+        # worker อื่นอาจเขียนไฟล์ไว้แล้ว -> รวมกัน (ของ process นี้ใหม่กว่า)
+        delta = _read_delta(path)
+        delta.update(_castle_delta)
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        ids = sorted(delta)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=np.asarray(ids, dtype=np.int64),
+                     vectors=np.asarray([delta[i] for i in ids], dtype=np.float32).reshape(len(ids), model.TEXT_VECTOR_DIM))
+        os.replace(tmp_path, path)
+        _castle_delta_dirty = False
+
+
+def save_castle_index():
+    # มี embedding store -> store เป็นตัวหลัก (export ใหม่ด้วย embedding_store.py) เขียนแค่ delta
+    if _castle_store is not None:
+        _save_delta()
+    elif _castle_index is not None and _castle_index.dirty:
+        _castle_index.save(CASTLE_INDEX_PATH)
+
+
+def index_castle(db, castle):
+    """Incremental insert เมื่อมีการสร้าง/แก้ไข castle"""
+    global _castle_delta_dirty
+    if castle.text_vector is None:
+        return
+    vector = np.asarray(castle.text_vector, dtype=np.float32)
+    get_castle_index(db)
+    with _castle_delta_lock:
+        if _castle_store is not None:
+            _castle_delta[castle.castle_id] = vector
+            _castle_delta_dirty = True
+        _castle_index.add([castle.castle_id], vector)
+
+
+def similar_castles(db, castle_id, k=10):
+    index = get_castle_index(db)
+    vector = index.get(castle_id)
+    if vector is None:
+        return None
+    return index.search(vector, k=k, exclude=[castle_id])
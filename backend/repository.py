@@ -0,0 +1,139 @@
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+
+import model
+
+
+### Castle queries: กำหนด loader ให้ตรงกับ response แต่ละแบบ (กัน N+1)
+# many-to-one / 1-to-1 -> joinedload (JOIN เดียว)
+# one-to-many -> selectinload (1 query ต่อ relationship ไม่ว่าจะกี่แถว)
+# ที่เหลือ raiseload: ถ้า serializer ไปแตะ relationship ที่ไม่ได้โหลดจะ error ทันที แทนที่จะ query ทีละแถว
+
+def castle_list_options():
+    """Loaders for ``CastleResponse`` (castle + location)."""
+    return [
+        joinedload(model.Castle.location_link).joinedload(model.LocationCastle.location),
+        raiseload("*"),
+    ]
+
+
+def castle_detail_options():
+    """Loaders for ``CastleDetailResponse``."""
+    return [
+        joinedload(model.Castle.castle_type),
+        joinedload(model.Castle.location_link).joinedload(model.LocationCastle.location),
+        selectinload(model.Castle.architectures),
+        selectinload(model.Castle.images),
+        selectinload(model.Castle.events),
+        selectinload(model.Castle.nearby_places),
+        raiseload("*"),
+    ]
+
+
+def castle_list_statement(limit=20):
+    return select(model.Castle).options(*castle_list_options()).order_by(model.Castle.castle_id).limit(limit)
+
+
+def castle_detail_statement(castle_id):
+    return select(model.Castle).options(*castle_detail_options()).where(model.Castle.castle_id == castle_id)
+
+
+def castle_details_statement(limit=20):
+    return select(model.Castle).options(*castle_detail_options()).order_by(model.Castle.castle_id).limit(limit)
+
+
+##### sync session
+def list_castles(db, limit=20):
+    return db.scalars(castle_list_statement(limit)).unique().all()
+
+
+def get_castle_detail(db, castle_id):
+    return db.scalars(castle_detail_statement(castle_id)).unique().one_or_none()
+
+
+##### async session
+async def list_castles_async(db, limit=20):
+    return (await db.scalars(castle_list_statement(limit))).unique().all()
+
+
+async def get_castle_detail_async(db, castle_id):
+    return (await db.scalars(castle_detail_statement(castle_id))).unique().one_or_none()
+
+
+##### Keyset pagination (WHERE pk > after ORDER BY pk LIMIT n) -> ไม่ใช้ OFFSET
+# ORM path: โหลด object แล้วให้ Pydantic แปลง / lean path: select เฉพาะ column -> dict ตรงๆ
+
+MAX_PAGE_SIZE = 1000
+
+
+def castle_page_statement(after=0, limit=20):
+    return castle_list_statement(limit).where(model.Castle.castle_id > after)
+
+
+_CASTLE_COLUMNS = (model.Castle.castle_id, model.Castle.castle_name, model.Castle.castle_description,
+                   model.Castle.era, model.Castle.type_id)
+_LOCATION_COLUMNS = (model.Location.location_id, model.Location.latitude, model.Location.longitude,
+                     model.Location.sub_district, model.Location.district, model.Location.province)
+
+
+def castle_rows_statement(after=0, limit=20):
+    return (
+        select(*_CASTLE_COLUMNS, *_LOCATION_COLUMNS)
+        .outerjoin(model.LocationCastle, model.LocationCastle.castle_id == model.Castle.castle_id)
+        .outerjoin(model.Location, model.Location.location_id == model.LocationCastle.location_id)
+        .where(model.Castle.castle_id > after)
+        .order_by(model.Castle.castle_id)
+        .limit(limit)
+    )
+
+
+def castle_rows_to_dicts(rows):
+    """Rows of ``castle_rows_statement`` -> dicts shaped like ``CastleResponse``."""
+    castle_keys = [c.key for c in _CASTLE_COLUMNS]
+    location_keys = [c.key for c in _LOCATION_COLUMNS]
+    split = len(castle_keys)
+    items = []
+    for row in rows:
+        item = dict(zip(castle_keys, row[:split]))
+        item["location"] = dict(zip(location_keys, row[split:])) if row[split] is not None else None
+        items.append(item)
+    return items
+
+
+# entity -> (primary key, columns ตาม *Response schema)
+LEAN_LISTS = {
+    "events": (model.Event.event_id, (model.Event.event_id, model.Event.castle_id, model.Event.event_name,
+                                      model.Event.event_description, model.Event.event_start,
+                                      model.Event.event_end, model.Event.event_time)),
+    "images": (model.Image.img_id, (model.Image.img_id, model.Image.castle_id, model.Image.img_description)),
+    "nearby_places": (model.NearbyPlace.place_id, (model.NearbyPlace.place_id, model.NearbyPlace.castle_id,
+                                                   model.NearbyPlace.place_name, model.NearbyPlace.nearby_detail)),
+}
+
+
+def lean_rows_statement(entity, after=0, limit=20, castle_id=None):
+    pk, columns = LEAN_LISTS[entity]
+    stmt = select(*columns).where(pk > after)
+    if castle_id is not None:
+        stmt = stmt.where(columns[1] == castle_id)
+    return stmt.order_by(pk).limit(limit)
+
+
+def rows_to_dicts(entity, rows):
+    keys = [c.key for c in LEAN_LISTS[entity][1]]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def page(items, key, limit):
+    """Wrap a page; ``next_cursor`` is the last key when the page is full."""
+    return {"items": items, "next_cursor": items[-1][key] if len(items) == limit else None}
+
+
+async def list_castles_page_async(db, after=0, limit=20):
+    rows = (await db.execute(castle_rows_statement(after, limit))).all()
+    return page(castle_rows_to_dicts(rows), "castle_id", limit)
+
+
+async def list_page_async(db, entity, after=0, limit=20, castle_id=None):
+    rows = (await db.execute(lean_rows_statement(entity, after, limit, castle_id))).all()
+    return page(rows_to_dicts(entity, rows), LEAN_LISTS[entity][0].key, limit)
@@ -0,0 +1,365 @@
+import datetime
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy import func, select
+
+import event_index
+import geo_index
+import model
+import recommend
+from autocomplete import normalize
+from geo_index import haversine_km
+from startup import CatalogVersion, building, startup
+
+
+### Re-ranking: candidate (จาก CF / materialized / nearby) -> feature หลายตัวเป็น column numpy -> คะแนน = W @ F ครั้งเดียว
+# feature ทุกตัวอยู่ในช่วง 0..1 -> weight เทียบกันได้ตรงๆ
+# แล้วเลือกด้วย MMR (relevance - ความซ้ำกับที่เลือกไปแล้ว: content + ยุคเดียวกัน) + เหตุผลของแต่ละอันดับ
+
+FEATURES = ("retrieval", "content", "interest", "popularity", "distance", "type_era", "event")
+DEFAULT_WEIGHTS = {
+    "retrieval": 1.0, "content": 0.8, "interest": 0.5, "popularity": 0.3,
+    "distance": 0.5, "type_era": 0.4, "event": 0.3,
+}
+MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", "0.7")) # 1 = ไม่สนความหลากหลาย
+ERA_SIMILARITY = 0.5 # สัดส่วนของ "ยุคเดียวกัน" ในความเหมือนระหว่าง castle (ที่เหลือคือ content cosine)
+MMR_POOL = 5 # MMR เลือกจาก top (k x MMR_POOL) ตามคะแนน
+DISTANCE_SCALE_KM = float(os.getenv("RERANK_DISTANCE_SCALE_KM", "50")) # ห่างเท่านี้ -> feature เหลือ 1/e
+CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "500"))
+CATALOG_REFRESH_SECONDS = float(os.getenv("RERANK_CATALOG_REFRESH", "300"))
+TERM_CACHE_SIZE = 1024
+REASON_MIN_SHARE = 0.1 # feature ที่ให้คะแนนน้อยกว่า 10% ของคะแนนรวม ไม่ต้องอธิบาย
+
+
+def parse_weights(text, base=None):
+    """'content=1,distance=0.2' -> weights dict over ``base`` (unknown names raise ValueError)."""
+    weights = dict(base or DEFAULT_WEIGHTS)
+    for part in (text or "").split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in FEATURES:
+            raise ValueError(f"Unknown feature {name!r}; use one of {list(FEATURES)}")
+        weights[name] = float(value)
+    return weights
+
+
+DEFAULT_WEIGHTS = parse_weights(os.getenv("RERANK_WEIGHTS", ""), DEFAULT_WEIGHTS)
+
+
+def _minmax(values):
+    values = values.astype(np.float32, copy=False)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.zeros_like(values)
+    low, high = values[finite].min(), values[finite].max()
+    out = (values - low) / (high - low) if high > low else np.ones_like(values)
+    out[~finite] = 0.0
+    return out
+
+
+##### Castle catalog เป็น column (เรียงตาม castle_id -> หา row ด้วย searchsorted)
+
+class CastleCatalog:
+    def __init__(self):
+        self.castle_ids = np.empty(0, dtype=np.int64)
+        self.names = []
+        self.eras = []
+        self.types = []
+        self.era_codes = np.empty(0, dtype=np.int32)
+        self.type_codes = np.empty(0, dtype=np.int32)
+        self.lat = np.empty(0)
+        self.lon = np.empty(0)
+        self.popularity = np.empty(0, dtype=np.float32)
+        self.tag_text = []
+        self.loaded_at = 0.0
+        self._term_masks = OrderedDict()
+        self._vector_rows = (None, 0, None)
+        self._lock = threading.Lock()
+
+    def load(self, db):
+        rows = db.execute(
+            select(model.Castle.castle_id, model.Castle.castle_name, model.Castle.era, model.CastleType.type_detail,
+                   model.Location.latitude, model.Location.longitude, model.Location.province)
+            .outerjoin(model.CastleType, model.CastleType.type_id == model.Castle.type_id)
+            .outerjoin(model.LocationCastle, model.LocationCastle.castle_id == model.Castle.castle_id)
+            .outerjoin(model.Location, model.Location.location_id == model.LocationCastle.location_id)
+            .order_by(model.Castle.castle_id)
+        ).all()
+        self.castle_ids = np.array([r[0] for r in rows], dtype=np.int64)
+        self.names = [r[1] for r in rows]
+        self.eras = sorted({r[2] for r in rows if r[2]})
+        self.types = sorted({r[3] for r in rows if r[3]})
+        era_code = {era: i for i, era in enumerate(self.eras)}
+        type_code = {name: i for i, name in enumerate(self.types)}
+        self.era_codes = np.array([era_code.get(r[2], -1) for r in rows], dtype=np.int32)
+        self.type_codes = np.array([type_code.get(r[3], -1) for r in rows], dtype=np.int32)
+        self.lat = np.array([np.nan if r[4] is None else r[4] for r in rows], dtype=np.float64)
+        self.lon = np.array([np.nan if r[5] is None else r[5] for r in rows], dtype=np.float64)
+        self.tag_text = [normalize(" ".join(part for part in (r[1], r[2], r[3], r[6]) if part)) for r in rows]
+        # นับจาก DB อย่างเดียว: activity_log.visit_counts รวม visit ที่ flush ลง DB แล้ว -> บวกเพิ่มจะนับซ้ำทุกรอบ reload
+        # visit ที่ยังค้างใน write-behind queue เข้ามาใน reload รอบถัดไป
+        visits = dict(db.execute(
+            select(model.VisitHistory.castle_id, func.count()).group_by(model.VisitHistory.castle_id)).all())
+        counts = np.array([visits.get(c, 0) for c in self.castle_ids.tolist()], dtype=np.float32)
+        self.popularity = np.log1p(counts) / max(float(np.log1p(counts).max()) if counts.size else 0.0, 1e-9)
+        self._term_masks = OrderedDict()
+        self.loaded_at = time.monotonic()
+        return self
+
+    def rows(self, castle_ids):
+        """Row of each id (-1 when unknown)."""
+        castle_ids = np.asarray(castle_ids, dtype=np.int64)
+        if self.castle_ids.size == 0:
+            return np.full(castle_ids.shape[0], -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.castle_ids, castle_ids), self.castle_ids.shape[0] - 1)
+        return np.where(self.castle_ids[rows] == castle_ids, rows, -1)
+
+    def vector_rows(self, vectors):
+        """Row in ``vectors`` of every catalog castle; recomputed when the index is swapped or grows."""
+        with self._lock:
+            index, size, rows = self._vector_rows
+            if index is vectors and size == len(vectors):
+                return rows
+        rows = vectors.rows_of(self.castle_ids)
+        with self._lock:
+            self._vector_rows = (vectors, len(vectors), rows)
+        return rows
+
+    def term_mask(self, term):
+        """Castles whose name / era / type / province contains ``term`` (cached per term)."""
+        with self._lock:
+            mask = self._term_masks.get(term)
+            if mask is not None:
+                self._term_masks.move_to_end(term)
+                return mask
+        mask = np.fromiter((term in text for text in self.tag_text), dtype=bool, count=len(self.tag_text))
+        with self._lock:
+            self._term_masks[term] = mask
+            if len(self._term_masks) > TERM_CACHE_SIZE:
+                self._term_masks.popitem(last=False)
+        return mask
+
+
+##### User context: profile / ยุค-ประเภทที่ชอบ / ความสนใจ / castle ที่เคยไป
+
+class UserContext:
+    def __init__(self, profile=None, era_preference=None, type_preference=None, interests=(), seen=(),
+                 lat=None, lon=None, now=None):
+        self.profile = profile
+        self.era_preference = era_preference
+        self.type_preference = type_preference
+        self.interests = list(dict.fromkeys(normalize(term) for term in interests if term and normalize(term)))
+        self.seen = np.asarray(sorted(set(seen)), dtype=np.int64)
+        self.lat = lat
+        self.lon = lon
+        self.now = now or datetime.datetime.now()
+
+    @classmethod
+    def for_user(cls, db, catalog, vectors, user_id, lat=None, lon=None, now=None):
+        visited = db.scalars(select(model.VisitHistory.castle_id).where(model.VisitHistory.user_id == user_id)).all()
+        interests = db.execute(
+            select(model.Interest.castle_id, model.Interest.interest_name).where(model.Interest.user_id == user_id)
+        ).all()
+        liked = [c for c in visited if c is not None] + [c for c, _ in interests if c is not None]
+        profile = era_preference = type_preference = None
+        if liked:
+            rows = catalog.rows(liked)
+            rows = rows[rows >= 0]
+            era_preference = _preference(catalog.era_codes[rows], len(catalog.eras))
+            type_preference = _preference(catalog.type_codes[rows], len(catalog.types))
+            found_vectors, found = vectors.get_many(liked) if vectors is not None else (None, np.zeros(0, dtype=bool))
+            if found.any():
+                profile = found_vectors[found].mean(axis=0)
+                norm = np.linalg.norm(profile)
+                profile = profile / norm if norm > 0 else None
+        return cls(profile, era_preference, type_preference, [name for _, name in interests],
+                   liked, lat, lon, now)
+
+
+def _preference(codes, size):
+    codes = codes[codes >= 0]
+    if size == 0 or codes.size == 0:
+        return None
+    counts = np.bincount(codes, minlength=size).astype(np.float32)
+    return counts / counts.max()
+
+
+##### Re-ranker
+
+class Reranker:
+    def __init__(self, catalog, vectors=None, events=None, weights=None):
+        self.catalog = catalog
+        self.vectors = vectors
+        self.events = events
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+
+    def features(self, castle_ids, retrieval, context):
+        """(rows, features [len(FEATURES) x n] float32, distances km)."""
+        catalog = self.catalog
+        rows = catalog.rows(castle_ids)
+        known = rows >= 0
+        safe = np.where(known, rows, 0)
+        n = castle_ids.shape[0]
+        F = np.zeros((len(FEATURES), n), dtype=np.float32)
+        F[0] = _minmax(np.asarray(retrieval, dtype=np.float32))
+
+        if self.vectors is not None and context.profile is not None:
+            vector_rows = np.where(known, catalog.vector_rows(self.vectors)[safe], -1)
+            F[1] = _minmax(self.vectors.dot_rows(vector_rows, context.profile))
+
+        if context.interests and catalog.tag_text:
+            hits = np.zeros(n, dtype=np.float32)
+            for term in context.interests:
+                hits += catalog.term_mask(term)[safe]
+            F[2] = hits / len(context.interests)
+
+        F[3] = catalog.popularity[safe]
+
+        distances = np.full(n, np.nan)
+        if context.lat is not None and context.lon is not None:
+            distances = haversine_km(context.lat, context.lon, catalog.lat[safe], catalog.lon[safe])
+            F[4] = np.nan_to_num(np.exp(-distances / DISTANCE_SCALE_KM), nan=0.0)
+
+        era_codes, type_codes = catalog.era_codes[safe], catalog.type_codes[safe]
+        if context.era_preference is not None:
+            F[5] += 0.5 * np.where(era_codes >= 0, context.era_preference[np.maximum(era_codes, 0)], 0.0)
+        if context.type_preference is not None:
+            F[5] += 0.5 * np.where(type_codes >= 0, context.type_preference[np.maximum(type_codes, 0)], 0.0)
+
+        if self.events is not None:
+            upcoming = self.events.active_counts(
+                castle_ids, context.now, context.now + datetime.timedelta(days=event_index.EVENT_BOOST_DAYS))
+            F[6] = upcoming > 0
+
+        F[:, ~known] = 0.0
+        return rows, F, distances
+
+    def rank(self, candidates, context, k=10, diversity=None, weights=None, explain=True):
+        """Re-rank [(castle_id, retrieval score), ...].
+
+        Returns [(castle_id, score, {feature: contribution}, [reason, ...]), ...].
+        """
+        weights = dict(self.weights, **(weights or {}))
+        candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 2)
+        if candidates.shape[0] == 0:
+            return []
+        castle_ids, first = np.unique(candidates[:, 0].astype(np.int64), return_index=True)
+        retrieval = candidates[first, 1]
+        if context.seen.size:
+            keep = ~np.isin(castle_ids, context.seen)
+            castle_ids, retrieval = castle_ids[keep], retrieval[keep]
+        if castle_ids.size == 0:
+            return []
+
+        rows, F, distances = self.features(castle_ids, retrieval, context)
+        W = np.array([weights.get(name, 0.0) for name in FEATURES], dtype=np.float32)
+        scores = W @ F
+
+        pool_size = min(castle_ids.shape[0], k * MMR_POOL)
+        pool = np.argpartition(-scores, pool_size - 1)[:pool_size]
+        pool = pool[np.argsort(-scores[pool], kind="stable")]
+        lam = MMR_LAMBDA if diversity is None else 1.0 - diversity
+        chosen = self._mmr(pool, scores, rows, castle_ids, min(k, pool_size), lam)
+        if not explain:
+            return [(int(castle_ids[i]), float(scores[i]), {}, []) for i in chosen]
+        return [
+            (int(castle_ids[i]), float(scores[i]), *self._explain(i, W, F, rows, distances, context))
+            for i in chosen
+        ]
+
+    def _mmr(self, pool, scores, rows, castle_ids, k, lam):
+        if lam >= 1.0 or pool.shape[0] <= 1:
+            return pool[:k].tolist()
+        relevance = _minmax(scores[pool])
+        era = self.catalog.era_codes[np.maximum(rows[pool], 0)]
+        # vector เต็มเฉพาะ pool (k x MMR_POOL แถว) ไม่ใช่ candidate ทั้งหมด
+        vectors = self.vectors.get_many(castle_ids[pool])[0] if self.vectors is not None else None
+        max_similarity = np.zeros(pool.shape[0], dtype=np.float32)
+        available = np.ones(pool.shape[0], dtype=bool)
+        chosen = []
+        for _ in range(k):
+            value = lam * relevance - (1.0 - lam) * max_similarity
+            value[~available] = -np.inf
+            best = int(np.argmax(value))
+            chosen.append(int(pool[best]))
+            available[best] = False
+            similarity = ERA_SIMILARITY * ((era == era[best]) & (era >= 0))
+            if vectors is not None:
+                similarity = similarity + (1.0 - ERA_SIMILARITY) * np.clip(vectors @ vectors[best], 0.0, 1.0)
+            np.maximum(max_similarity, similarity, out=max_similarity)
+        return chosen
+
+    def _explain(self, i, W, F, rows, distances, context):
+        contributions = {name: round(float(W[f] * F[f, i]), 4) for f, name in enumerate(FEATURES)}
+        contributions = {name: value for name, value in contributions.items() if value > 0}
+        total = sum(contributions.values()) or 1.0
+        row = rows[i]
+        reasons = []
+        for name, value in sorted(contributions.items(), key=lambda item: -item[1]):
+            if value / total < REASON_MIN_SHARE:
+                continue
+            if name == "retrieval":
+                reasons.append("liked by visitors with similar history")
+            elif name == "content":
+                reasons.append("similar to castles you visited")
+            elif name == "interest":
+                matched = [t for t in context.interests if t in self.catalog.tag_text[row]]
+                reasons.append("matches your interests: " + ", ".join(matched))
+            elif name == "popularity":
+                reasons.append("popular with visitors")
+            elif name == "distance":
+                reasons.append(f"{distances[i]:.0f} km away")
+            elif name == "type_era":
+                era_code, type_code = self.catalog.era_codes[row], self.catalog.type_codes[row]
+                parts = [self.catalog.eras[era_code] if era_code >= 0 else None,
+                         self.catalog.types[type_code] if type_code >= 0 else None]
+                reasons.append("era/type you like: " + " / ".join(p for p in parts if p))
+            elif name == "event":
+                reasons.append("event coming up")
+        return contributions, reasons
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+_catalog_version = CatalogVersion()
+
+
+def get_catalog(db):
+    global _catalog
+    if _catalog is None:
+        with building(_catalog_lock, "rerank"):
+            if _catalog is None:
+                _catalog_version.mark()
+                with startup.timed("rerank"):
+                    _catalog = CastleCatalog().load(db)
+    elif ((time.monotonic() - _catalog.loaded_at > CATALOG_REFRESH_SECONDS or _catalog_version.changed())
+          and _catalog_lock.acquire(blocking=False)):
+        # มีคนโหลดใหม่อยู่แล้ว -> ใช้ catalog เดิมไปก่อน (bulk import จาก process อื่น -> โหลดใหม่ทันที)
+        try:
+            if (time.monotonic() - _catalog.loaded_at > CATALOG_REFRESH_SECONDS
+                    or _catalog_version.seen != _catalog_version.current()):
+                _catalog_version.mark()
+                with startup.timed("rerank"):
+                    _catalog = CastleCatalog().load(db)
+        finally:
+            _catalog_lock.release()
+    return _catalog
+
+
+def rerank_for_user(db, user_id, candidates, k=10, lat=None, lon=None, diversity=None, weights=None):
+    """Build the user's context and re-rank ``candidates``; adds castles near (lat, lon) as extra candidates."""
+    catalog = get_catalog(db)
+    vectors = recommend.get_castle_index(db)
+    events = event_index.get_event_index(db)
+    context = UserContext.for_user(db, catalog, vectors, user_id, lat, lon)
+    if lat is not None and lon is not None:
+        nearby = geo_index.get_castle_geo_index(db).nearest(lat, lon, k=CANDIDATES // 5)
+        floor = min((s for _, s in candidates), default=0.0)
+        candidates = list(candidates) + [(castle_id, floor) for castle_id, _ in nearby]
+    return Reranker(catalog, vectors, events, weights).rank(candidates, context, k=k, diversity=diversity)
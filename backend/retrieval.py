@@ -0,0 +1,295 @@
+import os
+import re
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+import embedding
+import model
+from startup import building, startup
+from vector_index import VectorIndex
+
+
+### Hybrid retrieval บน places_rag: BM25 (keyword inverted index) + vector similarity -> RRF
+
+LOAD_BATCH_SIZE = 5000
+RRF_K = 60
+# job ที่เขียน places_rag ด้วย Core (ingest.py) แตะไฟล์นี้ -> ทุก process สร้าง index ใหม่ภายใน PLACES_VERSION_CHECK วินาที
+PLACES_VERSION_PATH = os.getenv("PLACES_VERSION_PATH", "indexes/places.version")
+PLACES_VERSION_CHECK_SECONDS = float(os.getenv("PLACES_VERSION_CHECK", "5"))
+_THAI_RUN_RE = re.compile("[\u0e00-\u0e7f]+")
+_TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+class KeywordIndex:
+    """Inverted index keyword_id -> sorted int32 array of place_ids, scored with BM25.
+
+    A place/keyword link is binary (tf = 1), so document length is the number
+    of keywords attached to the place. New links are buffered and merged into
+    the postings on the next query.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.n_docs = 0
+        self.total_len = 0
+        self.vocab = {}
+        self.max_term_len = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add_keywords(self, pairs):
+        """Register (keyword_id, keyword text) pairs for query parsing."""
+        with self._lock:
+            for keyword_id, text in pairs:
+                text = text.strip().lower()
+                if text:
+                    self.vocab[text] = keyword_id
+                    self.max_term_len = max(self.max_term_len, len(text))
+
+    def add(self, pairs):
+        """Queue (place_id, keyword_id) links; merged lazily."""
+        with self._lock:
+            self._pending.extend(pairs)
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        pairs = np.asarray(self._pending, dtype=np.int64).reshape(-1, 2)
+        self._pending = []
+        # key = keyword_id << 32 | place_id -> unique แล้วได้ลำดับ (keyword, place) ในครั้งเดียว
+        keys = np.unique((pairs[:, 1] << 32) | pairs[:, 0])
+        keyword_col = keys >> 32
+        place_col = (keys & 0xFFFFFFFF).astype(np.int32)
+        max_place = int(place_col.max())
+        if max_place >= self.doc_len.shape[0]:
+            grown = np.zeros(max(max_place + 1, self.doc_len.shape[0] * 2), dtype=np.int32)
+            grown[:self.doc_len.shape[0]] = self.doc_len
+            self.doc_len = grown
+        keyword_ids, starts = np.unique(keyword_col, return_index=True)
+        added = []
+        for keyword_id, place_ids in zip(keyword_ids.tolist(), np.split(place_col, starts[1:])):
+            old = self.postings.get(keyword_id)
+            if old is None:
+                self.postings[keyword_id] = place_ids
+                added.append(place_ids)
+                continue
+            new_places = np.setdiff1d(place_ids, old, assume_unique=True)
+            if new_places.size:
+                self.postings[keyword_id] = np.union1d(old, new_places)
+                added.append(new_places)
+        if added:
+            added = np.concatenate(added)
+            self.doc_len += np.bincount(added, minlength=self.doc_len.shape[0]).astype(np.int32)
+            self.total_len += int(added.size)
+            self.n_docs = int(np.count_nonzero(self.doc_len))
+
+    def parse(self, text):
+        """Map free text to keyword ids.
+
+        Thai has no spaces, so Thai runs are segmented by longest match against
+        the keyword vocabulary; other scripts are split on word characters.
+        """
+        text = text.lower()
+        found = []
+        if text.strip() in self.vocab:
+            found.append(self.vocab[text.strip()])
+        for token in _TOKEN_RE.findall(_THAI_RUN_RE.sub(" ", text)):
+            if token in self.vocab:
+                found.append(self.vocab[token])
+        for run in _THAI_RUN_RE.findall(text):
+            i = 0
+            while i < len(run):
+                for length in range(min(self.max_term_len, len(run) - i), 0, -1):
+                    keyword_id = self.vocab.get(run[i:i + length])
+                    if keyword_id is not None:
+                        found.append(keyword_id)
+                        i += length
+                        break
+                else:
+                    i += 1
+        return list(dict.fromkeys(found))
+
+    def search(self, keyword_ids, k=100):
+        """Return (place_ids, bm25 scores) for the top ``k`` places, best first."""
+        with self._lock:
+            self._merge_pending()
+            lists = [self.postings[kw] for kw in keyword_ids if kw in self.postings]
+            if not lists or self.n_docs == 0:
+                return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+            avg_len = self.total_len / self.n_docs
+            place_ids = np.concatenate(lists)
+            idf = np.concatenate([
+                np.full(p.size, np.log(1.0 + (self.n_docs - p.size + 0.5) / (p.size + 0.5)), dtype=np.float32)
+                for p in lists
+            ])
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[place_ids] / avg_len)
+            term_scores = idf * (self.k1 + 1.0) / (1.0 + norm)
+        unique_ids, inverse = np.unique(place_ids, return_inverse=True)
+        scores = np.bincount(inverse, weights=term_scores).astype(np.float32)
+        if k < scores.shape[0]:
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(scores.shape[0])
+        best = best[np.argsort(-scores[best])]
+        return unique_ids[best], scores[best]
+
+
+class HybridSearcher:
+    def __init__(self, encoder=None):
+        self.keywords = KeywordIndex()
+        self.vectors = VectorIndex(model.DOCUMENT_VECTOR_DIM)
+        self.encoder = encoder or embedding.get_encoder(embedding.EMBEDDING_ENCODER, model.DOCUMENT_VECTOR_DIM)
+
+    def load(self, db):
+        rows = db.query(model.Keyword.keyword_id, model.Keyword.keyword).yield_per(LOAD_BATCH_SIZE)
+        self.keywords.add_keywords((keyword_id, text) for keyword_id, text in rows if text)
+        rows = db.query(model.PlaceKeyword.place_id, model.PlaceKeyword.keyword_id).yield_per(LOAD_BATCH_SIZE)
+        self.keywords.add([tuple(row) for row in rows])
+        rows = (
+            db.query(model.Place.place_id, model.Place.document_vector)
+            .filter(model.Place.document_vector.isnot(None))
+            .yield_per(LOAD_BATCH_SIZE)
+        )
+        ids, vectors = [], []
+        for place_id, vector in rows:
+            ids.append(place_id)
+            vectors.append(vector)
+            if len(ids) == LOAD_BATCH_SIZE:
+                self.vectors.add(ids, np.asarray(vectors, dtype=np.float32))
+                ids, vectors = [], []
+        if ids:
+            self.vectors.add(ids, np.asarray(vectors, dtype=np.float32))
+        return self
+
+    def search(self, text, k=10, candidates=100, query_vector=None):
+        """Reciprocal-rank fusion of BM25 and cosine rankings.
+
+        Returns dicts with the fused score and each component score (None when
+        the place was not retrieved by that ranker).
+        """
+        keyword_ids = self.keywords.parse(text)
+        bm25_ids, bm25_scores = self.keywords.search(keyword_ids, k=candidates)
+        if query_vector is None:
+            query_vector = self.encoder.encode([text])[0]
+        vector_hits = self.vectors.search(query_vector, k=candidates)
+
+        fused = {}
+        for rank, (place_id, score) in enumerate(zip(bm25_ids.tolist(), bm25_scores.tolist())):
+            hit = fused.setdefault(place_id, {"place_id": place_id, "score": 0.0, "keyword_score": None, "vector_score": None})
+            hit["score"] += 1.0 / (RRF_K + rank + 1)
+            hit["keyword_score"] = score
+        for rank, (place_id, score) in enumerate(vector_hits):
+            hit = fused.setdefault(place_id, {"place_id": place_id, "score": 0.0, "keyword_score": None, "vector_score": None})
+            hit["score"] += 1.0 / (RRF_K + rank + 1)
+            hit["vector_score"] = score
+        return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)[:k]
+
+
+##### Singleton + incremental refresh จาก ORM session
+
+_searcher = None
+_searcher_lock = threading.Lock()
+_searcher_version = None
+_version_checked_at = 0.0
+
+
+def places_version():
+    try:
+        return os.stat(PLACES_VERSION_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def publish_places_version():
+    """Tell every process that places_rag changed outside the ORM (atomic write of the marker file)."""
+    folder = os.path.dirname(PLACES_VERSION_PATH)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{PLACES_VERSION_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, PLACES_VERSION_PATH)
+
+
+def get_place_searcher(db):
+    global _searcher, _searcher_version, _version_checked_at
+    if (_searcher is not None and time.monotonic() - _version_checked_at > PLACES_VERSION_CHECK_SECONDS
+            and _searcher_lock.acquire(blocking=False)):
+        # มีคนสร้างใหม่อยู่แล้ว -> request นี้ใช้ตัวเดิมไปก่อน ไม่ต้องรอ
+        try:
+            _version_checked_at = time.monotonic()
+            version = places_version()
+            if version != _searcher_version:
+                # สร้างตัวใหม่ก่อนแล้วค่อยสลับ -> request อื่นยังใช้ตัวเดิมได้ระหว่างโหลด
+                with startup.timed("retrieval"):
+                    fresh = HybridSearcher().load(db)
+                _searcher, _searcher_version = fresh, version
+        finally:
+            _searcher_lock.release()
+    if _searcher is None:
+        with building(_searcher_lock, "retrieval"):
+            if _searcher is None:
+                _version_checked_at = time.monotonic()
+                _searcher_version = places_version()
+                with startup.timed("retrieval"):
+                    _searcher = HybridSearcher().load(db)
+    return _searcher
+
+
+_INDEXED = (model.Keyword, model.PlaceKeyword, model.Place)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_new_rows(session, flush_context):
+    if _searcher is None:
+        return
+    # เก็บเป็นค่าธรรมดา เพราะหลัง commit object จะ expired และ query เพิ่มไม่ได้
+    pending = session.info.setdefault("retrieval_pending", {"keywords": [], "links": [], "vectors": [], "stale": False})
+    for obj in session.new:
+        if isinstance(obj, model.Keyword) and obj.keyword:
+            pending["keywords"].append((obj.keyword_id, obj.keyword))
+        elif isinstance(obj, model.PlaceKeyword):
+            pending["links"].append((obj.place_id, obj.keyword_id))
+        elif isinstance(obj, model.Place) and obj.document_vector is not None:
+            pending["vectors"].append((obj.place_id, obj.document_vector))
+    # แก้ vector = แทนที่ใน index ได้ / ลบหรือแก้อย่างอื่น index ลบออกไม่ได้ -> ให้ทุก worker สร้างใหม่
+    for obj in session.dirty:
+        if not isinstance(obj, _INDEXED) or not session.is_modified(obj):
+            continue
+        if isinstance(obj, model.Place):
+            if not inspect(obj).attrs.document_vector.history.has_changes():
+                continue
+            if obj.document_vector is not None:
+                pending["vectors"].append((obj.place_id, obj.document_vector))
+                continue
+        pending["stale"] = True
+    if any(isinstance(obj, _INDEXED) for obj in session.deleted):
+        pending["stale"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_new_rows(session):
+    global _version_checked_at
+    pending = session.info.pop("retrieval_pending", None)
+    if not pending or _searcher is None:
+        return
+    if pending["stale"]:
+        publish_places_version()
+        _version_checked_at = 0.0
+    _searcher.keywords.add_keywords(pending["keywords"])
+    _searcher.keywords.add(pending["links"])
+    if pending["vectors"]:
+        ids, vectors = zip(*pending["vectors"])
+        _searcher.vectors.add(ids, np.asarray(vectors, dtype=np.float32))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_new_rows(session):
+    session.info.pop("retrieval_pending", None)
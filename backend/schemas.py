@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import Dict, List, Optional, Union
 from datetime import datetime
 
 
@@ -101,6 +101,12 @@ class TripItineraryResponse(TripItineraryBase):
     class Config:
         from_attributes = True
 
+class ItineraryRequest(BaseModel): # castle_ids ว่าง -> ใช้ castle ใน route ของ plan / ตัวแรกคือจุดเริ่มต้น
+    # จำกัดขนาดงานของ solver ต่อ request (itinerary.MAX_STOPS / MAX_TIME_BUDGET_SECONDS)
+    castle_ids: List[int] = Field(default=[], max_length=100)
+    visit_minutes: int = Field(default=90, ge=0, le=24 * 60)
+    time_budget_ms: int = Field(default=500, ge=0, le=5000)
+
 ##### Castle Type 
 class CastleTypeBase(BaseModel):
     type_detail: str
@@ -147,11 +153,11 @@ class CastleBase(BaseModel):
     castle_name: str
     castle_description: Optional[str] = None
     era: Optional[str] = None
-    # Vector รับเป็น List ของ float
-    # text_vector: Optional[List[float]] = None 
 
 class CastleCreate(CastleBase):
     type_id: Optional[int] = None
+    # Vector รับเป็น List ของ float (รับเฉพาะตอนสร้าง ไม่ส่งกลับใน Response เพราะมีขนาดใหญ่)
+    text_vector: Optional[List[float]] = None
 
 class CastleResponse(CastleBase):
     castle_id: int
@@ -160,13 +166,29 @@ class CastleResponse(CastleBase):
     class Config:
         from_attributes = True
 
+class SimilarCastleResponse(BaseModel):
+    castle_id: int
+    score: float
+
+class NearbyCastleResponse(BaseModel):
+    castle_id: int
+    distance_km: float
+
+class RecommendationResponse(BaseModel):
+    castle_id: int
+    score: float
+
+class ExplainedRecommendationResponse(RecommendationResponse):
+    contributions: Dict[str, float] # คะแนนที่แต่ละ feature ให้ (weight x feature)
+    reasons: List[str]
+
 ##### Image 
 class ImageBase(BaseModel):
     img_description: Optional[str] = None
-    # image_vector: Optional[List[float]] = None
 
 class ImageCreate(ImageBase):
     castle_id: int
+    image_vector: Optional[List[float]] = None
 
 class ImageResponse(ImageBase):
     img_id: int
@@ -191,6 +213,15 @@ class EventResponse(EventBase):
     class Config:
         from_attributes = True
 
+class EventWindowResponse(BaseModel):
+    event_id: int
+    castle_id: Optional[int] = None
+    event_start: datetime
+    event_end: datetime # event ที่ไม่มี event_end -> ถือว่าจบสิ้นวันที่เริ่ม
+
+class NearbyEventResponse(EventWindowResponse):
+    distance_km: float
+
 ##### Nearby Place 
 class NearbyPlaceBase(BaseModel):
     place_name: str
@@ -222,7 +253,7 @@ class RouteResponse(RouteBase):
 class RouteCastleBase(BaseModel):
     route_id: int
     castle_id: int
-    # sequence_order: Optional[int] = None
+    sequence_order: Optional[int] = None
 
 class RouteCastleCreate(RouteCastleBase):
     pass
@@ -231,6 +262,12 @@ class RouteCastleResponse(RouteCastleBase):
     class Config:
         from_attributes = True
 
+class RouteSuggestionResponse(BaseModel):
+    # castle เรียงตามลำดับเที่ยว (เริ่มจาก seed_castle_id)
+    castle_ids: List[int]
+    score: float
+    seed_castle_id: int
+
 ##### Document 
 class DocumentBase(BaseModel):
     document_name: str
@@ -241,23 +278,26 @@ class DocumentCreate(DocumentBase):
 class DocumentResponse(DocumentBase):
     document_id: int
     castle_id: int
+    source_path: Optional[str] = None
     class Config:
         from_attributes = True
 
 ##### Place 
 
 class PlaceBase(BaseModel):
-    # document_vector: Optional[List[float]] = None
     pass
 
 class PlaceCreate(PlaceBase):
     document_id: int
     castle_id: Optional[int] = None
+    document_vector: Optional[List[float]] = None
 
 class PlaceResponse(PlaceBase):
     place_id: int
     document_id: int
     castle_id: Optional[int] = None
+    passage_index: Optional[int] = None
+    content: Optional[str] = None
     class Config:
         from_attributes = True
 
@@ -271,4 +311,49 @@ class KeywordCreate(KeywordBase):
 class KeywordResponse(KeywordBase):
     keyword_id: int
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class PlaceSearchResponse(BaseModel):
+    place_id: int
+    score: float
+    keyword_score: Optional[float] = None
+    vector_score: Optional[float] = None
+
+class TrendingQueryResponse(BaseModel):
+    query: str
+    count: int
+
+class AutocompleteResponse(BaseModel):
+    text: str
+    kind: str # castle / keyword / province
+    ref_id: Union[int, str] # castle_id / keyword_id / ชื่อจังหวัด
+
+class ImageCastleMatchResponse(BaseModel):
+    castle_id: int
+    score: float # similarity สูงสุดของรูปใน castle นี้
+    img_ids: List[int] # รูปที่ match เรียงจากเหมือนมากสุด
+
+##### Paginated lists (keyset: ส่ง next_cursor กลับมาเป็น ?after= ของหน้าถัดไป)
+class CastlePage(BaseModel):
+    items: List[CastleResponse]
+    next_cursor: Optional[int] = None
+
+class EventPage(BaseModel):
+    items: List[EventResponse]
+    next_cursor: Optional[int] = None
+
+class ImagePage(BaseModel):
+    items: List[ImageResponse]
+    next_cursor: Optional[int] = None
+
+class NearbyPlacePage(BaseModel):
+    items: List[NearbyPlaceResponse]
+    next_cursor: Optional[int] = None
+
+##### Castle Detail (nested) -> ต้องประกาศหลัง Image/Event/NearbyPlace
+class CastleDetailResponse(CastleResponse):
+    castle_type: Optional[CastleTypeResponse] = None
+    architectures: List[ArchitectureResponse] = []
+    images: List[ImageResponse] = []
+    events: List[EventResponse] = []
+    nearby_places: List[NearbyPlaceResponse] = []
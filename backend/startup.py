@@ -0,0 +1,276 @@
+import importlib
+import os
+import threading
+import time
+import types
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+### Startup: ของหนัก (engine, mappers, index, encoder, scipy) ไม่โหลดตอน import main
+# - module หนักใน main ใช้ lazy_import -> import จริงตอนใช้ครั้งแรก
+# - get_xxx() ของแต่ละ index จับเวลา init ผ่าน startup.timed(...) ไม่ว่าจะโหลดจาก request หรือ warm-up
+# - lifespan เริ่ม warm-up thread (ไม่ block) -> uvicorn เปิด port ได้ทันที, /health/ready = 503 จนกว่าจะ warm เสร็จ
+# module นี้ใช้แค่ stdlib เพื่อให้ import ได้เร็วจากทุกที่
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# comma separated ชื่อ component ที่จะ warm (ว่าง = ทุกตัวที่ register) ที่เหลือโหลดตอนใช้ครั้งแรก
+WARMUP_COMPONENTS = [name.strip() for name in os.getenv("WARMUP_COMPONENTS", "").split(",") if name.strip()]
+# รอก่อนเริ่ม warm (วินาที) ให้ server รับ request แรกๆ ได้ก่อน
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "0"))
+
+# state ของ component
+LAZY = "lazy"          # ยังไม่โหลด และไม่อยู่ใน warm-up -> โหลดตอนใช้ครั้งแรก
+PENDING = "pending"    # รอ warm-up
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class Startup:
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._components = OrderedDict()
+        self._warmers = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.warmup_started = None
+        self.warmup_seconds = None
+
+    def _component(self, name):
+        # เรียกภายใต้ _lock
+        if name not in self._components:
+            self._components[name] = {"state": LAZY, "import_ms": None, "init_ms": None, "loads": 0, "error": None}
+        return self._components[name]
+
+    def record(self, name, phase, seconds, state=None):
+        with self._lock:
+            component = self._component(name)
+            component[f"{phase}_ms"] = round(seconds * 1000, 3)
+            if state is not None:
+                component["state"] = state
+
+    def _set_state(self, name, state, error=None):
+        with self._lock:
+            component = self._component(name)
+            component["state"] = state
+            component["error"] = error
+
+    @contextmanager
+    def timed(self, name, phase="init"):
+        """Time an import / init block; ``init`` blocks also move the component to ready or failed."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as exc:
+            if phase == "init":
+                self._set_state(name, FAILED, f"{type(exc).__name__}: {exc}")
+            raise
+        self.record(name, phase, time.perf_counter() - started)
+        if phase == "init":
+            with self._lock:
+                component = self._component(name)
+                component["state"] = READY
+                component["error"] = None
+                component["loads"] += 1
+
+    def register(self, name, warm):
+        """``warm(db)`` loads the component (normally by calling its ``get_xxx``)."""
+        with self._lock:
+            self._warmers[name] = warm
+            self._component(name)
+
+    ##### Warm-up
+
+    def _selected(self):
+        if not WARMUP_ENABLED:
+            return []
+        names = WARMUP_COMPONENTS or list(self._warmers)
+        return [name for name in names if name in self._warmers]
+
+    def warm(self, session_factory, names=None):
+        """Load components in order on the calling thread; one failure does not stop the rest."""
+        names = self._selected() if names is None else names
+        self.warmup_started = time.perf_counter()
+        for name in names:
+            if self._stop.is_set():
+                break
+            with self._lock:
+                component = self._component(name)
+                if component["state"] == READY:
+                    continue
+                component["state"] = WARMING
+            started = time.perf_counter()
+            try:
+                with session_factory() as db:
+                    self._warmers[name](db)
+            except Exception as exc:
+                self._set_state(name, FAILED, f"{type(exc).__name__}: {exc}")
+                continue
+            with self._lock:
+                component = self._component(name)
+                if component["state"] == WARMING:
+                    # warmer ที่ไม่ได้ผ่าน timed(...) เอง -> ใช้เวลาทั้งก้อนแทน
+                    component["state"] = READY
+                    component["init_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                    component["loads"] += 1
+        self.warmup_seconds = time.perf_counter() - self.warmup_started
+
+    def start_warmup(self, session_factory):
+        """Warm in a daemon thread so the server starts accepting connections right away."""
+        names = self._selected()
+        with self._lock:
+            for name in names:
+                if self._component(name)["state"] == LAZY:
+                    self._component(name)["state"] = PENDING
+        self._stop.clear()
+
+        def run():
+            if WARMUP_DELAY_SECONDS and self._stop.wait(WARMUP_DELAY_SECONDS):
+                return
+            self.warm(session_factory, names)
+
+        self._thread = threading.Thread(target=run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # shutdown: ไม่รอ component ที่กำลังโหลด แค่ไม่เริ่มตัวถัดไป
+        self._stop.set()
+
+    ##### Readiness
+
+    def snapshot(self):
+        with self._lock:
+            components = {name: dict(c) for name, c in self._components.items()}
+        busy = any(c["state"] in (PENDING, WARMING) for c in components.values())
+        failed = [name for name, c in components.items() if c["state"] == FAILED]
+        return {
+            "ready": not busy,
+            "status": "warming" if busy else ("degraded" if failed else "ready"),
+            "uptime_seconds": round(time.perf_counter() - self._started, 3),
+            "warmup_seconds": None if self.warmup_seconds is None else round(self.warmup_seconds, 3),
+            "components": components,
+        }
+
+
+startup = Startup()
+
+
+##### Build lock ของ singleton: warm-up / CLI รอได้ แต่ request ไม่ควรรอ index ที่ thread อื่นกำลังสร้าง
+
+class Warming(RuntimeError):
+    """A request needs a component that another thread is still building."""
+
+    def __init__(self, name):
+        super().__init__(f"{name} is still warming up")
+        self.name = name
+
+
+_request = threading.local()
+
+
+@contextmanager
+def request_path():
+    """Mark the current thread as serving a request (see ``building``)."""
+    previous = getattr(_request, "active", False)
+    _request.active = True
+    try:
+        yield
+    finally:
+        _request.active = previous
+
+
+@contextmanager
+def building(lock, name):
+    """Hold a singleton's build lock.
+
+    Off the request path this waits for the lock. On it, a build already
+    running in another thread raises ``Warming`` so the caller can answer 503
+    instead of stalling.
+    """
+    if not lock.acquire(blocking=not getattr(_request, "active", False)):
+        raise Warming(name)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+##### Version marker: job ที่เขียนด้วย Core (bulk_import.py) ไม่ผ่าน ORM event -> แตะไฟล์นี้แทน
+# index ในหน่วยความจำของทุก process เช็ค mtime (ไม่เกินทุก CATALOG_VERSION_CHECK วินาที) แล้วโหลดใหม่
+
+CATALOG_VERSION_PATH = os.getenv("CATALOG_VERSION_PATH", "indexes/catalog.version")
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK", "5"))
+
+
+def publish_catalog_version():
+    """Tell every process that catalog tables changed outside the ORM (atomic write of the marker file)."""
+    folder = os.path.dirname(CATALOG_VERSION_PATH)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{CATALOG_VERSION_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(time.time_ns()))
+    os.replace(tmp_path, CATALOG_VERSION_PATH)
+
+
+class CatalogVersion:
+    """Catalog version one index was loaded from; ``changed()`` stats the marker at most every few seconds."""
+
+    def __init__(self):
+        self.seen = None
+        self.checked_at = 0.0
+
+    @staticmethod
+    def current():
+        try:
+            return os.stat(CATALOG_VERSION_PATH).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def mark(self):
+        # เรียกก่อนโหลด -> import ที่จบระหว่างโหลดยังทำให้โหลดใหม่อีกรอบ
+        self.seen = self.current()
+        self.checked_at = time.monotonic()
+
+    def changed(self):
+        if time.monotonic() - self.checked_at <= CATALOG_VERSION_CHECK_SECONDS:
+            return False
+        self.checked_at = time.monotonic()
+        return self.current() != self.seen
+
+
+##### Lazy module: import จริงตอนเข้าถึง attribute ครั้งแรก (และจับเวลา import)
+
+class LazyModule(types.ModuleType):
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+        self.__dict__["_lazy_lock"] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            with self.__dict__["_lazy_lock"]:
+                module = self.__dict__["_lazy_module"]
+                if module is None:
+                    with startup.timed(self.__name__, "import"):
+                        module = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_module"] = module
+        return module
+
+    @property
+    def loaded(self):
+        return self.__dict__["_lazy_module"] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """Module proxy that imports ``name`` on first attribute access."""
+    return LazyModule(name)
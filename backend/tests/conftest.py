@@ -0,0 +1,59 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND not in sys.path:
+    sys.path.insert(0, BACKEND)
+
+from benchmarks.run import isolated_environment
+
+
+### ทุก test ใช้ SQLite (aiosqlite สำหรับ async engine) + index บน disk ใน temp dir
+# ต้องตั้ง env ก่อน import db / main
+
+WORKDIR = tempfile.mkdtemp(prefix="castles-tests-")
+isolated_environment(WORKDIR)
+os.environ["EMBEDDING_ENCODER"] = "hashing"
+
+CASTLES = 60
+USERS = 20
+
+
+@pytest.fixture(scope="session")
+def engine():
+    import db
+    from benchmarks.catalog import seed_catalog
+
+    seed_catalog(db.engine, "small", castles=CASTLES, users=USERS, visits=3, interests=1)
+    return db.engine
+
+
+@pytest.fixture
+def session(engine):
+    import db
+
+    session = db.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture(scope="session")
+def client(engine):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        # warm-up อยู่ใน thread แยก -> รอให้ทุก component พร้อมก่อน
+        deadline = time.monotonic() + 60
+        while client.get("/health/ready").status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError("app did not become ready")
+            time.sleep(0.05)
+        yield client
@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, event, exc, func, select
+from sqlalchemy.orm import sessionmaker
+
+import model
+from activity_log import WindowedTopQueries, WriteBehindLog
+
+
+@pytest.fixture
+def factory(tmp_path):
+    """Own database with foreign keys enforced (sqlite leaves them off by default)."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'activity.db'}")
+    event.listen(engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    model.Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    with factory() as db:
+        db.add(model.User(user_id=1, username="u", password="x", email="u@example.com"))
+        db.add_all([model.Castle(castle_id=i, castle_name=f"castle {i}") for i in range(1, 4)])
+        db.commit()
+    yield factory
+    engine.dispose()
+
+
+def _visits(factory):
+    with factory() as db:
+        return db.scalar(select(func.count(model.VisitHistory.visit_id)))
+
+
+def test_bad_rows_are_quarantined(factory):
+    log = WriteBehindLog(factory, batch_size=100)
+    for castle_id in [1, 2, 3, 999, 1, 2, 3, 1]:
+        log.log_visit(1, castle_id)
+    assert log.flush() == 7
+    assert _visits(factory) == 7
+    assert len(log.quarantine) == 1
+    table, row, error = log.quarantine[0]
+    assert (table, row["castle_id"]) == ("visit_histories", 999) and "IntegrityError" in error
+    assert log.snapshot()["quarantined"] == 1 and log.snapshot()["pending"] == 0
+
+
+def test_batch_is_retried_after_db_outage(factory):
+    def down():
+        raise exc.OperationalError("connect", {}, Exception("database is down"))
+
+    log = WriteBehindLog(down, batch_size=100)
+    for castle_id in (1, 2, 3):
+        log.log_visit(1, castle_id)
+    log.log_search("Phimai", user_id=1)
+    with pytest.raises(exc.OperationalError):
+        log.flush()
+    assert log.snapshot()["pending"] == 4
+
+    log.session_factory = factory
+    assert log.flush() == 4
+    assert _visits(factory) == 3
+    assert log.snapshot()["pending"] == 0
+
+
+def test_stop_flushes_pending_rows(factory):
+    log = WriteBehindLog(factory, batch_size=1000, flush_interval=60)
+    log.start()
+    for castle_id in (1, 2):
+        log.log_visit(1, castle_id, visit_date=datetime.datetime(2025, 1, 1))
+    log.stop()
+    assert _visits(factory) == 2
+    assert log.visit_counts == {1: 1, 2: 1}
+
+
+def test_trending_queries_by_window():
+    top = WindowedTopQueries(window_seconds=60, windows=10)
+    for text, at in [("Phimai", 0), ("phimai ", 30), ("Phanom Rung", 30), ("phimai", 70)]:
+        top.add(text, timestamp=at)
+    assert top.top(k=2, seconds=120, now=70) == [("phimai", 3), ("phanom rung", 1)]
+    assert top.estimate("Phimai", seconds=60, now=70) == 1
+    # เกิน windows ช่อง -> bucket เก่าถูกทิ้ง
+    top.add("sukhothai", timestamp=700)
+    assert top.top(k=5, seconds=3600, now=700) == [("sukhothai", 1)]
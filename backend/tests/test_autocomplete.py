@@ -0,0 +1,65 @@
+import autocomplete
+import model
+from autocomplete import AutocompleteIndex
+
+
+def _index(rows, popularity=None, vocabulary=()):
+    index = AutocompleteIndex(min_rebuild=1000)
+    index.set_vocabulary(vocabulary)
+    index.set_popularity(popularity or {})
+    return index.bulk_load(rows)
+
+
+def _texts(results):
+    return [text for text, _, _ in results]
+
+
+def test_prefix_ranked_by_popularity():
+    index = _index([("castle", 1, "Phimai Historical Park"), ("castle", 2, "Phanom Rung"),
+                    ("castle", 3, "Prasat Phimai Museum"), ("province", "Buriram", "Buriram")],
+                   popularity={("castle", 3): 50, ("castle", 1): 5})
+    assert _texts(index.suggest("phi", k=2)) == ["Prasat Phimai Museum", "Phimai Historical Park"]
+    # ที่เหลือเติมด้วย fuzzy หลัง prefix ทั้งหมด
+    assert _texts(index.suggest("phi", k=5))[2:] == ["Phanom Rung"]
+    assert _texts(index.suggest("ph", k=5, kinds={"castle"}))[:2] == ["Prasat Phimai Museum", "Phimai Historical Park"]
+    assert index.suggest("bur", kinds={"castle"}) == []
+
+
+def test_thai_tone_marks_and_word_starts():
+    index = _index([("castle", 1, "ปราสาทหินพิมาย"), ("castle", 2, "ปราสาทเมืองต่ำ")], vocabulary=["พิมาย", "เมือง"])
+    # คำกลางข้อความภาษาไทย (ไม่มีเว้นวรรค) จาก vocabulary
+    assert _texts(index.suggest("พิมา")) == ["ปราสาทหินพิมาย"]
+    # พิมพ์ไม่ใส่วรรณยุกต์
+    assert _texts(index.suggest("เมืองตา")) == ["ปราสาทเมืองต่ำ"]
+
+
+def test_delta_updates_before_rebuild():
+    index = _index([("castle", 1, "Phimai"), ("castle", 2, "Phanom Rung")])
+    index.upsert("castle", 1, "Muang Tam")
+    index.upsert("keyword", 7, "Phnom")
+    index.remove("castle", 2)
+    assert index._delta
+    assert _texts(index.suggest("ph", k=5)) == ["Phnom"]
+    assert _texts(index.suggest("muang")) == ["Muang Tam"]
+    index.rebuild()
+    assert _texts(index.suggest("ph", k=5)) == ["Phnom"] and len(index) == 2
+
+
+def test_fuzzy_fills_up_after_prefix():
+    index = _index([("castle", 1, "Sukhothai"), ("castle", 2, "Si Satchanalai")])
+    assert _texts(index.suggest("sukhotai")) == ["Sukhothai"]
+
+
+def test_orm_rename_reaches_warm_index(client, session):
+    client.get("/search/autocomplete", params={"q": "x"})
+    castle = session.get(model.Castle, 17)
+    original = castle.castle_name
+    castle.castle_name = "Zzyzx Fortress"
+    session.commit()
+    try:
+        rows = client.get("/search/autocomplete", params={"q": "zzyzx"}).json()
+        assert [r["text"] for r in rows] == ["Zzyzx Fortress"]
+    finally:
+        castle.castle_name = original
+        session.commit()
+    assert autocomplete.get_autocomplete(session).suggest("zzyzx") == []
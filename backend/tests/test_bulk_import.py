@@ -0,0 +1,96 @@
+import json
+import time
+
+import pytest
+from sqlalchemy import create_engine, func, select
+
+import bulk_import
+import cache
+import geo_index
+import model
+import retrieval
+import startup
+
+
+@pytest.fixture
+def target(tmp_path, monkeypatch):
+    """Empty database for the import + marker files in tmp_path + recorded cache invalidations."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'import.db'}")
+    model.Base.metadata.create_all(engine)
+    monkeypatch.setattr(startup, "CATALOG_VERSION_PATH", str(tmp_path / "catalog.version"))
+    monkeypatch.setattr(retrieval, "PLACES_VERSION_PATH", str(tmp_path / "places.version"))
+    invalidated = []
+    monkeypatch.setattr(cache.response_cache, "invalidate", lambda groups: invalidated.append(set(groups)))
+    engine.invalidated = invalidated
+    yield engine
+    engine.dispose()
+
+
+def _jsonl(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    return str(path)
+
+
+def _castles(tmp_path, ids):
+    return _jsonl(tmp_path / "castles.jsonl", [
+        {"castle_id": i, "castle_name": f"castle {i}", "castle_type": "khmer" if i % 2 else "lanna"} for i in ids])
+
+
+def _count(engine, column):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count(column))).scalar()
+
+
+def test_castles_with_ids_across_chunks(tmp_path, target):
+    written = bulk_import.run_import(target, "castles", _castles(tmp_path, range(1, 8)), chunk_size=3, progress=None)
+    assert written == 7
+    assert _count(target, model.Castle.castle_id) == 7
+    assert _count(target, model.CastleType.type_id) == 2
+    assert target.invalidated == [
+        {f"castle:{i}" for i in range(1, 8)} | {cache.SIMILAR_GROUP, "castle_types"}]
+    assert startup.CatalogVersion.current() is not None
+    assert retrieval.places_version() is None
+
+
+def test_locations_reimport_leaves_no_orphans(tmp_path, target):
+    bulk_import.run_import(target, "castles", _castles(tmp_path, range(1, 5)), progress=None)
+    path = _jsonl(tmp_path / "locations.jsonl", [
+        {"castle_name": f"castle {i}", "latitude": 14.0 + i, "longitude": 100.0, "province": "p"} for i in range(1, 5)])
+    bulk_import.run_import(target, "locations", path, chunk_size=2, progress=None)
+    bulk_import.run_import(target, "locations", path, chunk_size=2, upsert=True, progress=None)
+    assert _count(target, model.Location.location_id) == 4
+    assert _count(target, model.LocationCastle.castle_id) == 4
+    assert target.invalidated[-1] == {f"castle:{i}" for i in range(1, 5)}
+
+
+def test_places_import_publishes_places_version(tmp_path, target):
+    bulk_import.run_import(target, "castles", _castles(tmp_path, [1]), progress=None)
+    bulk_import.run_import(target, "documents", _jsonl(tmp_path / "documents.jsonl", [
+        {"document_id": 1, "castle_id": 1, "document_name": "doc"}]), progress=None)
+    before = retrieval.places_version()
+    time.sleep(0.01)
+    bulk_import.run_import(target, "places", _jsonl(tmp_path / "places.jsonl", [
+        {"document_name": "doc", "castle_id": 1, "keywords": "moat|gate"}]), progress=None)
+    assert retrieval.places_version() not in (None, before)
+    assert _count(target, model.PlaceKeyword.place_id) == 2
+
+
+def test_empty_import_announces_nothing(tmp_path, target):
+    assert bulk_import.run_import(target, "castles", _jsonl(tmp_path / "none.jsonl", []), progress=None) == 0
+    assert target.invalidated == []
+    assert startup.CatalogVersion.current() is None
+
+
+def test_catalog_version_swaps_warm_index(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(startup, "CATALOG_VERSION_PATH", str(tmp_path / "catalog.version"))
+    monkeypatch.setattr(startup, "CATALOG_VERSION_CHECK_SECONDS", 0)
+    stale = geo_index.CastleGeoIndex()
+    monkeypatch.setattr(geo_index, "_castle_index", stale)
+    monkeypatch.setattr(geo_index, "_castle_index_version", startup.CatalogVersion())
+    geo_index._castle_index_version.mark()
+    assert geo_index.get_castle_geo_index(session) is stale
+
+    startup.publish_catalog_version()
+    fresh = geo_index.get_castle_geo_index(session)
+    assert fresh is not stale
+    assert fresh.nearest(15.0, 100.0, k=1)
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import select, update
+
+import cache
+import model
+from cache import SIMILAR_GROUP
+
+
+@pytest.fixture
+def invalidated(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cache.response_cache, "invalidate", lambda groups: calls.append(set(groups)))
+    return calls
+
+
+def test_castle_write_invalidates_own_group_and_similar(session, invalidated):
+    castle = session.get(model.Castle, 3)
+    castle.castle_description = "edited"
+    session.commit()
+    assert invalidated == [{"castle:3", SIMILAR_GROUP}]
+
+
+def test_child_row_invalidates_only_its_castle(session, invalidated):
+    event = session.scalars(select(model.Event).where(model.Event.castle_id == 4)).first()
+    event.event_name = "renamed"
+    session.commit()
+    assert invalidated == [{"castle:4"}]
+
+
+def test_moving_child_row_invalidates_old_and_new_castle(session, invalidated):
+    event = session.scalars(select(model.Event).where(model.Event.castle_id == 12)).first()
+    event.castle_id = 13
+    session.commit()
+    event.castle_id = 12
+    session.commit()
+    assert invalidated == [{"castle:12", "castle:13"}, {"castle:12", "castle:13"}]
+
+
+def test_location_write_invalidates_linked_castle(session, invalidated):
+    link = session.get(model.LocationCastle, 6)
+    session.get(model.Location, link.location_id).province = "edited"
+    session.commit()
+    assert invalidated == [{"castle:6"}]
+
+
+def test_castle_type_write_invalidates_castles_of_that_type(session, invalidated):
+    castle_type = session.get(model.CastleType, 2)
+    castle_type.type_detail = "edited"
+    session.commit()
+    expected = {f"castle:{c}" for c in session.scalars(select(model.Castle.castle_id).where(model.Castle.type_id == 2))}
+    assert invalidated == [expected | {"castle_types"}]
+
+
+def test_bulk_update_resolves_rows(session, invalidated):
+    image = session.scalars(select(model.Image).where(model.Image.castle_id == 7)).first()
+    session.execute(update(model.Image), [{"img_id": image.img_id, "img_description": "bulk"}])
+    session.commit()
+    session.execute(update(model.Event).where(model.Event.castle_id == 8).values(event_name="bulk"))
+    session.commit()
+    assert invalidated == [{"castle:7"}, {"castle:8"}]
+
+
+def test_visit_invalidates_user_group(session, invalidated):
+    # rollback -> group ที่เก็บไว้ตอน flush ต้องถูกทิ้ง
+    visit = session.scalars(select(model.VisitHistory).where(model.VisitHistory.user_id == 2)).first()
+    session.delete(visit)
+    session.flush()
+    session.rollback()
+    assert invalidated == []
+    interest = session.scalars(select(model.Interest).where(model.Interest.user_id == 2)).first()
+    interest.interest_name = "edited"
+    session.commit()
+    assert invalidated == [{"user:2"}]
+
+
+def test_detail_is_refetched_only_for_the_written_castle(client, session):
+    cache.response_cache.local.clear()
+    for castle_id in (10, 11):
+        assert client.get(f"/castles/{castle_id}").headers["X-Cache"] == "MISS"
+    session.get(model.Castle, 10).castle_description = "fresh description"
+    session.commit()
+    response = client.get("/castles/10")
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.json()["castle_description"] == "fresh description"
+    assert client.get("/castles/11").headers["X-Cache"] == "HIT"
+
+
+def test_ttl_cache_groups():
+    local = cache.TTLCache(maxsize=10, ttl=60)
+    local.set("a", 1, ["castle:1"])
+    local.set("b", 2, ["castle:1", SIMILAR_GROUP])
+    local.set("c", 3, ["castle:2"])
+    local.invalidate([SIMILAR_GROUP])
+    assert (local.get("a"), local.get("b"), local.get("c")) == (1, None, 3)
+    local.invalidate(["castle:1"])
+    assert (local.get("a"), local.get("c")) == (None, 3)
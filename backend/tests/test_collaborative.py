@@ -0,0 +1,91 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+
+import collaborative
+import model
+
+
+@pytest.fixture
+def new_rows(session):
+    added = []
+    yield added
+    for obj in reversed(added):
+        session.delete(obj)
+    session.commit()
+
+
+def test_refresh_folds_in_new_interactions(session, new_rows):
+    rec = collaborative.train(session)
+    before = dict(rec.watermarks)
+    user_row = rec._user_pos[1]
+    seen = set(rec.castle_ids[rec.matrix.indices[rec.matrix.indptr[user_row]:rec.matrix.indptr[user_row + 1]]].tolist())
+    castle_id = next(c for c in rec.castle_ids.tolist() if c not in seen)
+
+    user = model.User(user_id=9001, username="refresh-user", password="x", email="refresh@example.com")
+    session.add(user)
+    session.flush()
+    visits = [
+        model.VisitHistory(user_id=1, castle_id=castle_id, visit_date=datetime.datetime(2025, 6, 1)),
+        model.VisitHistory(user_id=9001, castle_id=castle_id, visit_date=datetime.datetime(2025, 6, 1)),
+    ]
+    session.add_all(visits)
+    session.commit()
+    new_rows.extend([user, *visits])
+
+    n_users = rec.user_ids.shape[0]
+    old_factors = rec.castle_factors.copy()
+    old_matrix = rec.matrix.copy()
+    fresh = collaborative.refresh(session, rec)
+
+    # ตัวเดิมไม่เปลี่ยน (request อื่นอาจอ่านอยู่)
+    assert fresh is not rec
+    assert rec.watermarks == before and 9001 not in rec._user_pos
+    assert rec.matrix.shape == old_matrix.shape and (rec.matrix != old_matrix).nnz == 0
+    np.testing.assert_array_equal(rec.castle_factors, old_factors)
+
+    assert fresh.watermarks["visit_id"] == max(v.visit_id for v in visits) > before["visit_id"]
+    assert fresh.watermarks["interest_id"] == before["interest_id"]
+    assert fresh.user_ids.shape[0] == n_users + 1 and 9001 in fresh._user_pos
+    assert fresh.matrix[fresh._user_pos[1], fresh._castle_pos[castle_id]] >= collaborative.VISIT_WEIGHT
+    assert fresh.castle_factors.shape == old_factors.shape
+    # เห็นแล้วไม่แนะนำซ้ำ
+    assert castle_id not in [c for c, _ in fresh.recommend(1, k=20)]
+    assert castle_id not in [c for c, _ in fresh.recommend(9001, k=20)]
+
+    # refresh ซ้ำโดยไม่มีแถวใหม่ -> ได้ตัวเดิมกลับมา
+    assert collaborative.refresh(session, fresh) is fresh
+
+
+def test_get_recommender_reloads_new_model_file(session, tmp_path, monkeypatch):
+    path = str(tmp_path / "cf.npz")
+    monkeypatch.setattr(collaborative, "CF_MODEL_PATH", path)
+    monkeypatch.setattr(collaborative, "RELOAD_CHECK_SECONDS", 0)
+    monkeypatch.setattr(collaborative, "_recommender", None)
+    monkeypatch.setattr(collaborative, "_recommender_mtime", None)
+    first = collaborative.get_recommender(session)
+    assert collaborative.get_recommender(session) is first
+
+    rec = collaborative.ALSRecommender(factors=8, iterations=3).fit([1, 2], [10, 20], [1, 1])
+    rec.save(path)
+    os.utime(path, ns=(0, collaborative._recommender_mtime + 1))
+    second = collaborative.get_recommender(session)
+    assert second is not first
+    np.testing.assert_array_equal(second.castle_ids, [10, 20])
+
+
+def test_save_load_keeps_watermarks(session, tmp_path):
+    rec = collaborative.train(session)
+    path = str(tmp_path / "cf.npz")
+    rec.save(path)
+    loaded = collaborative.ALSRecommender.load(path)
+    assert loaded.watermarks == rec.watermarks
+    assert loaded.recommend(2, k=5) == rec.recommend(2, k=5)
+
+
+def test_unknown_user_gets_popular_castles():
+    rec = collaborative.ALSRecommender(factors=8, iterations=3).fit([1, 1, 2, 3], [10, 20, 10, 10], [1, 1, 1, 1])
+    assert [c for c, _ in rec.recommend(99, k=2)] == [10, 20]
+    assert np.isfinite([score for _, score in rec.recommend(1, k=5)]).all()
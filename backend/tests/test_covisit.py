@@ -0,0 +1,93 @@
+import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import covisit
+import model
+from covisit import CoVisitGraph
+
+DAY = datetime.datetime(2025, 1, 1)
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'covisit.db'}")
+    model.Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all([model.User(user_id=i, username=f"u{i}", password="x", email=f"u{i}@example.com")
+                    for i in range(1, 4)])
+        db.add_all([model.Castle(castle_id=i, castle_name=f"castle {i}") for i in range(1, 9)])
+        db.commit()
+        yield db
+    engine.dispose()
+
+
+def _visit(db, user_id, castle_id, days):
+    db.add(model.VisitHistory(user_id=user_id, castle_id=castle_id, visit_date=DAY + datetime.timedelta(days=days)))
+
+
+def test_window_pairs_respect_steps_and_days():
+    groups = np.array([1, 1, 1, 2, 2])
+    nodes = np.array([0, 1, 2, 3, 4])
+    day = 86400
+    times = np.array([0, day, 30 * day, 0, day])
+    left, right, weights = covisit.window_pairs(groups, nodes, times, window=14 * day, steps=2)
+    # 1 -> 2 ห่างเกิน 14 วัน, ข้าม group ไม่นับ
+    assert sorted(zip(left.tolist(), right.tolist())) == [(0, 1), (3, 4)]
+    assert weights.tolist() == [1.0, 1.0]
+
+
+def test_also_visited_ranks_co_visited_castles(db):
+    for user_id in (1, 2):
+        for step, castle_id in enumerate((1, 2, 3)):
+            _visit(db, user_id, castle_id, step)
+    _visit(db, 3, 1, 0)
+    _visit(db, 3, 5, 1)
+    db.commit()
+    graph = covisit.build(db)
+    ranked = [castle_id for castle_id, _ in graph.also_visited(1, k=5)]
+    assert ranked[0] == 2 and set(ranked) == {2, 3, 5}
+    assert graph.also_visited(8) == []
+
+
+def test_refresh_adds_only_new_pairs(db, tmp_path):
+    _visit(db, 1, 1, 0)
+    _visit(db, 1, 2, 1)
+    db.commit()
+    graph = covisit.build(db)
+    before = graph.visits[graph._pos[1], graph._pos[2]]
+    _visit(db, 1, 3, 2)
+    db.commit()
+    assert covisit.refresh(db, graph) is graph
+    assert graph.watermarks["visit_id"] == 3
+    # คู่ 1-2 เดิมไม่ถูกนับซ้ำ; คู่ใหม่ที่แตะ visit ใหม่เท่านั้นที่เพิ่ม
+    assert graph.visits[graph._pos[1], graph._pos[2]] == before
+    assert graph.visits[graph._pos[2], graph._pos[3]] == 1.0
+    assert graph.visits[graph._pos[1], graph._pos[3]] == 0.5
+    rebuilt = covisit.build(db)
+    assert (abs(rebuilt.visits - graph.visits)).sum() == 0
+
+    path = str(tmp_path / "graph.npz")
+    graph.save(path)
+    loaded = CoVisitGraph.load(path)
+    assert loaded.watermarks == graph.watermarks and (abs(loaded.visits - graph.visits)).sum() == 0
+
+
+def test_suggest_routes_skips_existing_routes(db):
+    db.add(model.Route(route_id=1, route_name="existing"))
+    db.add_all([model.RouteCastle(route_id=1, castle_id=c, sequence_order=i) for i, c in enumerate((1, 2, 3))])
+    for user_id in (1, 2):
+        for step, castle_id in enumerate((5, 6, 7)):
+            _visit(db, user_id, castle_id, step)
+    db.commit()
+    graph = covisit.build(db)
+    suggestions = graph.suggest_routes(k=5, size=3)
+    assert suggestions
+    assert all(len(set(s["castle_ids"]) & {1, 2, 3}) < 2 for s in suggestions)
+    assert {5, 6, 7} in [set(s["castle_ids"]) for s in suggestions]
+    seeded = graph.suggest_routes(k=1, size=3, seed_castle=6)
+    assert seeded[0]["seed_castle_id"] == 6 and seeded[0]["castle_ids"][0] == 6
+    assert graph.suggest_routes(seed_castle=99) == []
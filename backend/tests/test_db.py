@@ -0,0 +1,42 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+import db
+import repository
+
+
+def test_async_url_picks_async_driver():
+    assert db.async_database_url("sqlite:///x.db").drivername == "sqlite+aiosqlite"
+    assert db.async_database_url("postgresql://u:p@h/d").drivername == "postgresql+asyncpg"
+    assert db.async_database_url("postgresql+asyncpg://u:p@h/d").drivername == "postgresql+asyncpg"
+
+
+def test_pool_status_does_not_create_engines(client, monkeypatch):
+    # worker ที่ยังไม่เคยใช้ async engine -> /db/pool ไม่สร้างให้
+    monkeypatch.delitem(vars(db), "async_engine", raising=False)
+    monkeypatch.delitem(vars(db), "AsyncSessionLocal", raising=False)
+    body = client.get("/db/pool").json()
+    assert set(body) == {"sync"}
+    assert "async_engine" not in vars(db)
+    assert body["sync"]["checkouts"] >= 1
+
+
+def test_async_repository_matches_sync(session):
+    expected = repository.get_castle_detail(session, 5)
+
+    async def load():
+        engine = create_async_engine(db.async_database_url(db.DATABASE_URL))
+        try:
+            async with AsyncSession(engine, expire_on_commit=False) as adb:
+                castle = await repository.get_castle_detail_async(adb, 5)
+                page = await repository.list_castles_page_async(adb, after=10, limit=5)
+                return castle, page
+        finally:
+            await engine.dispose()
+
+    castle, page = asyncio.run(load())
+    assert castle.castle_name == expected.castle_name
+    assert sorted(e.event_id for e in castle.events) == sorted(e.event_id for e in expected.events)
+    assert [c["castle_id"] for c in page["items"]] == [11, 12, 13, 14, 15]
+    assert page["next_cursor"] == 15
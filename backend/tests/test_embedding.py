@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import embedding
+import model
+
+ENCODER = embedding.HashingEncoder(model.TEXT_VECTOR_DIM)
+
+
+class Interrupt(Exception):
+    pass
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Own database: backfill rewrites every vector it touches."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'embed.db'}")
+    model.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([model.Castle(castle_id=i, castle_name=f"castle {i}", castle_description=f"moat {i}")
+                     for i in range(1, 11)])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _run(db, tmp_path, **kwargs):
+    return embedding.backfill(db, "castle", encoder=ENCODER, batch_size=3,
+                              checkpoint_path=str(tmp_path / "checkpoint.sqlite3"), **kwargs)
+
+
+def test_backfill_skips_unchanged_and_reembeds_edits(db, tmp_path):
+    assert _run(db, tmp_path).rows == 10
+    vectors = db.scalars(select(model.Castle.text_vector).order_by(model.Castle.castle_id)).all()
+    np.testing.assert_allclose(np.asarray(vectors[0]), ENCODER.encode(["castle 1 moat 1"])[0], rtol=1e-6)
+
+    again = _run(db, tmp_path)
+    assert (again.rows, again.skipped) == (0, 10)
+
+    db.get(model.Castle, 4).castle_description = "edited"
+    db.commit()
+    edited = _run(db, tmp_path)
+    assert (edited.rows, edited.skipped) == (1, 9)
+    np.testing.assert_allclose(np.asarray(db.get(model.Castle, 4).text_vector),
+                               ENCODER.encode(["castle 4 edited"])[0], rtol=1e-6)
+
+
+def test_backfill_resumes_after_interruption(db, tmp_path):
+    def stop_after_first_batch(stats):
+        raise Interrupt
+
+    with pytest.raises(Interrupt):
+        _run(db, tmp_path, progress=stop_after_first_batch)
+    resumed = _run(db, tmp_path)
+    # batch แรก (3 แถว) commit + checkpoint แล้ว -> ไม่ไล่ซ้ำ
+    assert (resumed.rows, resumed.skipped) == (7, 0)
+    assert db.scalars(select(model.Castle.castle_id).where(model.Castle.text_vector.is_(None))).all() == []
+
+
+def test_embed_texts_uses_cache(tmp_path):
+    cache = embedding.EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    try:
+        first, hits = embedding.embed_texts(["a", "b", "a"], ENCODER, cache)
+        assert hits == 0
+        second, hits = embedding.embed_texts(["b", "a", "c"], ENCODER, cache)
+        assert hits == 2
+        np.testing.assert_array_equal(second[:2], first[[1, 0]])
+    finally:
+        cache.close()
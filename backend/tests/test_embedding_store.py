@@ -0,0 +1,92 @@
+import types
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+import embedding_store
+import model
+import recommend
+from embedding_store import EmbeddingStore, StoreWriter
+from vector_index import normalize
+
+DIM = model.TEXT_VECTOR_DIM
+
+
+def _publish(folder, vectors_by_id, dim=DIM):
+    writer = StoreWriter(folder, dim, len(vectors_by_id))
+    ids = sorted(vectors_by_id)
+    writer.append(ids, np.stack([vectors_by_id[i] for i in ids]))
+    return writer.publish()
+
+
+def _vector(seed, dim=DIM):
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def test_store_rows_get_and_swap(tmp_path):
+    folder = str(tmp_path / "store")
+    _publish(folder, {1: _vector(1, 8), 3: _vector(3, 8), 5: _vector(5, 8)}, dim=8)
+    store = EmbeddingStore(folder)
+    assert store.rows([5, 2, 1]).tolist() == [2, -1, 0]
+    vectors, found = store.get([3, 4])
+    assert found.tolist() == [True, False]
+    np.testing.assert_allclose(vectors[0], normalize(_vector(3, 8)[None, :])[0], rtol=1e-6)
+    assert not vectors[1].any()
+
+    assert store.refresh(force=True) is False
+    _publish(folder, {2: _vector(2, 8)}, dim=8)
+    _publish(folder, {2: _vector(2, 8), 7: _vector(7, 8)}, dim=8)
+    assert store.refresh(force=True) is True
+    assert store.version == "v3.bin" and len(store) == 2
+    # เก็บไว้ 2 version ล่าสุด
+    assert sorted(p.name for p in (tmp_path / "store").glob("v*.bin")) == ["v2.bin", "v3.bin"]
+
+
+def test_writer_rejects_unsorted_ids(tmp_path):
+    writer = StoreWriter(str(tmp_path / "store"), 4, 4)
+    writer.append([1, 2], np.ones((2, 4)))
+    with pytest.raises(ValueError):
+        writer.append([2, 3], np.ones((2, 4)))
+
+
+def test_export_matches_database(session, tmp_path):
+    folder = str(tmp_path / "castle")
+    embedding_store.export(session, "castle", folder=folder, batch_size=7)
+    store = EmbeddingStore(folder)
+    rows = session.execute(select(model.Castle.castle_id, model.Castle.text_vector)
+                           .where(model.Castle.text_vector.isnot(None)).order_by(model.Castle.castle_id)).all()
+    assert store.ids.tolist() == [castle_id for castle_id, _ in rows]
+    expected = normalize(np.asarray([vector for _, vector in rows], dtype=np.float32))
+    np.testing.assert_allclose(store.vectors, expected, rtol=1e-5, atol=1e-6)
+
+
+@pytest.fixture
+def castle_store(tmp_path, monkeypatch):
+    """recommend's singleton state pointed at an empty store root in tmp_path."""
+    monkeypatch.setattr(embedding_store, "EMBEDDING_STORE_ROOT", str(tmp_path / "embeddings"))
+    monkeypatch.setattr(embedding_store, "RELOAD_CHECK_SECONDS", 0)
+    monkeypatch.setattr(recommend, "CASTLE_DELTA_PATH", str(tmp_path / "delta.npz"))
+    monkeypatch.setattr(recommend, "_castle_index", None)
+    monkeypatch.setattr(recommend, "_castle_store", None)
+    monkeypatch.setattr(recommend, "_castle_delta", {})
+    monkeypatch.setattr(recommend, "_castle_delta_dirty", False)
+    return embedding_store.store_path("castle")
+
+
+def test_runtime_insert_survives_store_swap(session, castle_store):
+    _publish(castle_store, {1: _vector(1), 2: _vector(2)})
+    assert len(recommend.get_castle_index(session)) == 2
+
+    new_vector = _vector(9001)
+    recommend.index_castle(session, types.SimpleNamespace(castle_id=9001, text_vector=new_vector))
+    _publish(castle_store, {1: _vector(1), 2: _vector(2), 3: _vector(3)})
+    index = recommend.get_castle_index(session)
+    # version ใหม่ยังไม่มี 9001 -> ใส่ delta ซ้ำ
+    assert len(index) == 4
+    np.testing.assert_allclose(index.get(9001), normalize(new_vector[None, :])[0], rtol=1e-5)
+
+    # export รอบถัดไปมี vector เดียวกันแล้ว -> ไม่ต้องเก็บใน delta ต่อ
+    _publish(castle_store, {1: _vector(1), 2: _vector(2), 3: _vector(3), 9001: new_vector})
+    assert len(recommend.get_castle_index(session)) == 4
+    assert recommend._castle_delta == {}
@@ -0,0 +1,62 @@
+import datetime
+
+import numpy as np
+
+from event_index import EventIndex
+
+
+##### EventIndex: overlap [start, end] แบบรวมขอบ
+
+BASE = datetime.datetime(2025, 1, 1)
+
+
+def _day(n, hours=0):
+    return BASE + datetime.timedelta(days=n, hours=hours)
+
+
+def _brute_overlapping(events, start, end, castle_ids=None):
+    return sorted(
+        (event_id for event_id, (castle_id, s, e) in events.items()
+         if s <= end and e >= start and (castle_ids is None or castle_id in castle_ids)),
+        key=lambda event_id: (events[event_id][1], event_id))
+
+
+def test_event_overlap_matches_brute_force():
+    rng = np.random.default_rng(0)
+    index = EventIndex(min_rebuild=10 ** 6)
+    rows = []
+    for event_id in range(1, 301):
+        start = _day(int(rng.integers(0, 120)), int(rng.integers(0, 24)))
+        rows.append((event_id, int(rng.integers(1, 30)), start, start + datetime.timedelta(hours=int(rng.integers(1, 200)))))
+    index.upsert(rows)
+    index.rebuild()
+    # delta: แก้ช่วงเวลา, ลบ, เพิ่มใหม่
+    index.upsert([(5, 3, _day(50), _day(52)), (1000, 7, _day(10), _day(11))])
+    index.remove([6, 7, 8])
+    events = {event_id: (castle_id, s, e) for event_id, castle_id, s, e in rows}
+    events[5] = (3, _day(50), _day(52))
+    events[1000] = (7, _day(10), _day(11))
+    for event_id in (6, 7, 8):
+        del events[event_id]
+
+    for start, end in [(_day(10), _day(11)), (_day(50), _day(50)), (_day(0), _day(200)), (_day(300), _day(301))]:
+        got = [row[0] for row in index.overlapping(start, end)]
+        assert sorted(got) == sorted(_brute_overlapping(events, start, end))
+        assert [events[event_id][1] for event_id in got] == sorted(events[event_id][1] for event_id in got)
+        wanted = {3, 7, 11}
+        got = [row[0] for row in index.overlapping(start, end, castle_ids=sorted(wanted))]
+        assert sorted(got) == sorted(_brute_overlapping(events, start, end, wanted))
+
+
+def test_event_touching_boundaries_and_open_end():
+    index = EventIndex()
+    index.upsert([
+        (1, 1, _day(1), _day(2)),
+        (2, 1, _day(2), _day(3)),
+        (3, 2, _day(5, 9), None),  # ไม่มีวันจบ -> ถึงสิ้นวันที่เริ่ม
+    ])
+    assert [row[0] for row in index.overlapping(_day(2), _day(2))] == [1, 2]
+    assert [row[0] for row in index.overlapping(_day(5, 23), _day(5, 23))] == [3]
+    assert index.overlapping(_day(6), _day(7)) == []
+    assert [row[0] for row in index.overlapping(_day(0), _day(10), limit=1)] == [1]
+    assert list(index.active_counts([1, 2, 9], _day(0), _day(10))) == [2, 1, 0]
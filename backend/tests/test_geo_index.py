@@ -0,0 +1,59 @@
+import numpy as np
+
+from geo_index import GeoIndex, haversine_km
+
+
+##### GeoIndex: ผลต้องตรงกับการไล่คำนวณทุกจุด ทั้งใน tree และ delta / หลังแก้ / ลบ
+
+def _points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(1, n + 1), rng.uniform(5.6, 20.5, n), rng.uniform(97.3, 105.7, n)
+
+
+def _brute_within(points, lat, lon, radius_km):
+    found = [(item_id, haversine_km(lat, lon, a, b)) for item_id, (a, b) in points.items()]
+    return sorted((item for item in found if item[1] <= radius_km), key=lambda item: item[1])
+
+
+def _check(index, points, lat, lon):
+    expected = _brute_within(points, lat, lon, 150.0)
+    got = index.within(lat, lon, 150.0)
+    assert [i for i, _ in got] == [i for i, _ in expected]
+    assert np.allclose([d for _, d in got], [d for _, d in expected])
+    nearest = sorted(((i, haversine_km(lat, lon, a, b)) for i, (a, b) in points.items()), key=lambda item: item[1])[:7]
+    assert [i for i, _ in index.nearest(lat, lon, k=7)] == [i for i, _ in nearest]
+
+
+def test_geo_index_matches_brute_force_with_delta():
+    ids, lats, lons = _points(400)
+    index = GeoIndex(min_rebuild=10 ** 6)  # ไม่ rebuild -> การแก้ทั้งหมดค้างใน delta / stale
+    index.upsert(ids, lats, lons)
+    index.rebuild()
+    points = dict(zip(ids.tolist(), zip(lats.tolist(), lons.tolist())))
+    # ย้ายจุด, ลบจุด, เพิ่มจุดใหม่
+    moved, new_lat, new_lon = ids[:30], lats[:30] + 0.5, lons[:30] - 0.5
+    index.upsert(moved, new_lat, new_lon)
+    points.update(zip(moved.tolist(), zip(new_lat.tolist(), new_lon.tolist())))
+    index.remove(ids[30:60].tolist())
+    for item_id in ids[30:60].tolist():
+        del points[item_id]
+    extra_ids, extra_lats, extra_lons = _points(20, seed=1)
+    extra_ids = extra_ids + 10000
+    index.upsert(extra_ids, extra_lats, extra_lons)
+    points.update(zip(extra_ids.tolist(), zip(extra_lats.tolist(), extra_lons.tolist())))
+
+    assert len(index) == len(points)
+    for lat, lon in [(14.0, 101.0), (8.0, 99.0), (18.5, 103.0)]:
+        _check(index, points, lat, lon)
+    index.rebuild()
+    _check(index, points, 14.0, 101.0)
+
+
+def test_geo_index_limits():
+    ids, lats, lons = _points(50)
+    index = GeoIndex()
+    index.upsert(ids, lats, lons)
+    assert index.nearest(14.0, 101.0, k=0) == []
+    assert len(index.nearest(14.0, 101.0, k=500)) == 50
+    assert index.within(14.0, 101.0, 5000.0, limit=0) == []
+    assert len(index.within(14.0, 101.0, 5000.0, limit=3)) == 3
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+import embedding
+import embedding_store
+import image_search
+import model
+
+
+def test_image_vector_has_a_single_writer():
+    # text backfill ห้ามเขียนทับ vector รูป / export ยังทำได้
+    assert "image" not in embedding.SOURCES
+    assert embedding_store.SOURCES["image"].vector_column == "image_vector"
+    with pytest.raises(KeyError):
+        embedding.backfill(None, "image")
+
+
+@pytest.fixture
+def fresh_searcher(monkeypatch):
+    monkeypatch.setattr(image_search, "_searcher", None)
+    monkeypatch.setattr(embedding_store, "RELOAD_CHECK_SECONDS", 0.0)
+    yield
+    image_search._searcher = None
+
+
+def _write_images(folder, contents):
+    os.makedirs(folder, exist_ok=True)
+    for img_id, data in contents.items():
+        with open(os.path.join(folder, f"{img_id}.jpg"), "wb") as f:
+            f.write(data)
+
+
+def _photo(seed):
+    return np.random.default_rng(seed).integers(0, 256, 4096, dtype=np.uint8).tobytes()
+
+
+def test_searcher_swaps_in_a_newly_published_store(session, tmp_path, fresh_searcher):
+    images = session.execute(select(model.Image.img_id, model.Image.castle_id).order_by(model.Image.img_id).limit(6)).all()
+    castle_of = dict(images)
+    photos = {img_id: _photo(img_id) for img_id, _ in images}
+    _write_images(str(tmp_path / "v1"), photos)
+    image_search.encode_folder(session, str(tmp_path / "v1"), image_search.StubImageEncoder())
+    embedding_store.export(session, "image")
+
+    searcher = image_search.get_image_searcher(session)
+    target = images[2][0]
+    assert searcher.search_castles(photos[target], k=1)[0][0] == castle_of[target]
+
+    # รูปใหม่ของ image เดิม -> export version ใหม่ -> worker ที่รันอยู่ต้องเห็นโดยไม่ restart
+    replacement = _photo(999)
+    _write_images(str(tmp_path / "v2"), {target: replacement})
+    image_search.encode_folder(session, str(tmp_path / "v2"), image_search.StubImageEncoder())
+    embedding_store.export(session, "image")
+
+    swapped = image_search.get_image_searcher(session)
+    assert swapped is not searcher
+    best = swapped.search_castles(replacement, k=1)[0]
+    assert best[0] == castle_of[target] and target in best[2]
+    assert image_search.get_image_searcher(session) is swapped
+
+
+def test_group_by_castle_keeps_best_score():
+    hits = [(1, 10, 0.5), (2, 20, 0.9), (3, 10, 0.95), (4, 0, 1.0)]
+    assert image_search.group_by_castle(hits, k=5) == [(10, 0.95, [1, 3]), (20, 0.9, [2])]
@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+import ingest
+
+SIZES = {"size": 60, "min_size": 24, "overlap": 8}
+
+
+def _document(seed=0, paragraphs=30):
+    rng = random.Random(seed)
+    words = ["castle", "stone", "khmer", "temple", "moat", "wall", "king", "era", "gate", "tower", "lintel", "laterite"]
+    out = []
+    for _ in range(paragraphs):
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(5, 14))).capitalize() + "."
+                     for _ in range(rng.randint(2, 6))]
+        out.append(" ".join(sentences) + "\n")
+    return out
+
+
+def _passages(blocks):
+    tokens = ingest.tokenize(blocks, ingest.ThaiSegmenter(engine="dict"))
+    return [ingest.passage_text(p) for p in ingest.split_passages(tokens, **SIZES)]
+
+
+def test_passages_are_deterministic_and_bounded():
+    blocks = _document()
+    first, second = _passages(blocks), _passages(blocks)
+    assert first == second
+    assert len(first) > 10
+    tokens = list(ingest.tokenize(blocks, ingest.ThaiSegmenter(engine="dict")))
+    for passage in ingest.split_passages(tokens, **SIZES):
+        assert len(passage) <= SIZES["size"]
+
+
+def test_edit_only_changes_nearby_passages():
+    blocks = _document()
+    before = _passages(blocks)
+    edited = list(blocks)
+    edited[15] = edited[15].replace(".", ". Newly inserted sentence about a hidden gate.", 1)
+    after = _passages(edited)
+    changed = set(before) - set(after)
+    # passage ที่ไม่ได้แตะส่วนที่แก้ต้องเหมือนเดิมทุกตัวอักษร
+    assert 0 < len(changed) <= 3
+    assert len(set(before) & set(after)) >= len(before) - 3
+
+
+def test_split_rejects_bad_sizes():
+    with pytest.raises(ValueError):
+        list(ingest.split_passages([], size=10, min_size=20, overlap=5))
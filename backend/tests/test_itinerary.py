@@ -0,0 +1,72 @@
+import datetime
+
+import numpy as np
+import pytest
+from sqlalchemy import delete, select
+
+import itinerary
+import model
+
+ROUTE_CASTLES = [21, 5, 33, 14, 9]
+
+
+@pytest.fixture
+def plan(session):
+    route = model.Route(route_name="itinerary test")
+    session.add(route)
+    session.flush()
+    session.add_all([model.RouteCastle(route_id=route.route_id, castle_id=c, sequence_order=i)
+                     for i, c in enumerate(ROUTE_CASTLES)])
+    plan = model.TripPlan(user_id=1, route_id=route.route_id, plan_name="test trip",
+                          start_date=datetime.datetime(2030, 1, 1, 9), end_date=datetime.datetime(2030, 1, 3, 18))
+    session.add(plan)
+    session.commit()
+    yield plan
+    session.execute(delete(model.TripItinerary).where(model.TripItinerary.plan_id == plan.plan_id))
+    session.execute(delete(model.TripPlan).where(model.TripPlan.plan_id == plan.plan_id))
+    session.execute(delete(model.RouteCastle).where(model.RouteCastle.route_id == route.route_id))
+    session.execute(delete(model.Route).where(model.Route.route_id == route.route_id))
+    session.commit()
+
+
+def _route_order(session, route_id):
+    return session.scalars(select(model.RouteCastle.castle_id).where(model.RouteCastle.route_id == route_id)
+                           .order_by(model.RouteCastle.sequence_order)).all()
+
+
+def test_solve_orders_points_on_a_line():
+    positions = np.array([0.0, 30.0, 10.0, 20.0, 40.0])
+    travel = np.abs(positions[:, None] - positions[None, :])
+    order, begins, total, late = itinerary.solve(travel, 5.0)
+    assert order.tolist() == [0, 2, 3, 1, 4]
+    assert late == 0 and np.all(np.diff(begins) > 0)
+
+
+def test_solve_respects_time_window():
+    positions = np.array([0.0, 10.0, 20.0, 30.0])
+    travel = np.abs(positions[:, None] - positions[None, :])
+    # stop 1 เปิดหลัง stop อื่นทั้งหมด -> ต้องไปเป็นที่สุดท้าย
+    window_start = [0.0, 1000.0, 0.0, 0.0]
+    order, begins, _, late = itinerary.solve(travel, 0.0, window_start=window_start)
+    assert order.tolist()[-1] == 1 and begins[-1] >= 1000.0 and late == 0
+
+
+def test_itinerary_keeps_route_order(client, session, plan):
+    response = client.post(f"/trip-plans/{plan.plan_id}/itinerary", json={"time_budget_ms": 50})
+    assert response.status_code == 200
+    rows = response.json()
+    assert rows[0]["castle_id"] == ROUTE_CASTLES[0]
+    assert sorted(r["castle_id"] for r in rows) == sorted(ROUTE_CASTLES)
+    starts = [r["start_time"] for r in rows]
+    assert starts == sorted(starts)
+    # route ใช้ร่วมกับ plan อื่น -> ลำดับใน RouteCastle ต้องไม่เปลี่ยน
+    session.expire_all()
+    assert _route_order(session, plan.route_id) == ROUTE_CASTLES
+
+
+def test_itinerary_validation(client, plan):
+    url = f"/trip-plans/{plan.plan_id}/itinerary"
+    assert client.post(url, json={"castle_ids": list(range(1, itinerary.MAX_STOPS + 2))}).status_code == 422
+    assert client.post(url, json={"time_budget_ms": 60_000}).status_code == 422
+    assert client.post(url, json={"castle_ids": [1, 999999]}).status_code == 422
+    assert client.post("/trip-plans/999999/itinerary", json={}).status_code == 404
@@ -0,0 +1,33 @@
+import pytest
+
+import db
+from cache import response_cache
+from query_count import assert_max_queries
+
+
+### list endpoint (lean path): query เดียวต่อหน้า ไม่ขึ้นกับขนาดหน้า + keyset cursor
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    response_cache.local.clear()
+
+
+@pytest.mark.parametrize("path", ["/castles", "/events", "/images", "/nearby-places"])
+@pytest.mark.parametrize("limit", [1, 50])
+def test_list_endpoints_use_one_query(client, path, limit):
+    with assert_max_queries(db.get_async_engine(), 1):
+        response = client.get(path, params={"limit": limit})
+    assert response.status_code == 200
+    assert len(response.json()["items"]) <= limit
+
+
+def test_castle_pages_follow_the_cursor(client):
+    first = client.get("/castles", params={"limit": 7}).json()
+    second = client.get("/castles", params={"limit": 7, "after": first["next_cursor"]}).json()
+    ids = [c["castle_id"] for c in first["items"] + second["items"]]
+    assert ids == sorted(ids) and len(set(ids)) == 14
+
+
+def test_page_size_is_validated(client):
+    assert client.get("/castles", params={"limit": 0}).status_code == 422
+    assert client.get("/castles", params={"limit": 100000}).status_code == 422
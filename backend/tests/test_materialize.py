@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+from sqlalchemy import func, select
+
+import collaborative
+import materialize
+import model
+
+
+@pytest.fixture
+def new_rows(session):
+    added = []
+    yield added
+    for obj in reversed(added):
+        session.delete(obj)
+    session.commit()
+
+
+def _unseen_castle(session, user_id):
+    seen = select(model.VisitHistory.castle_id).where(model.VisitHistory.user_id == user_id)
+    return session.scalar(select(func.min(model.Castle.castle_id)).where(model.Castle.castle_id.not_in(seen)))
+
+
+def test_late_rows_with_old_timestamps_are_picked_up(session, new_rows):
+    watermarks = materialize.current_watermarks(session)
+    assert materialize.changed_users(session, watermarks).size == 0
+
+    # activity_log เขียนช้า / visit_date จาก client -> เวลาเก่ากว่าแถวล่าสุด แต่ id ใหม่กว่า
+    old = datetime.datetime(2001, 1, 1)
+    rows = [
+        model.VisitHistory(user_id=2, castle_id=_unseen_castle(session, 2), visit_date=old),
+        model.SearchHistory(user_id=3, query_text="moat", search_time=old),
+    ]
+    session.add_all(rows)
+    session.commit()
+    new_rows.extend(rows)
+
+    assert materialize.changed_users(session, watermarks).tolist() == [2, 3]
+    after = materialize.current_watermarks(session)
+    assert after["visit_id"] == rows[0].visit_id and after["search_id"] == rows[1].search_id
+    assert materialize.changed_users(session, after).size == 0
+
+
+def test_incremental_run_recomputes_late_visitor(session, new_rows, tmp_path, monkeypatch):
+    monkeypatch.setattr(collaborative, "CF_MODEL_PATH", str(tmp_path / "cf_als.npz"))
+    path = str(tmp_path / "user_recs")
+    materialize.run(session, path=path, full=True, workers=1, progress=None)
+    castle_id = materialize.MaterializedRecommendations(path).lookup(4, k=1)[0][0]
+
+    visit = model.VisitHistory(user_id=4, castle_id=castle_id, visit_date=datetime.datetime(2001, 1, 1))
+    session.add(visit)
+    session.commit()
+    new_rows.append(visit)
+
+    materialize.run(session, path=path, workers=1, progress=None)
+    meta = materialize.read_meta(path)
+    assert meta["watermarks"]["visit_id"] == visit.visit_id
+    assert castle_id not in [c for c, _ in materialize.MaterializedRecommendations(path).lookup(4, k=50)]
@@ -0,0 +1,54 @@
+import re
+
+import metrics
+from metrics import Histogram
+
+
+def _sample(body, name, **labels):
+    """Value of one sample line in a Prometheus text body (None when absent)."""
+    wanted = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    for line in body.splitlines():
+        match = re.match(rf"^{re.escape(name)}(?:\{{(.*)\}})? (\S+)$", line)
+        if match and (match.group(1) or "") == wanted:
+            return float(match.group(2))
+    return None
+
+
+def test_histogram_is_cumulative():
+    histogram = Histogram("h", "test", ("route",), (0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(("/x",), value)
+    body = "\n".join(histogram.render())
+    assert [_sample(body, "h_bucket", route="/x", le=le) for le in ("0.1", "1.0", "+Inf")] == [1, 3, 4]
+    assert _sample(body, "h_count", route="/x") == 4
+    assert _sample(body, "h_sum", route="/x") == 6.05
+
+
+def test_requests_are_labelled_by_route_template(client):
+    before = _sample(client.get("/metrics").text, "http_request_duration_seconds_count",
+                     method="GET", route="/castles/{castle_id}", status="200") or 0
+    for castle_id in (1, 2, 3):
+        response = client.get(f"/castles/{castle_id}", headers={"Cache-Control": "no-cache"})
+        assert "server-timing" in response.headers
+    body = client.get("/metrics").text
+    assert _sample(body, "http_request_duration_seconds_count",
+                   method="GET", route="/castles/{castle_id}", status="200") == before + 3
+    # path จริงต้องไม่กลายเป็น label
+    assert 'route="/castles/1"' not in body
+    assert _sample(body, "db_queries_total") > 0
+    assert _sample(body, "app_ready") == 1
+
+
+def test_sql_count_follows_the_request(client):
+    response = client.get("/castles", params={"limit": 5})
+    timing = response.headers["server-timing"]
+    queries = int(re.search(r'desc="(\d+) queries"', timing).group(1))
+    assert queries == 1
+    body = client.get("/metrics").text
+    assert _sample(body, "http_request_sql_queries_bucket", method="GET", route="/castles", le="1") >= 1
+
+
+def test_render_without_engines_or_cache():
+    body = metrics.render()
+    assert "db_pool_checkouts_total" not in body and "cache_hit_ratio" not in body
+    assert body.endswith("\n")
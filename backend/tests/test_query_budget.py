@@ -0,0 +1,40 @@
+import pytest
+
+import db
+import repository
+from cache import response_cache
+from query_count import assert_max_queries, count_queries
+
+
+### N+1: castle detail ต้องใช้ query จำนวนคงที่ ไม่ขึ้นกับจำนวนแถวของ relationship
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    response_cache.local.clear()
+
+
+def test_castle_detail_budget(client):
+    # castle + type + location (JOIN) แล้ว selectinload ทีละ relationship: architectures, images, events, nearby_places
+    with assert_max_queries(db.get_async_engine(), 5):
+        response = client.get("/castles/3")
+    assert response.status_code == 200
+    assert response.json()["images"]
+
+
+def test_castle_detail_cached_hit_skips_db(client):
+    client.get("/castles/4")
+    with assert_max_queries(db.get_async_engine(), 0):
+        response = client.get("/castles/4")
+    assert response.headers["X-Cache"] == "HIT"
+
+
+def test_sync_repository_budget(session):
+    with count_queries(session.get_bind()) as small:
+        repository.list_castles(session, limit=2)
+    with count_queries(session.get_bind()) as large:
+        castles = repository.list_castles(session, limit=40)
+    assert small.count == large.count
+    with assert_max_queries(session.get_bind(), 5):
+        castle = repository.get_castle_detail(session, 5)
+        assert castle.location is not None
+        assert [image.castle_id for image in castle.images] == [5] * len(castle.images)
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from sqlalchemy import func, select
+
+import model
+import rerank
+from activity_log import activity_log
+
+
+def test_reload_does_not_double_count_popularity(session, monkeypatch):
+    db_counts = dict(session.execute(
+        select(model.VisitHistory.castle_id, func.count()).group_by(model.VisitHistory.castle_id)).all())
+    top = max(db_counts, key=db_counts.get)
+    # visit ที่ activity_log นับไว้แล้ว flush ลง DB แล้ว -> อยู่ใน db_counts แล้ว
+    monkeypatch.setattr(activity_log, "visit_counts", {castle_id: 50 for castle_id in db_counts})
+
+    first = rerank.CastleCatalog().load(session)
+    second = rerank.CastleCatalog().load(session)
+    np.testing.assert_array_equal(first.popularity, second.popularity)
+    counts = np.array([db_counts.get(c, 0) for c in first.castle_ids.tolist()], dtype=np.float32)
+    np.testing.assert_allclose(first.popularity, np.log1p(counts) / np.log1p(counts).max(), rtol=1e-6)
+    assert first.popularity[first.rows([top])[0]] == pytest.approx(1.0)
+
+
+def test_rank_drops_seen_and_explains(session):
+    catalog = rerank.CastleCatalog().load(session)
+    context = rerank.UserContext.for_user(session, catalog, None, 1)
+    candidates = [(castle_id, 1.0 / (i + 1)) for i, castle_id in enumerate(catalog.castle_ids.tolist())]
+    ranked = rerank.Reranker(catalog).rank(candidates, context, k=5, diversity=0.0)
+    assert len(ranked) == 5
+    assert not set(c for c, *_ in ranked) & set(context.seen.tolist())
+    assert [s for _, s, _, _ in ranked] == sorted((s for _, s, _, _ in ranked), reverse=True)
+    assert all(set(contributions) <= set(rerank.FEATURES) for _, _, contributions, _ in ranked)
+
+
+def test_parse_weights_rejects_unknown_feature():
+    assert rerank.parse_weights("content=2, distance=0")["content"] == 2.0
+    with pytest.raises(ValueError):
+        rerank.parse_weights("stars=1")
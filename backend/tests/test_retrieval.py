@@ -0,0 +1,75 @@
+import numpy as np
+
+import model
+from embedding import HashingEncoder
+from retrieval import RRF_K, HybridSearcher, KeywordIndex
+
+
+##### BM25
+
+def _keyword_index(links, vocab=()):
+    index = KeywordIndex()
+    index.add_keywords(vocab)
+    index.add(links)
+    return index
+
+
+def test_bm25_rare_term_ranks_higher():
+    # keyword 1 อยู่ในทุก place / keyword 2 อยู่ใน place 3 เท่านั้น
+    index = _keyword_index([(1, 1), (2, 1), (3, 1), (4, 1), (3, 2), (1, 3), (2, 3)])
+    ids, scores = index.search([1, 2], k=10)
+    assert ids[0] == 3
+    assert np.all(np.diff(scores) <= 0)
+    assert set(ids.tolist()) == {1, 2, 3, 4}
+
+
+def test_bm25_shorter_document_wins_on_same_term():
+    # place 1 มี keyword 1 อย่างเดียว / place 2 มี keyword 1 + อีก 4 คำ
+    index = _keyword_index([(1, 1), (2, 1), (2, 2), (2, 3), (2, 4), (2, 5)])
+    ids, _ = index.search([1], k=10)
+    assert ids.tolist() == [1, 2]
+
+
+def test_bm25_pending_links_and_top_k():
+    index = _keyword_index([(place_id, 1) for place_id in range(1, 21)], [(1, "moat")])
+    # link ที่เพิ่มทีหลังรวมเข้า postings ตอน query / place 21 ยาวกว่า -> คะแนนต่ำสุด
+    index.add([(21, 1), (21, 2)])
+    ids, scores = index.search(index.parse("Moat"), k=21)
+    assert len(ids) == 21 and ids[-1] == 21 and scores[-1] < scores[0]
+    assert len(index.search([1], k=5)[0]) == 5
+    assert index.search([99], k=5)[0].size == 0
+
+
+def test_parse_thai_longest_match():
+    index = KeywordIndex()
+    index.add_keywords([(1, "ปราสาท"), (2, "ปราสาทหิน"), (3, "พนมรุ้ง")])
+    assert index.parse("ปราสาทหินพนมรุ้ง") == [2, 3]
+
+
+##### RRF: hybrid ใช้ HashingEncoder (deterministic) แทน model จริง
+
+def _searcher():
+    encoder = HashingEncoder(model.DOCUMENT_VECTOR_DIM)
+    searcher = HybridSearcher(encoder=encoder)
+    texts = {1: "khmer sandstone temple", 2: "moat and laterite wall", 3: "khmer moat temple", 4: "wooden palace"}
+    searcher.keywords.add_keywords([(1, "khmer"), (2, "moat"), (3, "palace")])
+    searcher.keywords.add([(1, 1), (3, 1), (2, 2), (3, 2), (4, 3)])
+    ids = list(texts)
+    searcher.vectors.add(ids, encoder.encode([texts[i] for i in ids]))
+    return searcher
+
+
+def test_rrf_fuses_both_rankers():
+    hits = _searcher().search("khmer moat", k=4)
+    assert hits[0]["place_id"] == 3
+    assert hits[0]["keyword_score"] is not None and hits[0]["vector_score"] is not None
+    scores = [hit["score"] for hit in hits]
+    assert scores == sorted(scores, reverse=True)
+    # อันดับ 1 ของทั้งสองฝั่ง = 2 / (RRF_K + 1)
+    assert abs(hits[0]["score"] - 2.0 / (RRF_K + 1)) < 1e-9
+
+
+def test_rrf_vector_only_hit_when_no_keyword_matches():
+    hits = _searcher().search("wooden", k=2)
+    assert hits[0]["place_id"] == 4
+    assert hits[0]["keyword_score"] is None
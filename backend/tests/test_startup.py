@@ -0,0 +1,76 @@
+import contextlib
+import sys
+import threading
+
+import pytest
+
+import geo_index
+from startup import FAILED, READY, Startup, Warming, building, lazy_import, request_path
+
+
+def test_building_raises_on_request_path_only():
+    lock = threading.Lock()
+    lock.acquire()
+    try:
+        with pytest.raises(Warming):
+            with request_path():
+                with building(lock, "thing"):
+                    pass
+    finally:
+        lock.release()
+    # ไม่ได้อยู่ใน request (warm-up / CLI) -> รอจน lock ว่าง
+    entered = threading.Event()
+
+    def warm():
+        with building(lock, "thing"):
+            entered.set()
+
+    lock.acquire()
+    worker = threading.Thread(target=warm)
+    worker.start()
+    assert not entered.wait(0.05)
+    lock.release()
+    worker.join(5)
+    assert entered.is_set() and not lock.locked()
+
+
+def test_warm_continues_after_failure():
+    startup = Startup()
+    loaded = []
+
+    def broken(db):
+        raise RuntimeError("boom")
+
+    def ok(db):
+        with startup.timed("ok"):
+            loaded.append(db)
+
+    startup.register("broken", broken)
+    startup.register("ok", ok)
+    startup.warm(lambda: contextlib.nullcontext("session"))
+    snapshot = startup.snapshot()
+    assert loaded == ["session"]
+    assert snapshot["ready"] and snapshot["status"] == "degraded"
+    assert snapshot["components"]["broken"]["state"] == FAILED
+    assert "boom" in snapshot["components"]["broken"]["error"]
+    assert snapshot["components"]["ok"]["state"] == READY and snapshot["components"]["ok"]["loads"] == 1
+
+
+def test_lazy_import_defers_the_import():
+    sys.modules.pop("colorsys", None)
+    module = lazy_import("colorsys")
+    assert not module.loaded and "colorsys" not in sys.modules
+    assert module.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert module.loaded
+
+
+def test_request_answers_503_while_index_is_building(client, monkeypatch):
+    monkeypatch.setattr(geo_index, "_castle_index", None)
+    lock = threading.Lock()
+    monkeypatch.setattr(geo_index, "_castle_index_lock", lock)
+    with lock:
+        response = client.get("/castles/nearest", params={"lat": 15.0, "lon": 103.0})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    # build เสร็จ (lock ว่าง) -> request สร้างเองได้
+    assert client.get("/castles/nearest", params={"lat": 15.0, "lon": 103.0}).status_code == 200
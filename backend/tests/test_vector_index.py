@@ -0,0 +1,68 @@
+import numpy as np
+
+from vector_index import VectorIndex, normalize
+
+
+def _clustered(n, dim, clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    points = centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim))
+    return normalize(points)
+
+
+def _exact_top(vectors, query, k):
+    scores = vectors @ normalize(query)[0]
+    return np.argsort(-scores)[:k]
+
+
+def test_exact_search_matches_brute_force():
+    vectors = _clustered(500, 32, 8)
+    index = VectorIndex(32)
+    index.add(np.arange(500) + 1, vectors)
+    assert not index.uses_ivf
+    for query in vectors[:20]:
+        ids = [item_id for item_id, _ in index.search(query, k=10)]
+        assert ids == (_exact_top(vectors, query, 10) + 1).tolist()
+
+
+def test_ivf_recall_against_exact():
+    vectors = _clustered(4000, 32, 40, seed=1)
+    ids = np.arange(4000) + 1
+    exact = VectorIndex(32, exact_limit=10 ** 9)
+    exact.add(ids, vectors)
+    ivf = VectorIndex(32, exact_limit=1000, nprobe=8)
+    ivf.add(ids, vectors)
+    assert ivf.uses_ivf and not exact.uses_ivf
+    queries = _clustered(50, 32, 40, seed=2)
+    hits = 0
+    for query in queries:
+        truth = {item_id for item_id, _ in exact.search(query, k=10)}
+        hits += len(truth & {item_id for item_id, _ in ivf.search(query, k=10)})
+    assert hits / (10 * len(queries)) >= 0.9
+
+
+def test_add_replaces_existing_id_and_exclude():
+    index = VectorIndex(4)
+    index.add([1, 2, 3], np.eye(4, dtype=np.float32)[:3])
+    index.add([2], np.array([[1.0, 0.0, 0.0, 0.0]], dtype=np.float32))
+    assert len(index) == 3
+    assert [item_id for item_id, _ in index.search([1, 0, 0, 0], k=2)] in ([1, 2], [2, 1])
+    assert [item_id for item_id, _ in index.search([1, 0, 0, 0], k=2, exclude=[1])][0] == 2
+
+
+def test_non_positive_k_returns_nothing():
+    index = VectorIndex(4)
+    assert index.search([1, 0, 0, 0], k=5) == []
+    index.add([1], np.ones((1, 4), dtype=np.float32))
+    assert index.search([1, 0, 0, 0], k=0) == []
+
+
+def test_save_load_round_trip(tmp_path):
+    vectors = _clustered(1500, 16, 10)
+    index = VectorIndex(16, exact_limit=500)
+    index.add(np.arange(1500) + 1, vectors)
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    loaded = VectorIndex.load(path, exact_limit=500)
+    assert loaded.uses_ivf
+    assert loaded.search(vectors[7], k=5) == index.search(vectors[7], k=5)
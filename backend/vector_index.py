@@ -0,0 +1,281 @@
+import os
+import threading
+
+import numpy as np
+
+
+### In-process ANN index (cosine)
+# เก็บ vector ทั้งหมดเป็น float32 matrix ต่อเนื่องกัน (normalized แล้ว) -> cosine = dot product
+# catalog เล็ก: brute-force (exact) / catalog ใหญ่: IVF (k-means coarse quantizer + inverted lists)
+
+EXACT_SEARCH_LIMIT = int(os.getenv("ANN_EXACT_SEARCH_LIMIT", "20000"))
+DEFAULT_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+
+
+def normalize(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, k):
+    if k >= scores.shape[0]:
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+def _spherical_kmeans(data, n_clusters, n_iter=10, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(data.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        present = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+        sums[present] = np.add.reduceat(data[order], starts, axis=0)
+        empty = ~present
+        # cluster ว่าง -> สุ่มจุดใหม่แทน
+        sums[empty] = data[rng.choice(data.shape[0], int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """Top-k cosine search over (id, vector) pairs with incremental inserts."""
+
+    def __init__(self, dim, exact_limit=EXACT_SEARCH_LIMIT, nprobe=DEFAULT_NPROBE):
+        self.dim = dim
+        self.exact_limit = exact_limit
+        self.nprobe = nprobe
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._positions = {}
+        self._centroids = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._lists = []
+        self._lock = threading.RLock()
+        self.dirty = False
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, item_id):
+        return int(item_id) in self._positions
+
+    @property
+    def uses_ivf(self):
+        return self._centroids is not None
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = self._vectors.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:self._size] = self._assign[:self._size]
+        self._vectors, self._ids, self._assign = vectors, ids, assign
+
+    def _make_writable(self):
+        # index จาก from_arrays อาจชี้ไปที่ mmap read-only -> copy ตอนเขียนครั้งแรก
+        if not self._vectors.flags.writeable or not self._ids.flags.writeable:
+            self._vectors = np.array(self._vectors, dtype=np.float32)
+            self._ids = np.array(self._ids, dtype=np.int64)
+
+    def add(self, ids, vectors):
+        """Insert or replace vectors; existing ids are overwritten in place."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        vectors = normalize(vectors)
+        if vectors.shape != (ids.shape[0], self.dim):
+            raise ValueError(f"expected {ids.shape[0]} vectors of dim {self.dim}, got {vectors.shape}")
+        with self._lock:
+            self._make_writable()
+            self._reserve(ids.shape[0])
+            rows = np.empty(ids.shape[0], dtype=np.int64)
+            for i, item_id in enumerate(ids.tolist()):
+                row = self._positions.get(item_id)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._positions[item_id] = row
+                    self._ids[row] = item_id
+                rows[i] = row
+            self._vectors[rows] = vectors
+            if self.uses_ivf:
+                self._assign_rows(rows)
+            elif self._size > self.exact_limit:
+                self.build_ivf()
+            self.dirty = True
+
+    def _assign_rows(self, rows):
+        new_assign = np.argmax(self._vectors[rows] @ self._centroids.T, axis=1).astype(np.int32)
+        for row, old, new in zip(rows.tolist(), self._assign[rows].tolist(), new_assign.tolist()):
+            if old == new:
+                continue
+            if old >= 0:
+                self._lists[old] = self._lists[old][self._lists[old] != row]
+            self._lists[new] = np.append(self._lists[new], np.int64(row))
+            self._assign[row] = new
+
+    def build_ivf(self, n_lists=None, points_per_list=64):
+        """(Re)train the coarse quantizer and rebuild every inverted list."""
+        with self._lock:
+            n = self._size
+            if n == 0:
+                return
+            n_lists = min(n_lists or max(1, int(np.sqrt(n))), n)
+            data = self._vectors[:n]
+            # train k-means บน sample พอ (~64 จุดต่อ list) ไม่ต้องใช้ทั้ง catalog
+            sample_size = n_lists * points_per_list
+            if n > sample_size:
+                sample = data[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+            else:
+                sample = data
+            self._centroids = _spherical_kmeans(sample, n_lists)
+            assign = np.empty(n, dtype=np.int32)
+            # assign เป็น chunk เพื่อไม่ให้ matrix score ใหญ่เกินไป
+            for start in range(0, n, 65536):
+                block = data[start:start + 65536]
+                assign[start:start + 65536] = np.argmax(block @ self._centroids.T, axis=1)
+            self._assign[:n] = assign
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(n_lists)]
+
+    def get(self, item_id):
+        with self._lock:
+            row = self._positions.get(int(item_id))
+            return None if row is None else self._vectors[row].copy()
+
+    def rows_of(self, ids):
+        """Row of each id in this index (-1 when missing); rows stay valid until the index is replaced."""
+        with self._lock:
+            return np.array([self._positions.get(item_id, -1) for item_id in np.asarray(ids).tolist()], dtype=np.int64)
+
+    def get_many(self, ids):
+        """(vectors, found) for ``ids``; missing ids get zero vectors."""
+        rows = self.rows_of(ids)
+        found = rows >= 0
+        out = np.zeros((rows.shape[0], self.dim), dtype=np.float32)
+        with self._lock:
+            out[found] = self._vectors[rows[found]]
+        return out, found
+
+    def dot_rows(self, rows, query, chunk=256):
+        """normalized(query) . vector for each of ``rows`` (NaN where row < 0).
+
+        Gathers in small chunks so the copy stays in cache instead of
+        materializing a (len(rows) x dim) matrix.
+        """
+        query = normalize(query)[0]
+        out = np.full(rows.shape[0], np.nan, dtype=np.float32)
+        valid = np.flatnonzero(rows >= 0)
+        with self._lock:
+            for start in range(0, valid.shape[0], chunk):
+                part = valid[start:start + chunk]
+                out[part] = self._vectors[rows[part]] @ query
+        return out
+
+    def snapshot(self):
+        """Copies of (ids, normalized vectors) for batch jobs."""
+        with self._lock:
+            return self._ids[:self._size].copy(), self._vectors[:self._size].copy()
+
+    def search(self, query, k=10, exclude=None, nprobe=None):
+        """Return up to ``k`` (id, cosine score) pairs, best first."""
+        query = normalize(query)[0]
+        exclude = set() if exclude is None else {int(e) for e in exclude}
+        with self._lock:
+            n = self._size
+            if n == 0 or k <= 0:
+                return []
+            want = k + len(exclude)
+            if self.uses_ivf:
+                probe = min(nprobe or self.nprobe, len(self._lists))
+                lists = _top_k(self._centroids @ query, probe)
+                rows = np.concatenate([self._lists[i] for i in lists])
+                scores = self._vectors[rows] @ query
+            else:
+                rows = None
+                scores = self._vectors[:n] @ query
+            best = _top_k(scores, want)
+            if rows is not None:
+                best_rows = rows[best]
+            else:
+                best_rows = best
+            ids = self._ids[best_rows]
+            results = []
+            for item_id, score in zip(ids.tolist(), scores[best].tolist()):
+                if item_id in exclude:
+                    continue
+                results.append((item_id, score))
+                if len(results) == k:
+                    break
+            return results
+
+    def save(self, path):
+        """Write the index atomically (temp file + rename)."""
+        with self._lock:
+            n = self._size
+            arrays = {
+                "dim": np.array(self.dim),
+                "ids": self._ids[:n],
+                "vectors": self._vectors[:n],
+                "assign": self._assign[:n],
+            }
+            if self.uses_ivf:
+                arrays["centroids"] = self._centroids
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    @classmethod
+    def from_arrays(cls, ids, vectors, **kwargs):
+        """Wrap already-normalized arrays (e.g. a read-only mmap) without copying them."""
+        index = cls(vectors.shape[1], **kwargs)
+        n = ids.shape[0]
+        index._ids = ids
+        index._vectors = vectors
+        index._assign = np.full(n, -1, dtype=np.int32)
+        index._size = n
+        index._positions = {item_id: row for row, item_id in enumerate(np.asarray(ids).tolist())}
+        if n > index.exact_limit:
+            index.build_ivf()
+        return index
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path) as data:
+            index = cls(int(data["dim"]), **kwargs)
+            ids = data["ids"]
+            n = ids.shape[0]
+            index._reserve(n)
+            index._ids[:n] = ids
+            index._vectors[:n] = data["vectors"]
+            index._size = n
+            index._positions = {item_id: row for row, item_id in enumerate(ids.tolist())}
+            if "centroids" in data:
+                index._centroids = data["centroids"]
+                assign = data["assign"]
+                index._assign[:n] = assign
+                n_lists = index._centroids.shape[0]
+                order = np.argsort(assign, kind="stable")
+                bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+                index._lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(n_lists)]
+        return index